@@ -1,15 +1,60 @@
 # facial_feature_extractor/analysis.py
 import os
+import cv2
 import dlib
 import logging
-from .utils import load_image
-from .detection import detect_faces, get_best_face
-from .landmarks import get_landmarks, align_face_chip, extract_landmark_points
+import numpy as np
+from .utils import load_image_capped, read_image_bytes, decode_image_capped
+from .detection import (detect_faces, detect_faces_adaptive, detect_faces_in_region, get_best_face,
+                        choose_detection_scale)
+from .landmarks import (get_landmarks, get_landmarks_batch, align_face_chip, align_face_chip_affine,
+                        compute_face_chip_transform, extract_landmark_points, build_landmarks_object,
+                        load_shape_predictor)
 from .enhancement import apply_optional_enhancements
-from .features import calculate_all_features, ALL_FEATURE_NAMES
+from .features import (calculate_features, calculate_features_batch,
+                       resolve_feature_dependencies, ALL_FEATURE_NAMES)
+from .cache import ResultCache, hash_bytes, hash_config, hash_file
+from .metrics import StageTimer
+from .quality import compute_quality_metrics, check_quality
+from .video import LandmarkTracker, iter_video_frames, get_video_fps, summarize_frame_sequence
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# --- Result Profiles ---
+# Controls how much data `process_image` returns. Lighter profiles skip the alignment and
+# enhancement stages and keep large arrays out of the result (e.g. when it is pickled
+# back from a worker process).
+RESULT_PROFILE_FEATURES = 'features'    # status, face_area and features only
+RESULT_PROFILE_LANDMARKS = 'landmarks'  # ... plus the 68 landmark points
+RESULT_PROFILE_FULL = 'full'            # ... plus the aligned and enhanced face images
+RESULT_PROFILES = (RESULT_PROFILE_FEATURES, RESULT_PROFILE_LANDMARKS, RESULT_PROFILE_FULL)
+
+# --- Alignment Methods ---
+ALIGN_METHOD_DLIB = 'dlib'      # dlib.get_face_chip on the color image
+ALIGN_METHOD_AFFINE = 'affine'  # OpenCV warp of only the face region (landmarks.align_face_chip_affine)
+ALIGN_METHODS = (ALIGN_METHOD_DLIB, ALIGN_METHOD_AFFINE)
+
+# Statuses that depend only on the image, config and model, and can therefore be cached
+CACHEABLE_STATUSES = ('success', 'no_face_detected', 'landmark_error', 'low_quality')
+
+
+class ImageContext:
+    """
+    Per-image working state shared by the pipeline stages. The image is decoded once and
+    its grayscale plane is derived at most once, instead of in every stage that needs it.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._gray = None
+
+    @property
+    def gray(self):
+        """The grayscale plane of the image, converted on first access."""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY) if self.image.ndim == 3 else self.image
+        return self._gray
+
 
 class FaceAnalyzer:
     """
@@ -19,34 +64,111 @@ class FaceAnalyzer:
 
     DEFAULT_CONFIG = {
         'detect_upsample': 1,
+        # Multi-resolution detection: run the detector on a downscaled image (None = full resolution)
+        'detect_max_pixels': None,
+        # Smallest face side (in pixels) that must stay detectable; takes precedence over detect_max_pixels
+        'detect_min_face_size': None,
+        # Adaptive upsampling: levels tried in order until a face (of at least detect_min_face_area
+        # pixels) is found, e.g. (0, 1). None uses the fixed detect_upsample level. Only the best face
+        # is guaranteed: faces visible only at later levels are missed (and not in num_faces).
+        'detect_upsample_levels': None,
+        'detect_min_face_area': None,
+        # Quality gate: measure the image before detection and reject it as 'low_quality' when a
+        # threshold is violated (None disables a threshold). Sharpness is the Laplacian variance
+        # at quality_sample_size pixels on the longer side; brightness values are 0-255.
+        'quality_check': False,
+        'quality_sample_size': 256,
+        'quality_min_side': 64,
+        'quality_min_sharpness': 15.0,
+        'quality_min_brightness': 25.0,
+        'quality_max_brightness': 235.0,
+        'quality_min_contrast': 10.0,
         'align_target_size': 256,
         'align_padding': 0.25,
+        # 'dlib' aligns with dlib.get_face_chip; 'affine' warps the same chip geometry with OpenCV,
+        # from the grayscale plane unless 'align_color' is set (see scripts/benchmark_alignment.py).
+        # Neither changes how the image is decoded, so features do not depend on them.
+        'align_method': ALIGN_METHOD_DLIB,
+        'align_color': False,
         'apply_illumination_norm': True,
         'apply_grayscale': True,
         'apply_bilateral_filter': True,
         'bilateral_d': 7,
         'bilateral_sigma_color': 50,
         'bilateral_sigma_space': 50,
+        'result_profile': RESULT_PROFILE_FULL,
+        # Record per-stage wall and CPU time in result['timings']
+        'collect_timings': False,
+        # Decode straight to grayscale when the result profile needs no color images. Faster, but the
+        # decoder's gray plane differs slightly from cv2.cvtColor's (by one gray level in many pixels),
+        # which moves some landmarks: features then differ from those of the full profile.
+        'decode_grayscale': False,
+        # Reduce larger images to this many pixels while decoding (None = full resolution).
+        # JPEGs are decoded at 1/2, 1/4 or 1/8 size, bounding the memory used per image.
+        'load_max_pixels': None,
+        # Report landmarks, face_area and the features derived from them in the coordinates of
+        # the full-resolution image, instead of the (possibly reduced) decoded image
+        'report_original_coordinates': False,
+        # Subset of ALL_FEATURE_NAMES to compute (None computes all features)
+        'feature_names': None,
+        # Video / burst analysis: face tracking and blink detection
+        'track_max_motion': 0.25,
+        'track_max_scale_change': 0.2,
+        'track_redetect_interval': 30,
+        # Tracked frames confirm the face with a detection within this margin (relative to the face
+        # size) around the predicted rectangle; a frame without a face there falls back to full detection
+        'track_search_margin': 0.5,
+        'blink_ear_threshold': 0.21,
+        'blink_min_frames': 2,
     }
 
-    def __init__(self, shape_predictor_path: str, config: dict = None):
+    def __init__(self, shape_predictor_path: str, config: dict = None, cache: ResultCache = None):
         """
         Initializes the FaceAnalyzer.
 
         Args:
             shape_predictor_path (str): Path to the dlib shape predictor model file.
             config (dict, optional): A dictionary to override default processing settings.
+            cache (ResultCache, optional): A persistent result cache. On a hit, detection and
+                                           landmark prediction are skipped.
         """
         if not os.path.exists(shape_predictor_path):
             raise FileNotFoundError(f"Shape predictor model not found at: {shape_predictor_path}")
 
+        # The detector is not safe for concurrent use and cheap to create, so every analyzer has
+        # its own; the large shape predictor is thread-safe and shared by all analyzers in the process
         self.detector = dlib.get_frontal_face_detector()
-        self.predictor = dlib.shape_predictor(shape_predictor_path)
+        self.predictor = load_shape_predictor(shape_predictor_path)
 
         self.config = self.DEFAULT_CONFIG.copy()
         if config:
             self.config.update(config)
 
+        if self.config['result_profile'] not in RESULT_PROFILES:
+            raise ValueError(f"Unknown result_profile '{self.config['result_profile']}'. "
+                             f"Expected one of: {', '.join(RESULT_PROFILES)}")
+        if self.config['align_method'] not in ALIGN_METHODS:
+            raise ValueError(f"Unknown align_method '{self.config['align_method']}'. "
+                             f"Expected one of: {', '.join(ALIGN_METHODS)}")
+
+        # Features to compute; a subset only evaluates the quantities those features depend on
+        self.feature_names = list(self.config['feature_names'] or ALL_FEATURE_NAMES)
+        resolve_feature_dependencies(self.feature_names)  # Validates the names
+
+        # The full profile always decodes in color, whatever the alignment settings: the grayscale
+        # plane is then derived with cv2.cvtColor, so alignment options never change the landmarks
+        self.decode_flags = cv2.IMREAD_COLOR
+        if self.config['decode_grayscale'] and self.config['result_profile'] != RESULT_PROFILE_FULL:
+            self.decode_flags = cv2.IMREAD_GRAYSCALE
+
+        self.cache = cache
+        self.cache_namespace = None
+        if cache is not None:
+            # Cached results are only valid for the same config, decoding and model file
+            model_hash = hash_file(shape_predictor_path)
+            self.cache_namespace = hash_bytes(
+                f"{hash_config(self.config)}:{self.decode_flags}:{model_hash}".encode('utf-8'))
+
     def process_image(self, image_path: str):
         """
         Runs the full analysis pipeline on a single image.
@@ -56,67 +178,547 @@ class FaceAnalyzer:
 
         Returns:
             dict: A dictionary containing the results of the analysis, including status,
-                  images, landmarks, and calculated features.
+                  images, landmarks, and calculated features. Depending on the configured
+                  `result_profile`, 'landmarks' and the image entries are left as None.
+                  With the images, 'align_transform' is the 2x3 affine matrix mapping image
+                  (landmark) coordinates to aligned-chip coordinates.
+                  If 'collect_timings' is enabled, 'timings' maps each stage to its wall
+                  and CPU time in seconds. If 'quality_check' is enabled, 'quality' holds the
+                  image quality metrics, and images failing a threshold get the status
+                  'low_quality' without running detection. 'image_size' is the full-resolution
+                  (width, height) and 'load_scale' the scale the image was decoded at (below
+                  1.0 when reduced to 'load_max_pixels').
+        """
+        result = self._new_result(image_path)
+        timer = StageTimer(enabled=self.config['collect_timings'])
+        with timer.stage('total'):
+            self._run_pipeline(image_path, result, timer)
+        result['timings'] = timer.as_dict()
+        self._report_original_coordinates(result)
+        return self._apply_result_profile(result)
+
+    def process_image_bytes(self, image_data: bytes, image_path: str | None = None) -> dict:
+        """
+        Runs the full analysis pipeline on an encoded image held in memory (e.g. a download
+        that was never written to disk). The buffer is decoded with `cv2.imdecode`.
+
+        Args:
+            image_data (bytes): The encoded image (JPEG, PNG, ...).
+            image_path (str, optional): An identifier reported as 'image_path' in the result.
+
+        Returns:
+            dict: The same result structure as `process_image`.
+        """
+        result = self._new_result(image_path)
+        timer = StageTimer(enabled=self.config['collect_timings'])
+        with timer.stage('total'):
+            self._run_pipeline(image_path, result, timer, image_bytes=bytes(image_data) if image_data else b'')
+        result['timings'] = timer.as_dict()
+        self._report_original_coordinates(result)
+        return self._apply_result_profile(result)
+
+    def process_image_all_faces(self, image_path: str) -> dict:
+        """
+        Runs the analysis pipeline on every face in an image (e.g. group photos, or checking
+        for a second face in the background).
+
+        The image is decoded and quality-checked as in `process_image`. The detector runs once,
+        landmarks for all faces are predicted against one shared grayscale image, and features are
+        computed for all faces in one vectorized pass. The result cache is not used in this mode.
+
+        Args:
+            image_path (str): The path to the image file.
+
+        Returns:
+            dict: 'image_path', 'status', 'error_message', 'num_faces', 'detect_upsample_used',
+                  'image_size', 'load_scale', 'quality' (as in `process_image`), 'timings' and
+                  'faces': a list with one entry per face, ordered by decreasing
+                  face area. Each entry holds 'face_index', 'face_area', 'face_rect' (left, top,
+                  right, bottom), 'status', 'error_message', 'landmarks', 'features', 'aligned_image',
+                  'align_transform' and 'final_image' (the last four subject to the result profile,
+                  as in `process_image`).
         """
         result = {
+            'image_path': image_path,
+            'status': 'failed',
+            'error_message': None,
+            'num_faces': 0,
+            'detect_upsample_used': None,
+            'image_size': None,
+            'load_scale': None,
+            'quality': None,
+            'faces': [],
+            'timings': None,
+        }
+        timer = StageTimer(enabled=self.config['collect_timings'])
+        with timer.stage('total'):
+            self._run_all_faces_pipeline(image_path, result, timer)
+        result['timings'] = timer.as_dict()
+        return result
+
+    def _run_all_faces_pipeline(self, image_path: str, result: dict, timer: StageTimer):
+        """Runs the multi-face pipeline stages on one image, filling in `result`."""
+        with timer.stage('decode'):
+            original_img, load_scale = load_image_capped(image_path, self.decode_flags, self.config['load_max_pixels'])
+        if original_img is None:
+            result['error_message'] = 'Could not load image'
+            return
+        context = self._new_context(original_img, load_scale, result)
+
+        # 0. Quality gate, before any detection cost is paid
+        if not self._passes_quality_gate(context, result, timer):
+            return
+
+        # 1. Face Detection, largest face first
+        detected_faces, result['detect_upsample_used'] = self._detect_faces(context, timer)
+        if not detected_faces:
+            result['status'] = 'no_face_detected'
+            result['error_message'] = 'No face detected in the image'
+            return
+        face_rects = sorted(detected_faces, key=lambda rect: rect.width() * rect.height(), reverse=True)
+        result['num_faces'] = len(face_rects)
+
+        # 2. Landmark Prediction for all faces on the shared grayscale plane
+        with timer.stage('landmarks'):
+            all_landmarks = get_landmarks_batch(context.gray, face_rects, self.predictor)
+
+        faces = []
+        for face_index, (face_rect, landmarks_obj) in enumerate(zip(face_rects, all_landmarks)):
+            face = {
+                'face_index': face_index,
+                'face_area': int(face_rect.width() * face_rect.height()),
+                'face_rect': (face_rect.left(), face_rect.top(), face_rect.right(), face_rect.bottom()),
+                'status': 'landmark_error',
+                'error_message': None,
+                'landmarks': extract_landmark_points(landmarks_obj),
+                'features': {name: None for name in self.feature_names},
+                'aligned_image': None,
+                'align_transform': None,
+                'final_image': None,
+            }
+            faces.append(face)
+            if landmarks_obj is None:
+                face['error_message'] = 'Failed to detect facial landmarks'
+                continue
+            face['status'] = 'success'
+            # 3-4. Alignment and enhancement, for the full profile only
+            if self.config['result_profile'] == RESULT_PROFILE_FULL:
+                self._align_and_enhance(context, landmarks_obj, face, timer)
+
+        # 5. Feature Calculation for all faces at once
+        located = [face for face in faces if face['landmarks'] is not None]
+        if located:
+            with timer.stage('features'):
+                reported = [self._reported_landmarks(face['landmarks'], load_scale) for face in located]
+                features_df = calculate_features_batch(np.array(reported), self.feature_names)
+            for face, features in zip(located, features_df.to_dict('records')):
+                if face['status'] == 'success':
+                    face['features'] = features
+
+        for face in faces:
+            self._report_original_coordinates(face, load_scale)
+            self._apply_result_profile(face)
+        result['faces'] = faces
+        if any(face['status'] == 'success' for face in faces):
+            result['status'] = 'success'
+        else:
+            result['status'] = faces[0]['status']
+            result['error_message'] = 'Failed to analyze any detected face'
+
+    def process_frames(self, frames):
+        """
+        Analyzes a sequence of frames (a video or a burst of photos), tracking the face between frames.
+
+        A full-frame detection runs on the first frame only. On later frames the face rectangle
+        is predicted from the previous frame's landmarks, and the detector only scans a small
+        region around it ('track_search_margin') to confirm the face is still there. A full-frame
+        detection runs again when no face is found in that region, when the tracked landmarks
+        become implausible, or after 'track_redetect_interval' tracked frames.
+
+        Args:
+            frames (iterable): BGR frames (np.ndarray) or image file paths, in sequence order.
+
+        Yields:
+            dict: One result per frame, structured like `process_image` results, with the extra
+                  entries 'frame_index' and 'tracked' (True if no detection ran for the frame).
+        """
+        tracker = LandmarkTracker(max_motion=self.config['track_max_motion'],
+                                  max_scale_change=self.config['track_max_scale_change'],
+                                  redetect_interval=self.config['track_redetect_interval'])
+        for frame_index, frame in enumerate(frames):
+            result = self._new_result(frame if isinstance(frame, str) else None)
+            result['frame_index'] = frame_index
+            result['tracked'] = False
+            timer = StageTimer(enabled=self.config['collect_timings'])
+            with timer.stage('total'):
+                load_scale = 1.0
+                if isinstance(frame, str):
+                    with timer.stage('decode'):
+                        frame, load_scale = load_image_capped(frame, self.decode_flags, self.config['load_max_pixels'])
+                if frame is None or frame.size == 0:
+                    result['error_message'] = 'Could not load frame'
+                    tracker.reset()
+                else:
+                    self._run_frame(self._new_context(frame, load_scale, result), result, tracker, timer)
+            result['timings'] = timer.as_dict()
+            self._report_original_coordinates(result)
+            yield self._apply_result_profile(result)
+
+    def process_video(self, video_path: str, frame_step: int = 1) -> dict:
+        """
+        Analyzes a video file frame by frame (see `process_frames`) and summarizes the sequence.
+
+        Args:
+            video_path (str): The path to the video file.
+            frame_step (int): Analyze every `frame_step`-th frame.
+
+        Returns:
+            dict: 'video_path', 'fps' (of the analyzed frames), 'frames' (per-frame results)
+                  and 'summary' (sequence statistics such as the blink rate).
+        """
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"Video not found at: {video_path}")
+        video_fps = get_video_fps(video_path)
+        fps = video_fps / frame_step if video_fps else None
+        frame_results = list(self.process_frames(iter_video_frames(video_path, frame_step)))
+        summary = summarize_frame_sequence(frame_results, fps,
+                                           blink_ear_threshold=self.config['blink_ear_threshold'],
+                                           blink_min_frames=self.config['blink_min_frames'])
+        return {'video_path': video_path, 'fps': fps, 'frames': frame_results, 'summary': summary}
+
+    def _new_result(self, image_path: str | None) -> dict:
+        """Returns an empty result dict with every entry set to its failure default."""
+        return {
             'image_path': image_path,
             'status': 'failed',
             'error_message': None,
             'face_area': None,
             'landmarks': None,
             'aligned_image': None,
+            'align_transform': None,
             'final_image': None,
-            'features': {name: None for name in ALL_FEATURE_NAMES}
+            'features': {name: None for name in self.feature_names},
+            'num_faces': 0,
+            'detect_upsample_used': None,
+            'image_size': None,
+            'load_scale': None,
+            'quality': None,
+            'cache_hit': False,
+            'timings': None,
         }
 
-        original_img = load_image(image_path)
+    def _run_frame(self, context: ImageContext, result: dict, tracker: LandmarkTracker, timer: StageTimer):
+        """Runs the pipeline stages on one frame of a sequence, tracking the face if possible."""
+        # Frames failing the quality gate (e.g. motion blur) also end the tracking
+        if not self._passes_quality_gate(context, result, timer):
+            tracker.reset()
+            return
+
+        landmarks_obj = None
+        if tracker.active:
+            # The shape predictor places landmarks in any rectangle, so confirm there is still a face.
+            # Landmarks are predicted in the tracked rectangle, which keeps the geometry of the
+            # full-frame detection (the detector's rectangles differ slightly at the region's scale).
+            face_rect = tracker.predict_rect()
+            with timer.stage('detection'):
+                confirmed = detect_faces_in_region(context.gray, self.detector, face_rect,
+                                                   self.config['track_search_margin'])
+            landmark_points = None
+            if confirmed:
+                with timer.stage('landmarks'):
+                    landmarks_obj = get_landmarks(context.gray, face_rect, self.predictor)
+                landmark_points = extract_landmark_points(landmarks_obj)
+            if tracker.update(landmark_points):
+                result['tracked'] = True
+                result['num_faces'] = None  # Unknown, as no full-frame detection ran
+                result['face_area'] = int(face_rect.width() * face_rect.height())
+                result['landmarks'] = landmark_points
+            else:
+                landmarks_obj = None
+
+        if landmarks_obj is None:
+            landmarks_obj = self._locate_landmarks(context, result, timer)
+            if landmarks_obj is None:
+                return
+            tracker.start(landmarks_obj.rect, result['landmarks'])
+
+        if self.config['result_profile'] == RESULT_PROFILE_FULL:
+            if not self._align_and_enhance(context, landmarks_obj, result, timer):
+                return
+
+        with timer.stage('features'):
+            result['features'] = self._calculate_features(self._reported_landmarks(result['landmarks'],
+                                                                                   result['load_scale']))
+        result['status'] = 'success'
+
+    def _run_pipeline(self, image_path: str | None, result: dict, timer: StageTimer, image_bytes: bytes = None):
+        """
+        Runs the pipeline stages on one image, filling in `result`. The image is read from
+        `image_path` unless its encoded bytes are given.
+        """
+        cache_key = None
+        if self.cache is None and image_bytes is None:
+            with timer.stage('decode'):
+                original_img, load_scale = load_image_capped(image_path, self.decode_flags,
+                                                             self.config['load_max_pixels'])
+        else:
+            if self.cache is not None:
+                with timer.stage('cache'):
+                    if image_bytes is None:
+                        image_bytes = read_image_bytes(image_path)
+                    cached = None
+                    if image_bytes is not None:
+                        cache_key = self.cache.make_key(image_bytes, self.cache_namespace)
+                        cached = self.cache.get(cache_key)
+                if cached is not None:
+                    self._process_cached(image_bytes, cached, result, timer)
+                    return
+            with timer.stage('decode'):
+                original_img, load_scale = decode_image_capped(image_bytes, self.decode_flags,
+                                                               self.config['load_max_pixels'])
+
         if original_img is None:
             result['error_message'] = 'Could not load image'
-            return result
+            return
+        context = self._new_context(original_img, load_scale, result)
+
+        # 0. Quality gate, before any detection cost is paid
+        landmarks_obj = None
+        features = None
+        if self._passes_quality_gate(context, result, timer):
+            # 1-2. Face Detection and Landmark Prediction
+            landmarks_obj = self._locate_landmarks(context, result, timer)
+            if landmarks_obj is not None:
+                with timer.stage('features'):
+                    features = self._calculate_features(self._reported_landmarks(result['landmarks'],
+                                                                                 result['load_scale']))
+
+        self._store_in_cache(cache_key, result, landmarks_obj, features, timer)
+
+        if landmarks_obj is None:
+            return
+
+        # 3-4. Alignment and enhancement only produce images, so lean profiles skip them
+        if self.config['result_profile'] == RESULT_PROFILE_FULL:
+            if not self._align_and_enhance(context, landmarks_obj, result, timer):
+                return
+
+        # 5. Feature Calculation
+        result['features'] = features
+        result['status'] = 'success'
+
+    def _store_in_cache(self, cache_key: str | None, result: dict, landmarks_obj, features: dict | None,
+                        timer: StageTimer):
+        """Stores the cacheable part of a freshly computed result, if caching is enabled and the status allows it."""
+        if cache_key is None or not (landmarks_obj is not None or result['status'] in CACHEABLE_STATUSES):
+            return
+        with timer.stage('cache'):
+            self.cache.put(cache_key, {
+                'status': 'success' if landmarks_obj is not None else result['status'],
+                'error_message': result['error_message'],
+                'face_area': result['face_area'],
+                'num_faces': result['num_faces'],
+                'detect_upsample_used': result['detect_upsample_used'],
+                'image_size': result['image_size'],
+                'load_scale': result['load_scale'],
+                'quality': result['quality'],
+                'face_rect': [landmarks_obj.rect.left(), landmarks_obj.rect.top(),
+                              landmarks_obj.rect.right(), landmarks_obj.rect.bottom()] if landmarks_obj else None,
+                'landmarks': result['landmarks'],
+                'features': features,
+            })
+
+    def _calculate_features(self, landmark_points: list[tuple[int, int]]) -> dict:
+        """Calculates the configured features: all of them, or only the requested subset."""
+        return calculate_features(landmark_points, self.feature_names)
+
+    def _detect_faces(self, context: ImageContext, timer: StageTimer):
+        """
+        Runs face detection on the shared grayscale plane with the configured upsampling policy.
+
+        Returns:
+            tuple[list[dlib.rectangle], int | None]: The detected faces and the upsample level used.
+        """
+        with timer.stage('detection'):
+            if self.config['detect_upsample_levels']:
+                return detect_faces_adaptive(
+                    context.gray, self.detector, self.config['detect_upsample_levels'],
+                    min_face_area=self.config['detect_min_face_area'],
+                    max_pixels=self.config['detect_max_pixels'],
+                    min_face_size=self.config['detect_min_face_size']
+                )
+            upsample = self.config['detect_upsample']
+            detect_scale = choose_detection_scale(context.gray.shape, self.config['detect_max_pixels'],
+                                                  self.config['detect_min_face_size'], upsample)
+            detected_faces = detect_faces(context.gray, self.detector, upsample, scale=detect_scale)
+            return detected_faces, (upsample if detected_faces else None)
 
-        # 1. Face Detection
-        detected_faces = detect_faces(original_img, self.detector, self.config['detect_upsample'])
+    def _passes_quality_gate(self, context: ImageContext, result: dict, timer: StageTimer) -> bool:
+        """
+        Computes the quality metrics of the image into result['quality'] and checks them against
+        the configured thresholds. A rejected image gets the 'low_quality' status.
+
+        Returns:
+            bool: True if the image passed, or if the quality check is disabled.
+        """
+        if not self.config['quality_check']:
+            return True
+        with timer.stage('quality'):
+            result['quality'] = compute_quality_metrics(context.gray, self.config['quality_sample_size'],
+                                                        image_size=result['image_size'])
+            reason = check_quality(
+                result['quality'],
+                min_side=self.config['quality_min_side'],
+                min_sharpness=self.config['quality_min_sharpness'],
+                min_brightness=self.config['quality_min_brightness'],
+                max_brightness=self.config['quality_max_brightness'],
+                min_contrast=self.config['quality_min_contrast']
+            )
+        if reason is not None:
+            result['status'] = 'low_quality'
+            result['error_message'] = reason
+            return False
+        return True
+
+    def _locate_landmarks(self, context: ImageContext, result: dict, timer: StageTimer):
+        """
+        Runs face detection and landmark prediction, recording the face area and landmark
+        points in `result`. On failure, the status and error message are set instead.
+
+        Returns:
+            dlib.full_object_detection | None: The landmarks of the best face, or None on failure.
+        """
+        # 1. Face Detection (landmarks are still predicted at full resolution)
+        detected_faces, upsample_used = self._detect_faces(context, timer)
+        result['num_faces'] = len(detected_faces)
         if not detected_faces:
             result['status'] = 'no_face_detected'
             result['error_message'] = 'No face detected in the image'
-            return result
+            return None
 
+        result['detect_upsample_used'] = upsample_used
         best_face_rect = get_best_face(detected_faces)
         result['face_area'] = int(best_face_rect.width() * best_face_rect.height())
 
         # 2. Landmark Prediction
-        landmarks_obj = get_landmarks(original_img, best_face_rect, self.predictor)
+        with timer.stage('landmarks'):
+            landmarks_obj = get_landmarks(context.gray, best_face_rect, self.predictor)
         if landmarks_obj is None:
             result['status'] = 'landmark_error'
             result['error_message'] = 'Failed to detect facial landmarks'
-            return result
+            return None
 
-        landmark_points = extract_landmark_points(landmarks_obj)
-        result['landmarks'] = landmark_points
+        result['landmarks'] = extract_landmark_points(landmarks_obj)
+        return landmarks_obj
 
+    def _align_and_enhance(self, context: ImageContext, landmarks_obj, result: dict, timer: StageTimer) -> bool:
+        """
+        Produces the aligned face chip and the enhanced final image, storing both in `result`
+        together with 'align_transform', the 2x3 affine matrix (as nested lists) mapping image
+        coordinates to chip coordinates. On failure, the status and error message are set instead.
+
+        Returns:
+            bool: True if both stages succeeded.
+        """
         # 3. Face Alignment
-        aligned_chip = align_face_chip(
-            original_img, landmarks_obj,
-            target_size=self.config['align_target_size'],
-            padding=self.config['align_padding']
-        )
+        with timer.stage('alignment'):
+            landmark_points = extract_landmark_points(landmarks_obj)
+            if self.config['align_method'] == ALIGN_METHOD_AFFINE:
+                aligned_chip, transform = align_face_chip_affine(
+                    context.image if self.config['align_color'] else context.gray, landmark_points,
+                    target_size=self.config['align_target_size'],
+                    padding=self.config['align_padding']
+                )
+            else:
+                aligned_chip = align_face_chip(
+                    context.image, landmarks_obj,
+                    target_size=self.config['align_target_size'],
+                    padding=self.config['align_padding']
+                )
+                transform = compute_face_chip_transform(landmark_points, self.config['align_target_size'],
+                                                        self.config['align_padding'])
         if aligned_chip is None:
             result['status'] = 'alignment_error'
             result['error_message'] = 'Failed to align face chip'
-            return result
+            return False
         result['aligned_image'] = aligned_chip
+        result['align_transform'] = transform.tolist() if transform is not None else None
 
         # 4. Optional Enhancements
-        final_image = apply_optional_enhancements(aligned_chip, self.config)
+        with timer.stage('enhancement'):
+            final_image = apply_optional_enhancements(aligned_chip, self.config)
         if final_image is None:
             result['status'] = 'enhancement_error'
             result['error_message'] = 'Failed during image enhancement steps'
-            return result
+            return False
         result['final_image'] = final_image
+        return True
 
-        # 5. Feature Calculation
-        features = calculate_all_features(landmark_points)
-        result['features'] = features
+    def _process_cached(self, image_bytes: bytes, cached: dict, result: dict, timer: StageTimer) -> dict:
+        """Fills `result` from a cache entry, re-running only the image stages for the full profile."""
+        result['cache_hit'] = True
+        result['status'] = cached['status']
+        result['error_message'] = cached['error_message']
+        result['face_area'] = cached['face_area']
+        result['num_faces'] = cached.get('num_faces', 0)
+        result['detect_upsample_used'] = cached.get('detect_upsample_used')
+        result['image_size'] = tuple(cached['image_size']) if cached.get('image_size') else None
+        result['load_scale'] = cached.get('load_scale', 1.0)
+        result['quality'] = cached.get('quality')
+        if cached['landmarks'] is not None:
+            result['landmarks'] = [tuple(p) for p in cached['landmarks']]
 
-        result['status'] = 'success'
-        return result
\ No newline at end of file
+        if result['status'] != 'success':
+            return result
+
+        if self.config['result_profile'] == RESULT_PROFILE_FULL:
+            with timer.stage('decode'):
+                original_img, _ = decode_image_capped(image_bytes, self.decode_flags, self.config['load_max_pixels'])
+            landmarks_obj = build_landmarks_object(cached['face_rect'], result['landmarks'])
+            if original_img is None or landmarks_obj is None:
+                result['status'] = 'failed'
+                result['error_message'] = 'Could not restore image or landmarks from cache'
+                return result
+            if not self._align_and_enhance(ImageContext(original_img), landmarks_obj, result, timer):
+                return result
+
+        result['features'] = cached['features']
+        return result
+
+    @staticmethod
+    def _new_context(image: np.ndarray, load_scale: float, result: dict) -> ImageContext:
+        """Records the decode scale and full-resolution size of a decoded image in `result` and wraps the image."""
+        result['load_scale'] = load_scale
+        result['image_size'] = (round(image.shape[1] / load_scale), round(image.shape[0] / load_scale))
+        return ImageContext(image)
+
+    def _reported_landmarks(self, landmarks: list[tuple[int, int]] | None,
+                            scale: float | None) -> list[tuple[int, int]] | None:
+        """Returns landmarks of an image decoded at `scale` in the coordinates features are computed and reported in."""
+        if not self.config['report_original_coordinates'] or not scale or scale == 1.0 or landmarks is None:
+            return landmarks
+        return [(int(round(x / scale)), int(round(y / scale))) for x, y in landmarks]
+
+    def _report_original_coordinates(self, result: dict, scale: float | None = None):
+        """
+        Converts the landmarks, face area (and rectangle) and alignment transform of a finished
+        result (or face entry) from decoded-image to full-resolution coordinates, if
+        'report_original_coordinates' is enabled. `scale` defaults to result['load_scale'].
+        """
+        scale = result['load_scale'] if scale is None else scale
+        if not self.config['report_original_coordinates'] or not scale or scale == 1.0:
+            return
+        result['landmarks'] = self._reported_landmarks(result['landmarks'], scale)
+        if result['face_area'] is not None:
+            result['face_area'] = int(round(result['face_area'] / scale ** 2))
+        if result.get('face_rect') is not None:
+            result['face_rect'] = tuple(int(round(value / scale)) for value in result['face_rect'])
+        if result.get('align_transform') is not None:
+            # Full-resolution point p is decoded point p * scale
+            result['align_transform'] = [[row[0] * scale, row[1] * scale, row[2]] for row in result['align_transform']]
+
+    def _apply_result_profile(self, result: dict) -> dict:
+        """Drops the result entries that the configured result profile does not include."""
+        if self.config['result_profile'] == RESULT_PROFILE_FEATURES:
+            result['landmarks'] = None
+        return result
@@ -0,0 +1,658 @@
+# facial_feature_extractor/batch.py
+import os
+import csv
+import json
+import time
+import hashlib
+import signal
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+
+# File extensions picked up when scanning directories for images
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Statuses of final results ('failed' images cannot be read or decoded, so retrying does not help).
+# Images recorded with any other status (e.g. 'critical_error' or 'timeout') are retried when a run
+# is resumed, up to a number of attempts; `compact_output_csv` then drops their earlier rows.
+COMPLETED_STATUSES = ('success', 'no_face_detected', 'low_quality', 'landmark_error', 'failed')
+
+
+def iter_image_paths(directory: str, extensions: tuple[str, ...] = IMAGE_EXTENSIONS):
+    """
+    Recursively yields the paths of image files below a directory.
+
+    Directories are scanned lazily with `os.scandir`, so consumers can start working before
+    the scan finishes and memory does not grow with the number of files.
+
+    Args:
+        directory (str): Root directory to scan.
+        extensions (tuple[str, ...]): Lower-case file extensions to include.
+
+    Yields:
+        str: Image file paths.
+    """
+    pending_dirs = [directory]
+    while pending_dirs:
+        current = pending_dirs.pop()
+        try:
+            with os.scandir(current) as entries:
+                subdirs = []
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        yield entry.path
+        except OSError as e:
+            print(f"Error scanning directory {current}: {e}")
+            continue
+        # Visit subdirectories in name order for a reproducible processing order
+        pending_dirs.extend(sorted(subdirs, reverse=True))
+
+
+def iter_manifest_paths(manifest_path: str, path_column: str = 'image_path', chunk_size: int = 10000):
+    """
+    Yields image paths from a manifest file without loading it into memory at once.
+
+    Args:
+        manifest_path (str): A CSV file, or a JSONL file (`.jsonl`) with one object per line.
+        path_column (str): The column (CSV) or key (JSONL) holding the image path.
+        chunk_size (int): Number of CSV rows read at a time.
+
+    Yields:
+        str: Image file paths.
+    """
+    if manifest_path.lower().endswith('.jsonl'):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    path = json.loads(line).get(path_column)
+                except (json.JSONDecodeError, AttributeError) as e:
+                    print(f"Skipping invalid manifest line {line_number}: {e}")
+                    continue
+                if path:
+                    yield str(path)
+        return
+
+    for chunk in pd.read_csv(manifest_path, usecols=[path_column], chunksize=chunk_size, encoding='utf-8-sig'):
+        yield from chunk[path_column].dropna().astype(str)
+
+
+def iter_chunks(iterable, size: int):
+    """Yields successive lists of up to `size` items from an iterable."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def shard_key(image_path: str, root: str | None = None) -> str:
+    """
+    Returns the key an image is sharded by: its path relative to `root` (if given) with '/'
+    separators, so that nodes mounting the input at different locations agree on it.
+    """
+    key = os.path.relpath(image_path, root) if root else image_path
+    return key.replace(os.sep, '/')
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    """
+    Assigns a key to one of `num_shards` shards by a stable hash.
+
+    Unlike the built-in `hash`, which is salted per process, the assignment is identical on
+    every machine and in every run.
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+
+def iter_shard(image_paths, num_shards: int, shard_index: int, root: str | None = None):
+    """Yields the image paths that belong to shard `shard_index` of `num_shards` (see `shard_key`)."""
+    if num_shards <= 1:
+        yield from image_paths
+        return
+    for image_path in image_paths:
+        if shard_of(shard_key(image_path, root), num_shards) == shard_index:
+            yield image_path
+
+
+def processed_image_name(image_path: str, root: str | None = None, extension: str = '.png') -> str:
+    """
+    Returns a unique file name for the processed image of an input image: its stem plus a short
+    hash of its `shard_key`, so that 'a/1.jpg' and 'b/1.jpg' of a recursive scan do not collide.
+    """
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    digest = hashlib.blake2b(shard_key(image_path, root).encode('utf-8'), digest_size=6).hexdigest()
+    return f"{stem}-{digest}{extension}"
+
+
+def shard_path(path: str, num_shards: int, shard_index: int) -> str:
+    """
+    Returns the output path of one shard, e.g. 'out.csv' -> 'out.shard-002-of-008.csv'
+    (unchanged for unsharded runs).
+    """
+    if num_shards <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard_index:03d}-of-{num_shards:03d}{ext}"
+
+
+def submit_bounded(executor, fn, chunks, max_in_flight: int, *args):
+    """
+    Submits `fn(chunk, *args)` for each chunk while keeping at most `max_in_flight` tasks
+    pending, and yields `(chunk, future)` pairs as the tasks complete.
+
+    Unlike submitting everything up front, the input is consumed only as fast as the
+    executor works through it, so memory stays flat for arbitrarily long inputs.
+
+    Args:
+        executor (concurrent.futures.Executor): The executor to submit to.
+        fn (callable): The task function, called with a chunk and `args`.
+        chunks (iterable): The task inputs, typically from `iter_chunks`.
+        max_in_flight (int): Maximum number of submitted but unfinished tasks.
+
+    Yields:
+        tuple[object, concurrent.futures.Future]: A chunk and its completed future.
+    """
+    chunks = iter(chunks)
+    in_flight = {}
+    exhausted = False
+    while True:
+        while not exhausted and len(in_flight) < max_in_flight:
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                break
+            in_flight[executor.submit(fn, chunk, *args)] = chunk
+        if not in_flight:
+            return
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield in_flight.pop(future), future
+
+
+class ItemTimeoutError(TimeoutError):
+    """Raised for an item whose processing exceeded the time budget of a `WatchdogProcessPool`."""
+
+    def __init__(self, item, elapsed: float):
+        super().__init__(f"Processing exceeded the time budget and was stopped after {elapsed:.1f}s")
+        self.item = item
+        self.elapsed = elapsed
+
+
+class WorkerCrashError(RuntimeError):
+    """Raised for an item whose worker process died while processing it alone."""
+
+    def __init__(self, item):
+        super().__init__("Worker process died while processing this item")
+        self.item = item
+
+
+# Registry of the item each worker is processing; set in the workers of a WatchdogProcessPool
+_watchdog_registry = None
+
+
+def _initialize_watchdog_worker(registry, initializer, initargs):
+    global _watchdog_registry
+    _watchdog_registry = registry
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_watched_chunk(fn, chunk, *args):
+    """Runs `fn(item, *args)` for each item of a chunk, registering the item being processed."""
+    pid = os.getpid()
+    results = []
+    try:
+        for item in chunk:
+            _watchdog_registry[pid] = (item, time.time())
+            results.append(fn(item, *args))
+    finally:
+        _watchdog_registry.pop(pid, None)
+    return results
+
+
+class WatchdogProcessPool:
+    """
+    A process pool for chunked tasks that enforces a per-item time budget.
+
+    Workers register each item before processing it. When an item runs longer than
+    `time_budget`, the worker processing it is killed (a call stuck in native code cannot be
+    interrupted otherwise). The pool is then rebuilt, the unfinished chunks are resubmitted
+    without that item, and the item is reported as an `ItemTimeoutError`. If a worker dies on
+    its own (e.g. a crash in native code), the unfinished chunks are resubmitted as well, and
+    the items that were running are retried one at a time; an item that kills its worker while
+    running alone is reported as a `WorkerCrashError`.
+    """
+
+    def __init__(self, max_workers: int, initializer=None, initargs: tuple = (), time_budget: float | None = None,
+                 poll_interval: float = 1.0, mp_context=None):
+        """
+        Initializes the pool.
+
+        Args:
+            max_workers (int): Number of worker processes.
+            initializer (callable, optional): Called with `initargs` in each new worker process.
+            initargs (tuple): Arguments of the initializer.
+            time_budget (float, optional): Maximum seconds per item (None disables the budget).
+            poll_interval (float): Seconds between checks of the running items.
+            mp_context (multiprocessing.context.BaseContext, optional): Context the worker processes
+                                                                        are started with (e.g. 'fork').
+        """
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.time_budget = time_budget
+        self.poll_interval = poll_interval
+        self.mp_context = mp_context
+        self.restarts = 0
+        self._manager = multiprocessing.Manager()
+        self._registry = self._manager.dict()
+        self._executor = None
+        self._crash_counts = {}
+
+    def _start_executor(self):
+        self._registry.clear()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context,
+                                             initializer=_initialize_watchdog_worker,
+                                             initargs=(self._registry, self.initializer, self.initargs))
+
+    def _kill_overdue_workers(self) -> dict:
+        """Kills the workers whose current item exceeded the budget; returns {item: elapsed}."""
+        timed_out = {}
+        if self.time_budget is None:
+            return timed_out
+        now = time.time()
+        for pid, (item, started) in list(self._registry.items()):
+            if now - started > self.time_budget:
+                try:
+                    os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                except OSError:
+                    continue  # Already gone
+                timed_out[item] = now - started
+        return timed_out
+
+    @staticmethod
+    def _failed_future(exception: Exception) -> Future:
+        future = Future()
+        future.set_exception(exception)
+        return future
+
+    def submit_chunks(self, fn, chunks, max_in_flight: int, *args):
+        """
+        Runs `fn(item, *args)` for every item of every chunk, keeping at most `max_in_flight`
+        chunks pending (see `submit_bounded`), and yields results as chunks complete.
+
+        `fn` should handle its own exceptions per item; an exception escaping it fails the
+        whole chunk.
+
+        Yields:
+            tuple[list, concurrent.futures.Future]: A chunk and its completed future, whose
+                result is the list of per-item results. Items dropped by the watchdog are
+                yielded as one-item chunks whose future raises `ItemTimeoutError` or
+                `WorkerCrashError`.
+        """
+        chunks = iter(chunks)
+        retry_chunks = deque()
+        suspects = deque()  # Items running when a worker died; each is retried alone to find the culprit
+        in_flight = {}
+        exhausted = False
+        timed_out = {}
+        if self._executor is None:
+            self._start_executor()
+
+        while True:
+            broken = False
+            while not broken:
+                isolated = bool(suspects)
+                if isolated:
+                    if in_flight:
+                        break
+                    chunk = [suspects.popleft()]
+                elif len(in_flight) >= max_in_flight:
+                    break
+                elif retry_chunks:
+                    chunk = retry_chunks.popleft()
+                elif not exhausted:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                else:
+                    break
+                try:
+                    in_flight[self._executor.submit(_run_watched_chunk, fn, chunk, *args)] = chunk
+                except BrokenProcessPool:
+                    if isolated:
+                        suspects.appendleft(chunk[0])
+                    else:
+                        retry_chunks.appendleft(chunk)
+                    broken = True
+            if not in_flight and not broken:
+                return
+
+            done, _ = wait(in_flight, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                if isinstance(future.exception(), BrokenProcessPool):
+                    broken = True
+                    continue
+                yield in_flight.pop(future), future
+            timed_out.update(self._kill_overdue_workers())
+            if not broken:
+                continue
+
+            # The pool is broken: find the items to drop, collect the unfinished chunks for
+            # resubmission and start a fresh pool
+            running_items = [item for item, _ in self._registry.values()]
+            if not timed_out and not running_items:
+                raise BrokenProcessPool("A worker process died outside of item processing (e.g. in the initializer)")
+            wait(in_flight)
+            for future in list(in_flight):
+                chunk = in_flight.pop(future)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    retry_chunks.append(chunk)
+                else:
+                    yield chunk, future
+
+            dropped = {item: ItemTimeoutError(item, elapsed) for item, elapsed in timed_out.items()}
+            if not timed_out:
+                if len(running_items) == 1:
+                    dropped[running_items[0]] = WorkerCrashError(running_items[0])
+                else:
+                    suspects.extend(item for item in running_items if item not in suspects)
+            timed_out = {}
+            for item, error in dropped.items():
+                yield [item], self._failed_future(error)
+            skipped = set(dropped) | set(suspects)
+            retry_chunks = deque(kept for kept in ([item for item in chunk if item not in skipped]
+                                                   for chunk in retry_chunks) if kept)
+
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self.restarts += 1
+            self._start_executor()
+
+    def shutdown(self):
+        """Shuts down the worker processes and the registry."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._manager.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+def read_completed_image_paths(csv_path: str, path_column: str = 'image_path', status_column: str = 'status',
+                               completed_statuses: tuple[str, ...] = COMPLETED_STATUSES,
+                               max_attempts: int | None = None) -> set[str]:
+    """
+    Reads the image paths already recorded in an existing output CSV with a final status.
+
+    Images recorded with any other status (e.g. 'critical_error' or 'timeout') are not
+    returned, so a resumed run retries them, unless they already have `max_attempts` rows
+    (one per attempt). CSVs without a status column count every row.
+
+    Args:
+        csv_path (str): Path to a (possibly partial) output CSV.
+        path_column (str): Name of the column holding the image paths.
+        status_column (str): Name of the column holding the result status.
+        completed_statuses (tuple[str, ...]): Statuses of results that are not retried.
+        max_attempts (int, optional): Attempts after which an image is no longer retried (None for no limit).
+
+    Returns:
+        set[str]: The image paths not to process again, or an empty set if the file does not
+                  exist or is empty.
+    """
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+        return set()
+    try:
+        done = pd.read_csv(csv_path, usecols=lambda column: column in (path_column, status_column), dtype=str,
+                           keep_default_na=False, encoding='utf-8-sig')
+    except (ValueError, pd.errors.EmptyDataError) as e:
+        print(f"Error reading completed paths from {csv_path}: {e}")
+        return set()
+    if path_column not in done.columns:
+        print(f"Error reading completed paths from {csv_path}: no '{path_column}' column")
+        return set()
+    if status_column not in done.columns:
+        return set(done[path_column]) - {''}
+    skipped = set(done.loc[done[status_column].isin(completed_statuses), path_column])
+    if max_attempts:
+        attempts = done[path_column].value_counts()
+        skipped.update(attempts.index[attempts >= max_attempts])
+    return skipped - {''}
+
+
+def compact_output_csv(csv_path: str, path_column: str = 'image_path', status_column: str = 'status',
+                       completed_statuses: tuple[str, ...] = COMPLETED_STATUSES, chunk_size: int = 10000) -> int:
+    """
+    Drops the rows superseded by a resumed run from an output CSV that resume appends to.
+
+    When an image's last row has a final status, only that row is kept. Images still without
+    a final result keep one row per attempt, which `read_completed_image_paths` counts for
+    its retry limit. The file is rewritten (values copied verbatim) only if rows are dropped.
+
+    Args:
+        csv_path (str): Path of the output CSV.
+        path_column (str): Name of the column holding the image paths (or other row keys).
+        status_column (str): Name of the column holding the result status.
+        completed_statuses (tuple[str, ...]): Statuses of final results.
+        chunk_size (int): Number of rows read at a time.
+
+    Returns:
+        int: The number of rows dropped.
+    """
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+        return 0
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        columns = next(csv.reader(f), [])
+    if path_column not in columns or status_column not in columns:
+        return 0
+
+    # First pass: the last row and the number of rows of every image
+    last_rows = {}  # Image path -> (row number, completed)
+    row_counts = {}
+    row_number = 0
+    for chunk in pd.read_csv(csv_path, usecols=[path_column, status_column], dtype=str, keep_default_na=False,
+                             chunksize=chunk_size, encoding='utf-8-sig'):
+        for image_path, status in zip(chunk[path_column], chunk[status_column]):
+            last_rows[image_path] = (row_number, status in completed_statuses)
+            row_counts[image_path] = row_counts.get(image_path, 0) + 1
+            row_number += 1
+    dropped = sum(row_counts[image_path] - 1 for image_path, (_, completed) in last_rows.items() if completed)
+    if dropped == 0:
+        return 0
+
+    tmp_path = f"{csv_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as out:
+        csv.writer(out, lineterminator='\n').writerow(columns)
+        row_number = 0
+        for chunk in pd.read_csv(csv_path, dtype=str, keep_default_na=False, chunksize=chunk_size,
+                                 encoding='utf-8-sig'):
+            keep = []
+            for image_path in chunk[path_column]:
+                last_row, completed = last_rows[image_path]
+                keep.append(not completed or last_row == row_number)
+                row_number += 1
+            chunk[keep].to_csv(out, header=False, index=False)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, csv_path)
+    return dropped
+
+
+class IncrementalCSVWriter:
+    """
+    Writes result rows to a CSV file in chunks, so finished work is persisted as it
+    completes instead of being held in memory until the end of a run.
+
+    Each chunk is written in one call and flushed to disk, which makes the output file
+    itself the checkpoint for resuming an interrupted run.
+    """
+
+    def __init__(self, csv_path: str, columns: list[str], chunk_size: int = 500, append: bool = False,
+                 before_flush=None):
+        """
+        Initializes the writer and opens the output file.
+
+        Args:
+            csv_path (str): Path of the CSV file to write.
+            columns (list[str]): Column order of the output. Missing keys are written as empty cells.
+            chunk_size (int): Number of buffered rows that triggers a flush to disk.
+            append (bool): If True, rows are appended to an existing file with the same header.
+            before_flush (callable, optional): Called before every chunk is written, e.g. to persist
+                                               side outputs of the buffered rows first, so they are
+                                               never behind the checkpoint.
+        """
+        self.csv_path = csv_path
+        self.columns = list(columns)
+        self.chunk_size = max(1, chunk_size)
+        self.before_flush = before_flush
+        self.rows_written = 0
+        self._buffer = []
+
+        has_content = append and os.path.exists(csv_path) and os.path.getsize(csv_path) > 0
+        if has_content:
+            with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+                existing_header = next(csv.reader(f), [])
+            if existing_header != self.columns:
+                raise ValueError(f"Cannot append to {csv_path}: its columns do not match the current output columns")
+
+        directory = os.path.dirname(csv_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._file = open(csv_path, 'a' if has_content else 'w', encoding='utf-8-sig', newline='')
+        self._write_header = not has_content
+
+    def write(self, row: dict):
+        """Buffers a result row, flushing the buffer once it reaches the chunk size."""
+        self._buffer.append(row)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered rows to disk."""
+        if not self._buffer and not self._write_header:
+            return
+        if self.before_flush is not None:
+            self.before_flush()
+        pd.DataFrame(self._buffer, columns=self.columns).to_csv(self._file, header=self._write_header, index=False)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.rows_written += len(self._buffer)
+        self._buffer = []
+        self._write_header = False
+
+    def close(self):
+        """Flushes any remaining rows and closes the file."""
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def merge_shard_outputs(output_path: str, num_shards: int, expected_keys: set[str] | None = None,
+                        root: str | None = None, path_column: str = 'image_path', chunk_size: int = 10000) -> dict:
+    """
+    Concatenates the per-shard output CSVs of a sharded run (see `shard_path`) and validates
+    that every image appears exactly once.
+
+    The checks are: all shard files exist and share the same columns, no image has two final
+    results, every image lies in the shard its key hashes to (catching nodes run with the wrong
+    shard settings), and, if `expected_keys` is given, no expected image is missing. Rows with a
+    status outside COMPLETED_STATUSES are dropped when the image has a later row (the retry of a
+    resumed run). The merged CSV is written to `output_path` only if all checks pass; values are
+    copied verbatim.
+
+    Args:
+        output_path (str): The unsharded output path; shard files are derived from it.
+        num_shards (int): Number of shards of the run.
+        expected_keys (set[str], optional): Shard keys of all input images (see `shard_key`).
+        root (str, optional): Root directory the shard keys are relative to.
+        path_column (str): Name of the column holding the image paths.
+        chunk_size (int): Number of rows read at a time.
+
+    Returns:
+        dict: 'valid', 'rows' (written), 'superseded' (dropped rows of retried images), and the
+              offending entries: 'missing_shards', 'column_mismatches', 'duplicates', 'misplaced'
+              (image path, found in shard, expected shard) and 'missing' (expected keys not found
+              in any shard).
+    """
+    report = {'valid': False, 'rows': 0, 'superseded': 0, 'missing_shards': [], 'column_mismatches': [],
+              'duplicates': [], 'misplaced': [], 'missing': []}
+    shard_paths = [shard_path(output_path, num_shards, index) for index in range(num_shards)]
+    report['missing_shards'] = [path for path in shard_paths if not os.path.exists(path)]
+    if report['missing_shards']:
+        return report
+
+    columns = None
+    for path in shard_paths:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            header = next(csv.reader(f), [])
+        if columns is None:
+            columns = header
+        if header != columns or path_column not in header:
+            report['column_mismatches'].append(path)
+    if report['column_mismatches']:
+        return report
+
+    # First pass: pick the row kept for every image. A row with a status outside COMPLETED_STATUSES
+    # (e.g. a timeout) is superseded by a later row of the same image, as written by a resumed run.
+    status_column = 'status' if 'status' in columns else None
+    kept = {}  # Shard key -> (shard index, row number, completed)
+    for shard_index, path in enumerate(shard_paths):
+        row_number = 0
+        for chunk in pd.read_csv(path, usecols=[path_column] + ([status_column] if status_column else []),
+                                 dtype=str, keep_default_na=False, chunksize=chunk_size, encoding='utf-8-sig'):
+            statuses = chunk[status_column] if status_column else [COMPLETED_STATUSES[0]] * len(chunk)
+            for image_path, status in zip(chunk[path_column], statuses):
+                key = shard_key(image_path, root)
+                completed = status in COMPLETED_STATUSES
+                previous = kept.get(key)
+                if previous is not None and previous[2] and completed:
+                    report['duplicates'].append(image_path)
+                if previous is None or completed or not previous[2]:
+                    kept[key] = (shard_index, row_number, completed)
+                expected_shard = shard_of(key, num_shards)
+                if expected_shard != shard_index:
+                    report['misplaced'].append((image_path, shard_index, expected_shard))
+                row_number += 1
+    report['valid'] = not (report['duplicates'] or report['misplaced'])
+    if expected_keys is not None:
+        report['missing'] = sorted(expected_keys - kept.keys())
+        report['valid'] = report['valid'] and not report['missing']
+    if not report['valid']:
+        return report
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as out:
+        csv.writer(out, lineterminator='\n').writerow(columns)
+        for shard_index, path in enumerate(shard_paths):
+            row_number = 0
+            for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size,
+                                     encoding='utf-8-sig'):
+                keep = []
+                for image_path in chunk[path_column]:
+                    keep.append(kept[shard_key(image_path, root)][:2] == (shard_index, row_number))
+                    row_number += 1
+                report['superseded'] += len(keep) - sum(keep)
+                chunk[keep].to_csv(out, header=False, index=False)
+                report['rows'] += sum(keep)
+    os.replace(tmp_path, output_path)
+    return report
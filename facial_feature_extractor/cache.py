@@ -0,0 +1,167 @@
+# facial_feature_extractor/cache.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Config entries that only change what `process_image` returns, not what is cached
+CACHE_INDEPENDENT_CONFIG_KEYS = ('result_profile', 'collect_timings', 'track_max_motion', 'track_max_scale_change',
+                                 'track_redetect_interval', 'track_search_margin', 'blink_ear_threshold',
+                                 'blink_min_frames')
+
+
+def hash_bytes(data: bytes) -> str:
+    """Returns the SHA-256 hex digest of a bytes object."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_config(config: dict) -> str:
+    """Returns a stable SHA-256 hex digest of the cache-relevant entries of an analyzer config."""
+    relevant = {k: v for k, v in config.items() if k not in CACHE_INDEPENDENT_CONFIG_KEYS}
+    return hash_bytes(json.dumps(relevant, sort_keys=True, default=str).encode('utf-8'))
+
+
+class ResultCache:
+    """
+    A persistent, content-addressed cache of analysis results backed by SQLite.
+
+    Entries are keyed by the hash of the image bytes combined with a namespace (the hash of
+    the analyzer config and shape predictor model), and hold the status, face area, face
+    rectangle, landmarks and features. When the total payload size exceeds `max_size_bytes`,
+    the least recently used entries are evicted.
+
+    The database file can be shared by several processes.
+    """
+
+    def __init__(self, db_path: str, max_size_bytes: int = 1 << 30):
+        """
+        Initializes the cache.
+
+        Args:
+            db_path (str): Path of the SQLite database file. It is created if missing.
+            max_size_bytes (int): Maximum total size of the stored payloads.
+        """
+        self.db_path = db_path
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the SQLite connection, reopening it after a fork."""
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, payload TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access)')
+            # The total payload size is kept up to date by triggers, so eviction checks do not scan the table
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self._conn.execute("INSERT OR IGNORE INTO cache_meta (name, value) "
+                               "SELECT 'total_size', COALESCE(SUM(size), 0) FROM results")
+            self._conn.execute("CREATE TRIGGER IF NOT EXISTS results_size_insert AFTER INSERT ON results BEGIN "
+                               "UPDATE cache_meta SET value = value + NEW.size WHERE name = 'total_size'; END")
+            self._conn.execute("CREATE TRIGGER IF NOT EXISTS results_size_delete AFTER DELETE ON results BEGIN "
+                               "UPDATE cache_meta SET value = value - OLD.size WHERE name = 'total_size'; END")
+            self._conn.execute("CREATE TRIGGER IF NOT EXISTS results_size_update AFTER UPDATE OF size ON results BEGIN "
+                               "UPDATE cache_meta SET value = value - OLD.size + NEW.size "
+                               "WHERE name = 'total_size'; END")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(image_bytes: bytes, namespace: str) -> str:
+        """Builds the cache key for an image within a namespace."""
+        return f"{hash_bytes(image_bytes)}:{namespace}"
+
+    def get(self, key: str) -> dict | None:
+        """
+        Looks up a cached entry.
+
+        Args:
+            key (str): A key built with `make_key`.
+
+        Returns:
+            dict | None: The cached entry, or None on a miss or error.
+        """
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute('SELECT payload FROM results WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute('UPDATE results SET last_access = ? WHERE key = ?', (time.time(), key))
+                conn.commit()
+            return json.loads(row[0])
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            print(f"Error reading from result cache: {e}")
+            return None
+
+    def put(self, key: str, entry: dict) -> bool:
+        """
+        Stores an entry, evicting the least recently used entries if the cache is over its size limit.
+
+        Args:
+            key (str): A key built with `make_key`.
+            entry (dict): A JSON-serializable entry.
+
+        Returns:
+            bool: True if the entry was stored.
+        """
+        try:
+            payload = json.dumps(entry)
+            with self._lock:
+                conn = self._connection()
+                # An upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger
+                conn.execute('INSERT INTO results (key, payload, size, last_access) VALUES (?, ?, ?, ?) '
+                             'ON CONFLICT (key) DO UPDATE SET payload = excluded.payload, size = excluded.size, '
+                             'last_access = excluded.last_access',
+                             (key, payload, len(payload), time.time()))
+                self._evict(conn)
+                conn.commit()
+            return True
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"Error writing to result cache: {e}")
+            return False
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Deletes the least recently used entries until the total size fits the limit."""
+        total_size = conn.execute("SELECT value FROM cache_meta WHERE name = 'total_size'").fetchone()[0]
+        excess = total_size - self.max_size_bytes
+        if excess <= 0:
+            return
+        evicted_keys = []
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY last_access'):
+            evicted_keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM results WHERE key = ?', evicted_keys)
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
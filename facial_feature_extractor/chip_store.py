@@ -0,0 +1,193 @@
+# facial_feature_extractor/chip_store.py
+import os
+import re
+import glob
+import json
+import uuid
+import numpy as np
+
+# Shard files: <prefix>_<writer>_<index>.json (chip shape and dtype), .chips (the raw chips, back to
+# back) and .index (one JSON-encoded image id per line; the chip of line i starts at i * chip bytes)
+SHARD_PREFIX = 'chips'
+SHARD_PATTERN = re.compile(rf'{SHARD_PREFIX}_([0-9a-zA-Z-]+)_(\d+)\.json$')
+
+
+def _shard_paths(base: str) -> tuple[str, str, str]:
+    return f"{base}.json", f"{base}.chips", f"{base}.index"
+
+
+def _existing_shard_bases(directory: str) -> list[str]:
+    bases = []
+    for path in glob.glob(os.path.join(directory, f"{SHARD_PREFIX}_*.json")):
+        if SHARD_PATTERN.search(os.path.basename(path)):
+            bases.append(path[:-len('.json')])
+    return sorted(bases)
+
+
+class ChipArchiveWriter:
+    """
+    Appends fixed-size uint8 face chips (e.g. the 256x256 aligned or final images) to packed
+    shard files, instead of writing one image file per face.
+
+    Chips are appended to the shard's data file as raw bytes and their ids to its index file,
+    and both are flushed after every chip, so a killed process loses at most the chip being
+    written. Every writer gets its own shard files (named after `writer_name`), so the workers
+    of a batch run can write to the same directory without coordinating.
+    """
+
+    def __init__(self, directory: str, shard_size: int = 10000, writer_name: str | None = None,
+                 chip_shape: tuple[int, ...] | None = None):
+        """
+        Initializes the writer.
+
+        Args:
+            directory (str): Directory of the archive. It is created if missing.
+            shard_size (int): Number of chips per shard.
+            writer_name (str, optional): Unique name of this writer (letters, digits and '-');
+                                         a random one is chosen by default.
+            chip_shape (tuple[int, ...], optional): Shape of every chip, e.g. (256, 256) or
+                                                   (256, 256, 3). Taken from the first chip if not given.
+        """
+        self.directory = directory
+        self.shard_size = max(1, shard_size)
+        self.writer_name = writer_name or uuid.uuid4().hex[:12]
+        self.chip_shape = tuple(chip_shape) if chip_shape else None
+        os.makedirs(directory, exist_ok=True)
+        existing = [base for base in _existing_shard_bases(directory)
+                    if os.path.basename(base).startswith(f"{SHARD_PREFIX}_{self.writer_name}_")]
+        self._next_shard = int(existing[-1].rsplit('_', 1)[1]) + 1 if existing else 0
+        self._shard_base = None
+        self._chips_file = None
+        self._index_file = None
+        self._shard_count = 0
+
+    def add(self, image_id: str, chip: np.ndarray) -> tuple[str, int] | None:
+        """
+        Appends one chip.
+
+        Returns:
+            tuple[str, int] | None: The shard data file and the chip's row in it, or None if
+                                    the chip was missing or did not match the archive's shape.
+        """
+        if chip is None:
+            return None
+        chip = np.asarray(chip)
+        if self.chip_shape is None:
+            self.chip_shape = chip.shape
+        if chip.shape != self.chip_shape or chip.dtype != np.uint8:
+            print(f"Skipping chip of {image_id}: expected uint8 {self.chip_shape}, got {chip.dtype} {chip.shape}")
+            return None
+
+        if self._chips_file is None:
+            self._open_shard()
+        row = self._shard_count
+        self._chips_file.write(np.ascontiguousarray(chip).tobytes())
+        self._chips_file.flush()
+        self._index_file.write(json.dumps(str(image_id)) + '\n')
+        self._index_file.flush()
+        self._shard_count += 1
+        chips_path = _shard_paths(self._shard_base)[1]
+        if self._shard_count >= self.shard_size:
+            self._close_shard()
+        return chips_path, row
+
+    def _open_shard(self):
+        self._shard_base = os.path.join(self.directory, f"{SHARD_PREFIX}_{self.writer_name}_{self._next_shard:05d}")
+        meta_path, chips_path, index_path = _shard_paths(self._shard_base)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'shape': list(self.chip_shape), 'dtype': 'uint8'}, f)
+        self._chips_file = open(chips_path, 'wb')
+        self._index_file = open(index_path, 'w', encoding='utf-8')
+        self._shard_count = 0
+        self._next_shard += 1
+
+    def _close_shard(self):
+        if self._chips_file is None:
+            return
+        self._chips_file.close()
+        self._index_file.close()
+        self._chips_file = None
+        self._index_file = None
+
+    def close(self):
+        """Closes the current shard."""
+        self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ChipArchive:
+    """
+    Read access to a directory written by one or more `ChipArchiveWriter`s.
+
+    Each shard's data file is memory-mapped once, so sequential iteration and random lookups
+    by position or image id read only the requested chips, without opening a file per chip.
+    Chips a writer has not finished writing are ignored.
+    """
+
+    def __init__(self, directory: str):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"Chip archive not found at: {directory}")
+        self.directory = directory
+        self.shard_bases = _existing_shard_bases(directory)
+        self._shards = [None] * len(self.shard_bases)
+        self._offsets = None
+        self._index = None
+
+    def _load_shard(self, shard_number: int) -> tuple[list[str], np.ndarray]:
+        """Returns the ids and the memory-mapped chips (N, *shape) of a shard, loading them on first use."""
+        if self._shards[shard_number] is None:
+            meta_path, chips_path, index_path = _shard_paths(self.shard_bases[shard_number])
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            shape = tuple(meta['shape'])
+            chip_bytes = int(np.prod(shape))
+            with open(index_path, 'r', encoding='utf-8') as f:
+                ids = [json.loads(line) for line in f if line.endswith('\n')]
+            count = min(len(ids), os.path.getsize(chips_path) // chip_bytes)
+            chips = np.memmap(chips_path, dtype=np.uint8, mode='r', shape=(count, *shape)) if count \
+                else np.empty((0, *shape), dtype=np.uint8)
+            self._shards[shard_number] = (ids[:count], chips)
+        return self._shards[shard_number]
+
+    def __len__(self) -> int:
+        if self._offsets is None:
+            self._offsets = np.cumsum([0] + [len(self._load_shard(i)[0]) for i in range(len(self.shard_bases))])
+        return int(self._offsets[-1])
+
+    def __getitem__(self, position: int) -> np.ndarray:
+        """Returns the chip at a position across all shards (in shard order)."""
+        length = len(self)
+        if position < 0:
+            position += length
+        if not 0 <= position < length:
+            raise IndexError(f"Chip position {position} out of range for {length} chips")
+        shard_number = int(np.searchsorted(self._offsets, position, side='right')) - 1
+        return np.array(self._load_shard(shard_number)[1][position - self._offsets[shard_number]])
+
+    def iter_shards(self):
+        """
+        Yields the shards of the archive in order.
+
+        Yields:
+            tuple[list[str], np.ndarray]: The image ids and the memory-mapped chips of one shard.
+        """
+        for shard_number in range(len(self.shard_bases)):
+            yield self._load_shard(shard_number)
+
+    def get(self, image_id: str) -> np.ndarray | None:
+        """Returns the chip of an image (the last one, if it was written repeatedly), or None if it is not in the archive."""
+        if self._index is None:
+            self._index = {}
+            for shard_number, (ids, _) in enumerate(self.iter_shards()):
+                for row, chip_id in enumerate(ids):
+                    self._index[chip_id] = (shard_number, row)
+        location = self._index.get(str(image_id))
+        if location is None:
+            return None
+        shard_number, row = location
+        return np.array(self._load_shard(shard_number)[1][row])
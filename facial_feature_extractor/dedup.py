@@ -0,0 +1,216 @@
+# facial_feature_extractor/dedup.py
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from .utils import read_image_bytes, decode_image_capped
+
+# Images are decoded reduced to about this many pixels for hashing (JPEGs at 1/2 to 1/8 size)
+HASH_DECODE_MAX_PIXELS = 256 * 256
+# Hash bits decided by a brightness difference below this many gray levels are noise. Images where
+# most bits are (flat or low-texture images) are not hashed, or they would all match each other.
+HASH_MIN_DIFFERENCE = 2
+
+
+def compute_dhash(gray: np.ndarray, hash_size: int = 8) -> int | None:
+    """
+    Computes the difference hash (dHash) of a grayscale image.
+
+    The image is shrunk to (hash_size + 1) x hash_size pixels and each bit records whether a
+    pixel is brighter than its right neighbour. Recompressed, resized or slightly recolored
+    copies of an image get hashes within a few bits of each other.
+
+    Args:
+        gray (np.ndarray): The grayscale image.
+        hash_size (int): Hash side length; the hash has hash_size ** 2 bits.
+
+    Returns:
+        int | None: The hash as an unsigned integer, or None if most of its bits would be
+                    decided by differences below HASH_MIN_DIFFERENCE (a flat or low-texture image).
+    """
+    thumbnail = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    differences = thumbnail[:, 1:] - thumbnail[:, :-1]
+    if np.count_nonzero(np.abs(differences) >= HASH_MIN_DIFFERENCE) < differences.size / 2:
+        return None
+    bits = (differences > 0).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def compute_image_dhash(image_path: str, hash_size: int = 8) -> tuple[int, tuple[int, int]] | None:
+    """
+    Computes the dHash of an image file, decoded at reduced size.
+
+    Returns:
+        tuple[int, tuple[int, int]] | None: The hash and the full-resolution (width, height) of
+                                            the image, or None if it cannot be read or hashed.
+    """
+    image_data = read_image_bytes(image_path)
+    if image_data is None:
+        return None
+    gray, scale = decode_image_capped(image_data, cv2.IMREAD_GRAYSCALE, HASH_DECODE_MAX_PIXELS)
+    if gray is None or gray.size == 0:
+        return None
+    hash_value = compute_dhash(gray, hash_size)
+    if hash_value is None:
+        return None
+    return hash_value, (round(gray.shape[1] / scale), round(gray.shape[0] / scale))
+
+
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+    """Returns the number of differing bits between two hashes."""
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class PerceptualHashIndex:
+    """
+    An in-memory index of perceptual hashes for Hamming-distance lookup.
+
+    The hash bits are split into max_distance + 1 bands. Two hashes within max_distance bits
+    of each other agree on at least one whole band, so a lookup only compares the entries
+    sharing a band with the query instead of scanning the whole index.
+    """
+
+    def __init__(self, max_distance: int = 4, hash_bits: int = 64):
+        """
+        Args:
+            max_distance (int): Maximum Hamming distance of a match.
+            hash_bits (int): Number of bits of the indexed hashes.
+        """
+        self.max_distance = max_distance
+        num_bands = min(max_distance + 1, hash_bits)
+        bounds = [round(i * hash_bits / num_bands) for i in range(num_bands + 1)]
+        self._bands = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._tables = [{} for _ in self._bands]
+        self.size = 0
+
+    def add(self, hash_value: int, key):
+        """Adds a hash with an associated key (e.g. the image path)."""
+        for (shift, mask), table in zip(self._bands, self._tables):
+            table.setdefault((hash_value >> shift) & mask, []).append((hash_value, key))
+        self.size += 1
+
+    def find(self, hash_value: int) -> tuple[object, int] | None:
+        """
+        Finds the closest indexed hash within max_distance bits.
+
+        Returns:
+            tuple[object, int] | None: The key of the match and its distance, or None.
+        """
+        best = None
+        for (shift, mask), table in zip(self._bands, self._tables):
+            for candidate, key in table.get((hash_value >> shift) & mask, ()):
+                distance = hamming_distance(hash_value, candidate)
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (key, distance)
+                    if distance == 0:
+                        return best
+        return best
+
+
+class NearDuplicateFilter:
+    """
+    Skips the analysis of images that are near-duplicates of an image seen earlier in a run,
+    and derives their results from the result of that image.
+
+    `filter` passes on the image paths to analyze and holds back the duplicates. Results of the
+    analyzed images are fed back through `add_result`; `pop_ready` then returns the results of
+    the duplicates whose original has finished, with 'duplicate_of' and 'duplicate_distance'
+    set. Results of originals are retained for later duplicates up to `max_retained_results`.
+
+    Results are only copied between images of the same dimensions, since pixel measurements
+    (face area, distances) do not carry over to a resized copy. A duplicate of another size, or
+    of an evicted original, is analyzed itself, but still reported as a duplicate.
+    """
+
+    def __init__(self, max_distance: int = 4, hash_size: int = 8, max_retained_results: int = 20_000,
+                 num_workers: int = 4):
+        """
+        Args:
+            max_distance (int): Maximum Hamming distance between the hashes of near-duplicates.
+            hash_size (int): Hash side length (see `compute_dhash`).
+            max_retained_results (int): Results of originals kept in memory for later duplicates.
+            num_workers (int): Threads reading and hashing images ahead of `filter`'s consumer.
+                               Decoding releases the GIL, so hashing does not gate the analysis pool.
+        """
+        self.hash_size = hash_size
+        self.index = PerceptualHashIndex(max_distance, hash_bits=hash_size ** 2)
+        self.max_retained_results = max_retained_results
+        self.num_workers = max(1, num_workers)
+        self.duplicates_found = 0
+        self._pending = set()  # Originals passed on for analysis whose result has not arrived yet
+        self._retained = OrderedDict()  # Original image path -> its result
+        self._waiting = {}  # Original image path -> [(duplicate path, distance)]
+        self._analyzed_duplicates = {}  # Duplicate analyzed itself -> (original path, distance)
+        self._ready = []
+
+    def filter(self, image_paths):
+        """
+        Yields the image paths that need analysis, in input order; near-duplicates of earlier
+        images are held back. Images that cannot be hashed are always passed on.
+        """
+        for image_path, hashed in self._hash_ahead(image_paths):
+            if hashed is None:
+                yield image_path
+                continue
+            hash_value, dimensions = hashed
+            match = self.index.find(hash_value)
+            if match is None:
+                self.index.add(hash_value, (image_path, dimensions))
+                self._pending.add(image_path)
+                yield image_path
+                continue
+
+            (original, original_dimensions), distance = match
+            self.duplicates_found += 1
+            if original_dimensions != dimensions:  # A resized copy: its pixel measurements differ
+                self._analyzed_duplicates[image_path] = (original, distance)
+                yield image_path
+            elif original in self._retained:
+                self._retained.move_to_end(original)
+                self._ready.append(self._duplicate_result(self._retained[original], image_path, original, distance))
+            elif original in self._pending:
+                self._waiting.setdefault(original, []).append((image_path, distance))
+            else:  # The original's result was evicted
+                self._analyzed_duplicates[image_path] = (original, distance)
+                yield image_path
+
+    def _hash_ahead(self, image_paths):
+        """Yields (image path, `compute_image_dhash` result) in input order, hashing a few images per thread ahead."""
+        max_ahead = 4 * self.num_workers
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='dedup-hash') as executor:
+            in_flight = deque()
+            for image_path in image_paths:
+                in_flight.append((image_path, executor.submit(compute_image_dhash, image_path, self.hash_size)))
+                if len(in_flight) >= max_ahead:
+                    image_path, future = in_flight.popleft()
+                    yield image_path, future.result()
+            while in_flight:
+                image_path, future = in_flight.popleft()
+                yield image_path, future.result()
+
+    def add_result(self, result: dict):
+        """Records the result of an analyzed image, releasing the duplicates waiting for it."""
+        image_path = result['image_path']
+        if image_path in self._analyzed_duplicates:
+            result['duplicate_of'], result['duplicate_distance'] = self._analyzed_duplicates.pop(image_path)
+            return
+        if image_path not in self._pending:
+            return
+        self._pending.discard(image_path)
+        for duplicate_path, distance in self._waiting.pop(image_path, ()):
+            self._ready.append(self._duplicate_result(result, duplicate_path, image_path, distance))
+        self._retained[image_path] = result
+        if len(self._retained) > self.max_retained_results:
+            self._retained.popitem(last=False)
+
+    def pop_ready(self) -> list[dict]:
+        """Returns (and forgets) the results of the duplicates whose original has finished."""
+        ready, self._ready = self._ready, []
+        return ready
+
+    @staticmethod
+    def _duplicate_result(original_result: dict, image_path: str, original: str, distance: int) -> dict:
+        result = dict(original_result)
+        result.update(image_path=image_path, duplicate_of=original, duplicate_distance=distance,
+                      timings=None, elapsed_seconds=None)
+        return result
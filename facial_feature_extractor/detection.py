@@ -1,10 +1,55 @@
 # facial_feature_extractor/detection.py
+import logging
 import dlib
 import numpy as np
 import cv2
 
 
-def detect_faces(image: np.ndarray, detector: dlib.fhog_object_detector, upsample=1):
+# Size (in pixels) of the sliding window of dlib's frontal face HOG detector.
+# Faces smaller than this are only found after upsampling.
+HOG_MIN_FACE_SIZE = 80
+
+
+def choose_detection_scale(image_shape: tuple, max_pixels: int | None = None,
+                           min_face_size: int | None = None, upsample: int = 0) -> float:
+    """
+    Picks the resolution (as a scale factor <= 1) at which to run face detection.
+
+    The pixel budget reduces the image, but never below the scale at which faces of
+    `min_face_size` still fill the detector window; if both are given and conflict, the face
+    size wins and the detection image exceeds the budget. With only `min_face_size`, the image
+    is reduced as far as those faces stay detectable.
+
+    Args:
+        image_shape (tuple): Shape of the original image.
+        max_pixels (int, optional): Pixel budget for the detection image.
+        min_face_size (int, optional): Smallest face side length (in original pixels) that must
+                                       still be detectable after downscaling.
+        upsample (int): Number of upsampling steps the detector will apply.
+
+    Returns:
+        float: The scale factor, 1.0 meaning full resolution.
+    """
+    height, width = image_shape[:2]
+    budget = None
+    if max_pixels and height * width > max_pixels:
+        budget = (max_pixels / float(height * width)) ** 0.5
+    # Each upsampling step halves the smallest face the detector can see
+    floor = HOG_MIN_FACE_SIZE / float(min_face_size * 2 ** upsample) if min_face_size else None
+
+    if budget is None:
+        scale = floor if floor is not None else 1.0
+    elif floor is None:
+        scale = budget
+    else:
+        if floor > budget:
+            logging.debug(f"Detection pixel budget {max_pixels} not honoured for a {width}x{height} image: "
+                          f"scale {floor:.3f} keeps {min_face_size}px faces detectable (budget scale {budget:.3f})")
+        scale = max(budget, floor)
+    return min(1.0, max(scale, 1e-3))
+
+
+def detect_faces(image: np.ndarray, detector: dlib.fhog_object_detector, upsample=1, scale: float = 1.0):
     """
     Detects faces in an image using a dlib HOG face detector.
 
@@ -12,6 +57,8 @@ def detect_faces(image: np.ndarray, detector: dlib.fhog_object_detector, upsampl
         image (np.ndarray): Input BGR image.
         detector: An initialized dlib face detector.
         upsample (int): Number of times to upsample the image to detect smaller faces.
+        scale (float): If below 1, detection runs on a copy of the image downscaled by this
+                       factor and the rectangles are mapped back to original coordinates.
 
     Returns:
         list[dlib.rectangle]: A list of detected face rectangles.
@@ -25,12 +72,106 @@ def detect_faces(image: np.ndarray, detector: dlib.fhog_object_detector, upsampl
         else:  # Assume it's already grayscale
             img_gray = image
 
-        return list(detector(img_gray, upsample))
+        if scale >= 1.0:
+            return list(detector(img_gray, upsample))
+
+        small_gray = cv2.resize(img_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return [scale_rectangle(rect, 1.0 / scale) for rect in detector(small_gray, upsample)]
     except Exception as e:
         print(f"Error during dlib face detection: {e}")
         return []
 
 
+def detect_faces_in_region(image: np.ndarray, detector: dlib.fhog_object_detector, region: dlib.rectangle,
+                           margin: float = 0.5, face_size: int = 2 * HOG_MIN_FACE_SIZE):
+    """
+    Detects faces only in the neighbourhood of an expected face rectangle (e.g. a tracked face).
+
+    The region, grown by `margin` times its size on every side, is cropped and resized so the
+    expected face is about `face_size` pixels wide, then scanned without upsampling. This costs
+    a fraction of a full-frame detection while still confirming that a face is there.
+
+    Args:
+        image (np.ndarray): Input grayscale image.
+        detector: An initialized dlib face detector.
+        region (dlib.rectangle): The expected face rectangle.
+        margin (float): Search margin around the region, relative to its width and height.
+        face_size (int): Side length (in pixels) the expected face is resized to.
+
+    Returns:
+        list[dlib.rectangle]: The faces found, in image coordinates.
+    """
+    if image is None or image.size == 0 or detector is None or region.is_empty():
+        return []
+    height, width = image.shape[:2]
+    left = max(0, int(region.left() - margin * region.width()))
+    top = max(0, int(region.top() - margin * region.height()))
+    right = min(width, int(region.right() + margin * region.width()) + 1)
+    bottom = min(height, int(region.bottom() + margin * region.height()) + 1)
+    if right - left < 2 or bottom - top < 2:
+        return []
+
+    scale = face_size / float(max(region.width(), region.height(), 1))
+    crop = image[top:bottom, left:right]
+    if scale != 1.0:
+        crop = cv2.resize(crop, None, fx=scale, fy=scale,
+                          interpolation=cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR)
+    try:
+        faces = detector(crop, 0)
+    except Exception as e:
+        print(f"Error during dlib face detection: {e}")
+        return []
+    return [dlib.translate_rect(scale_rectangle(rect, 1.0 / scale), dlib.point(left, top)) for rect in faces]
+
+
+def scale_rectangle(rect: dlib.rectangle, factor: float) -> dlib.rectangle:
+    """Scales a dlib rectangle's coordinates by a factor."""
+    return dlib.rectangle(int(round(rect.left() * factor)), int(round(rect.top() * factor)),
+                          int(round(rect.right() * factor)), int(round(rect.bottom() * factor)))
+
+
+def detect_faces_adaptive(image: np.ndarray, detector: dlib.fhog_object_detector, upsample_levels=(0, 1),
+                          min_face_area: int | None = None, max_pixels: int | None = None,
+                          min_face_size: int | None = None):
+    """
+    Detects faces with escalating upsampling, stopping at the first level that finds a face
+    (of at least `min_face_area` pixels, if given).
+
+    This is meant for finding the best face cheaply: the faces returned are those of the level
+    used, so smaller faces that only a later level would find are not included. Images without
+    any face run every level, each upsampling step scanning 4x the pixels of the previous one.
+
+    Args:
+        image (np.ndarray): Input BGR or grayscale image.
+        detector: An initialized dlib face detector.
+        upsample_levels (tuple[int, ...]): Upsampling levels to try, in order.
+        min_face_area (int, optional): Escalate if the largest face found is smaller than this.
+        max_pixels (int, optional): Pixel budget for the detection image, see `choose_detection_scale`.
+        min_face_size (int, optional): Smallest detectable face side, see `choose_detection_scale`.
+
+    Returns:
+        tuple[list[dlib.rectangle], int | None]: The detected face rectangles and the upsampling
+                                                 level that produced them (None if no face was found).
+    """
+    if image is None or image.size == 0 or detector is None:
+        return [], None
+
+    # Convert once and share the grayscale image between all levels
+    img_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) > 2 and image.shape[2] == 3 else image
+
+    faces, used_level = [], None
+    for level in upsample_levels:
+        scale = choose_detection_scale(img_gray.shape, max_pixels, min_face_size, level)
+        level_faces = detect_faces(img_gray, detector, level, scale=scale)
+        if not level_faces:
+            continue
+        faces, used_level = level_faces, level
+        best_face = get_best_face(level_faces)
+        if not min_face_area or best_face.width() * best_face.height() >= min_face_area:
+            break
+    return faces, used_level
+
+
 def get_best_face(detected_faces: list):
     """
     Selects the best face (the one with the largest area) from a list of dlib rectangles.
@@ -0,0 +1,305 @@
+# facial_feature_extractor/download.py
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import mimetypes
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from .cache import hash_file
+
+DEFAULT_EXTENSION = '.jpg'
+# HTTP statuses that are worth retrying
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def get_file_extension(content_type: str | None) -> str:
+    """Guesses file extension from MIME type."""
+    if not content_type:
+        return DEFAULT_EXTENSION
+    return mimetypes.guess_extension(content_type.split(';')[0].strip()) or DEFAULT_EXTENSION
+
+
+class RetryableHTTPError(requests.HTTPError):
+    """An HTTP error response (5xx or 429) that may succeed when retried."""
+
+
+class ImageDownloader:
+    """
+    Downloads images over a shared, pooled HTTP session.
+
+    Connections are reused across requests (and threads), the number of concurrent requests
+    per host is capped, responses are streamed to disk in chunks, and timeouts, connection
+    errors and 5xx/429 responses are retried with jittered exponential backoff.
+
+    All methods are thread-safe, so one downloader can serve a whole thread pool.
+    """
+
+    def __init__(self, save_dir: str, pool_size: int = 10, per_host_limit: int = 4, timeout: float = 15,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 10.0,
+                 chunk_size: int = 64 * 1024, session: requests.Session = None):
+        """
+        Initializes the downloader.
+
+        Args:
+            save_dir (str): Directory the images are saved to.
+            pool_size (int): Maximum number of pooled connections per host.
+            per_host_limit (int): Maximum number of concurrent requests to one host.
+            timeout (float): Connect and read timeout in seconds, per attempt.
+            max_retries (int): Number of retries after the first attempt.
+            backoff_base (float): Base delay in seconds; attempt n waits about base * 2**n.
+            backoff_max (float): Upper bound of a single backoff delay.
+            chunk_size (int): Size of the chunks streamed to disk.
+            session (requests.Session, optional): Session to use instead of a new pooled one.
+        """
+        self.save_dir = save_dir
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.chunk_size = chunk_size
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self.bytes_downloaded = 0
+        self.files_downloaded = 0
+        self.start_time = time.time()
+
+    def _host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_limits[host]
+
+    def _backoff(self, attempt: int):
+        """Sleeps before retry number `attempt` (0-based), with full jitter."""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        time.sleep(random.uniform(0, delay))
+
+    def _request(self, url: str, handle_response, headers: dict = None):
+        """
+        Sends a GET request with retries and passes the successful streaming response to
+        `handle_response`, returning its result.
+        """
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._backoff(attempt - 1)
+            try:
+                with self._host_semaphore(url):
+                    with self.session.get(url, timeout=self.timeout, stream=True, headers=headers) as response:
+                        if response.status_code in RETRY_STATUSES:
+                            raise RetryableHTTPError(f"{response.status_code} Server Error for url: {url}",
+                                                     response=response)
+                        response.raise_for_status()
+                        return handle_response(response)
+            except (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    RetryableHTTPError) as e:
+                last_error = e
+        raise last_error
+
+    def _record(self, num_bytes: int):
+        with self._lock:
+            self.bytes_downloaded += num_bytes
+            self.files_downloaded += 1
+
+    def fetch_bytes(self, url: str, headers: dict = None) -> tuple[bytes, str | None]:
+        """
+        Downloads a URL into memory.
+
+        Returns:
+            tuple[bytes, str | None]: The response body and its Content-Type header.
+
+        Raises:
+            requests.RequestException: If the download fails after all retries.
+        """
+        def read_body(response):
+            body = b''.join(response.iter_content(self.chunk_size))
+            return body, response.headers.get('Content-Type')
+
+        body, content_type = self._request(url, read_body, headers)
+        self._record(len(body))
+        return body, content_type
+
+    def download(self, url: str, id_val, validators: dict = None) -> dict:
+        """
+        Downloads a single image and streams it to `<save_dir>/<id_val><ext>`.
+
+        Args:
+            url (str): URL of the image.
+            id_val: ID used as the file name.
+            validators (dict, optional): 'etag' and/or 'last_modified' of a previously downloaded
+                                         copy, sent as If-None-Match / If-Modified-Since. If the
+                                         server answers 304 Not Modified, nothing is written.
+
+        Returns:
+            dict: 'image_filepath' (None on failure or when not modified), 'error', 'bytes',
+                  'content_type', 'etag', 'last_modified', 'sha256' and 'not_modified'.
+        """
+        result = {'image_filepath': None, 'error': None, 'bytes': 0, 'content_type': None,
+                  'etag': None, 'last_modified': None, 'sha256': None, 'not_modified': False}
+        if not isinstance(url, str) or not url.startswith('http'):
+            result['error'] = f'Invalid URL format: {url}'
+            return result
+
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        def save_body(response):
+            if response.status_code == 304:
+                return None
+            content_type = response.headers.get('Content-Type')
+            filepath = os.path.join(self.save_dir, f"{str(id_val).strip()}{get_file_extension(content_type)}")
+            # Stream to a temporary file so an interrupted download never leaves a partial image
+            tmp_path = f"{filepath}.part"
+            num_bytes = 0
+            digest = hashlib.sha256()
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(self.chunk_size):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        num_bytes += len(chunk)
+                os.replace(tmp_path, filepath)
+            except BaseException:
+                # A failed attempt (e.g. a truncated body) must not leave the partial file behind
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            return {'image_filepath': filepath, 'bytes': num_bytes, 'content_type': content_type,
+                    'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                    'sha256': digest.hexdigest()}
+
+        try:
+            saved = self._request(url, save_body, headers or None)
+            if saved is None:
+                result['not_modified'] = True
+            else:
+                self._record(saved['bytes'])
+                result.update(saved)
+        except requests.RequestException as e:
+            result['error'] = str(e)
+        except IOError as e:
+            result['error'] = f"File save error: {e}"
+        return result
+
+    def throughput(self) -> dict:
+        """Returns the files and bytes downloaded so far, and the rates since initialization."""
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        with self._lock:
+            return {
+                'files': self.files_downloaded,
+                'bytes': self.bytes_downloaded,
+                'elapsed_seconds': elapsed,
+                'files_per_second': self.files_downloaded / elapsed,
+                'megabytes_per_second': self.bytes_downloaded / elapsed / 1e6,
+            }
+
+    def close(self):
+        """Closes the pooled connections."""
+        self.session.close()
+
+
+class DownloadState:
+    """
+    A small JSON file recording, per ID, what was downloaded: the URL, the ETag and
+    Last-Modified validators, the local file path with its size and SHA-256, and when the
+    copy was last checked against the server. It lets repeated runs over a growing manifest
+    skip images that are already on disk and revalidate them with conditional requests.
+
+    Updates are thread-safe; nothing is written until `save` is called.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializes the state, loading `path` if it exists.
+
+        Args:
+            path (str): Path of the JSON state file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error reading download state {path}, starting from an empty state: {e}")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, id_val) -> dict | None:
+        """Returns the entry of an ID, or None if it was never downloaded."""
+        with self._lock:
+            return self.entries.get(str(id_val).strip())
+
+    def update(self, id_val, url: str, download_result: dict):
+        """
+        Records the outcome of `ImageDownloader.download` for an ID. Failed downloads are
+        not recorded; a 304 Not Modified only refreshes the check time.
+        """
+        key = str(id_val).strip()
+        with self._lock:
+            if download_result.get('not_modified') and key in self.entries:
+                self.entries[key]['checked_at'] = time.time()
+                return
+            if not download_result.get('image_filepath'):
+                return
+            self.entries[key] = {
+                'url': url,
+                'etag': download_result.get('etag'),
+                'last_modified': download_result.get('last_modified'),
+                'image_filepath': download_result['image_filepath'],
+                'size': download_result.get('bytes'),
+                'sha256': download_result.get('sha256'),
+                'checked_at': time.time(),
+            }
+
+    def adopt(self, id_val, url: str, image_filepath: str):
+        """Records a file that is already on disk but has no entry, e.g. from a run before the state existed."""
+        self.update(id_val, url, {'image_filepath': image_filepath, 'bytes': os.path.getsize(image_filepath),
+                                  'sha256': hash_file(image_filepath)})
+
+    def is_valid(self, id_val, url: str, verify_hash: bool = False) -> bool:
+        """
+        Whether the recorded copy of an ID can be reused: it was downloaded from the same URL
+        and the file still exists with the recorded size (and SHA-256, if `verify_hash`).
+        """
+        entry = self.get(id_val)
+        if entry is None or entry.get('url') != url:
+            return False
+        filepath = entry.get('image_filepath')
+        if not filepath or not os.path.isfile(filepath) or os.path.getsize(filepath) != entry.get('size'):
+            return False
+        return not verify_hash or hash_file(filepath) == entry.get('sha256')
+
+    def save(self):
+        """Writes the state to its file."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            content = json.dumps(self.entries, ensure_ascii=False)
+        # Write to a temporary file first so an interrupted save never corrupts the state
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
@@ -52,12 +52,13 @@ def apply_optional_enhancements(
         config (dict): A dictionary specifying which enhancements to apply.
 
     Returns:
-        np.ndarray: The processed image.
+        np.ndarray: The processed image. Every enabled step returns a new array, so the input
+                    is never modified; if no step is enabled, the input itself is returned.
     """
     if image is None:
         return None
 
-    processed_image = image.copy()
+    processed_image = image
 
     if config.get('apply_bilateral_filter'):
         processed_image = apply_bilateral_filter(
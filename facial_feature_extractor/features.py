@@ -1,8 +1,9 @@
 # facial_feature_extractor/features.py
 import math
+import itertools
+from functools import lru_cache
 import numpy as np
 import pandas as pd
-from .utils import calculate_distance
 
 # --- Landmark Point Indices (for clarity in calculations) ---
 # (Copied from the top of the original step3 script for self-containment)
@@ -88,62 +89,222 @@ def calculate_all_features(landmarks: list[tuple[int, int]]) -> dict:
     Returns:
         dict: A dictionary where keys are feature names and values are the calculated feature values.
     """
-    features = {name: np.nan for name in ALL_FEATURE_NAMES}
+    return calculate_features(landmarks, ALL_FEATURE_NAMES)
+
+
+# --- Feature Registry ---
+# Each registered quantity declares the quantities it is computed from. Quantities whose
+# name starts with an underscore are shared intermediates; all others are output features.
+# Registered functions receive the (N, 68, 2) float landmarks followed by the values of
+# their dependencies, and return one value per face.
+FEATURE_REGISTRY = {}
+
+
+def register_feature(name: str, dependencies: tuple[str, ...] = ()):
+    """Decorator that registers a vectorized feature (or intermediate) function under `name`."""
+    def decorator(fn):
+        FEATURE_REGISTRY[name] = (tuple(dependencies), fn)
+        return fn
+    return decorator
+
+
+def _batch_distance(landmarks: np.ndarray, i: int, j: int) -> np.ndarray:
+    """Euclidean distance between landmark i and landmark j for every face in a batch."""
+    diff = landmarks[:, i, :] - landmarks[:, j, :]
+    return np.sqrt(diff[:, 0] ** 2 + diff[:, 1] ** 2)
+
+
+def _batch_safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Element-wise division that yields NaN wherever the denominator is not positive."""
+    out = np.full(numerator.shape, np.nan)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    return out
+
+
+# --- Shared Intermediates ---
+@register_feature('_eye_width_right')
+def _eye_width_right(lm):
+    return _batch_distance(lm, 36, 39)
+
+
+@register_feature('_eye_width_left')
+def _eye_width_left(lm):
+    return _batch_distance(lm, 45, 42)
+
+
+@register_feature('_eye_opening_right')
+def _eye_opening_right(lm):
+    return _batch_distance(lm, 37, 41) + _batch_distance(lm, 38, 40)
+
+
+@register_feature('_eye_opening_left')
+def _eye_opening_left(lm):
+    return _batch_distance(lm, 43, 47) + _batch_distance(lm, 44, 46)
+
+
+# --- Basic Distances ---
+@register_feature('face_width_max_jaw')
+def _face_width_max_jaw(lm):
+    return _batch_distance(lm, JAW_RIGHT_END, JAW_LEFT_END)
+
+
+@register_feature('face_height_nose_bridge_to_chin')
+def _face_height_nose_bridge_to_chin(lm):
+    return np.abs(lm[:, NOSE_BRIDGE_TOP, 1] - lm[:, CHIN_TIP, 1])
+
+
+@register_feature('mouth_width_corners')
+def _mouth_width_corners(lm):
+    return _batch_distance(lm, MOUTH_CORNER_RIGHT, MOUTH_CORNER_LEFT)
+
+
+@register_feature('inter_ocular_distance_inner')
+def _inter_ocular_distance_inner(lm):
+    return _batch_distance(lm, RIGHT_EYE_INNER_CORNER, LEFT_EYE_INNER_CORNER)
+
+
+@register_feature('nose_length')
+def _nose_length(lm):
+    return _batch_distance(lm, NOSE_BRIDGE_TOP, NOSE_TIP)
+
+
+@register_feature('nose_width_nostrils')
+def _nose_width_nostrils(lm):
+    return _batch_distance(lm, NOSTRIL_RIGHT, NOSTRIL_LEFT)
+
+
+# --- Eye Features (EAR) ---
+@register_feature('eye_aspect_ratio_right', ('_eye_opening_right', '_eye_width_right'))
+def _eye_aspect_ratio_right(lm, opening, width):
+    return _batch_safe_divide(opening, 2.0 * width)
+
+
+@register_feature('eye_aspect_ratio_left', ('_eye_opening_left', '_eye_width_left'))
+def _eye_aspect_ratio_left(lm, opening, width):
+    return _batch_safe_divide(opening, 2.0 * width)
+
+
+@register_feature('avg_ear', ('eye_aspect_ratio_right', 'eye_aspect_ratio_left'))
+def _avg_ear(lm, ear_right, ear_left):
+    return (ear_right + ear_left) / 2.0
+
+
+# --- Emotion-related Cues ---
+@register_feature('tension_eyebrow_gap_horizontal_dist')
+def _tension_eyebrow_gap_horizontal_dist(lm):
+    return np.abs(lm[:, RIGHT_EYEBROW_INNER_END, 0] - lm[:, LEFT_EYEBROW_INNER_END, 0])
+
+
+@register_feature('smile_mouth_width_corners_dist', ('mouth_width_corners',))
+def _smile_mouth_width_corners_dist(lm, mouth_width):
+    return mouth_width
+
+
+@register_feature('smile_lip_corner_pull_up_avg_y')
+def _smile_lip_corner_pull_up_avg_y(lm):
+    mouth_center_y = (lm[:, LIP_TOP_OUTER, 1] + lm[:, LIP_BOTTOM_OUTER, 1]) / 2.0
+    return mouth_center_y - (lm[:, MOUTH_CORNER_LEFT, 1] + lm[:, MOUTH_CORNER_RIGHT, 1]) / 2.0
+
+
+def resolve_feature_dependencies(feature_names: list[str]) -> list[str]:
+    """
+    Returns the registered quantities needed to compute `feature_names`, in evaluation order
+    (every quantity after its dependencies). Each quantity appears once.
+
+    Raises:
+        ValueError: If a name is neither a registered quantity nor in ALL_FEATURE_NAMES, or
+                    names a shared intermediate (starting with an underscore).
+    """
+    order, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Circular feature dependency involving '{name}'")
+        visiting.add(name)
+        for dependency in FEATURE_REGISTRY[name][0]:
+            visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in feature_names:
+        if name.startswith('_'):
+            raise ValueError(f"'{name}' is an intermediate quantity, not a feature")
+        if name in FEATURE_REGISTRY:
+            visit(name)
+        elif name not in ALL_FEATURE_NAMES:
+            raise ValueError(f"Unknown feature name: '{name}'")
+    return order
+
+
+@lru_cache(maxsize=256)
+def _evaluation_order(feature_names: tuple[str, ...]) -> tuple[str, ...]:
+    """Cached `resolve_feature_dependencies`, as the same subset is requested for every face."""
+    return tuple(resolve_feature_dependencies(list(feature_names)))
+
+
+def _evaluate_features(landmarks: np.ndarray, feature_names: list[str]) -> dict:
+    """Evaluates the registered quantities needed for `feature_names` on (N, 68, 2) float landmarks."""
+    values = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name in _evaluation_order(tuple(feature_names)):
+            dependencies, fn = FEATURE_REGISTRY[name]
+            values[name] = fn(landmarks, *(values[d] for d in dependencies))
+    return values
+
+
+def calculate_features_batch(landmarks: np.ndarray, feature_names: list[str] | None = None) -> pd.DataFrame:
+    """
+    Calculates geometric features for a batch of faces using vectorized NumPy operations.
+
+    This is the batch counterpart of `calculate_features` and produces the same values for
+    every face. Only the registered quantities needed for `feature_names` are evaluated,
+    and shared intermediates are computed once. Rows containing NaN coordinates (e.g. faces
+    whose landmarks are missing) yield NaN features instead of raising.
+
+    Args:
+        landmarks (np.ndarray): An array of shape (N, 68, 2) holding the (x, y) landmark
+                                coordinates of N faces.
+        feature_names (list[str], optional): The features to compute. Defaults to ALL_FEATURE_NAMES.
+
+    Returns:
+        pd.DataFrame: A DataFrame with N rows and one column per requested feature.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    if landmarks.ndim != 3 or landmarks.shape[1:] != (68, 2):
+        raise ValueError(f"Expected landmarks of shape (N, 68, 2), got {landmarks.shape}")
+    feature_names = list(ALL_FEATURE_NAMES if feature_names is None else feature_names)
+
+    values = _evaluate_features(landmarks, feature_names)
+    num_faces = landmarks.shape[0]
+    df = pd.DataFrame({name: values.get(name, np.full(num_faces, np.nan)) for name in feature_names},
+                      columns=feature_names)
+    # Final cleanup of values, as in the single-face path
+    return df.replace([np.inf, -np.inf], np.nan)
+
+
+def calculate_features(landmarks: list[tuple[int, int]], feature_names: list[str] | None = None) -> dict:
+    """
+    Calculates a subset of the geometric features for one face, evaluating only what the
+    requested features depend on. Uses the registry of `calculate_features_batch` on a single
+    row, but with NumPy only, as building a DataFrame would dominate the cost for one face.
+
+    Args:
+        landmarks (list[tuple[int, int]]): A list of 68 (x,y) tuples for facial landmarks.
+        feature_names (list[str], optional): The features to compute. Defaults to ALL_FEATURE_NAMES.
+
+    Returns:
+        dict: A dictionary where keys are the requested feature names and values are the calculated values.
+    """
+    feature_names = list(ALL_FEATURE_NAMES if feature_names is None else feature_names)
     if not landmarks or len(landmarks) != 68:
-        return features
-
-    try:
-        # --- Basic Distances ---
-        features['face_width_max_jaw'] = calculate_distance(landmarks[JAW_RIGHT_END], landmarks[JAW_LEFT_END])
-        features['face_height_nose_bridge_to_chin'] = abs(landmarks[NOSE_BRIDGE_TOP][1] - landmarks[CHIN_TIP][1])
-        features['mouth_width_corners'] = calculate_distance(landmarks[MOUTH_CORNER_RIGHT],
-                                                             landmarks[MOUTH_CORNER_LEFT])
-        features['inter_ocular_distance_inner'] = calculate_distance(landmarks[RIGHT_EYE_INNER_CORNER],
-                                                                     landmarks[LEFT_EYE_INNER_CORNER])
-        features['nose_length'] = calculate_distance(landmarks[NOSE_BRIDGE_TOP], landmarks[NOSE_TIP])
-        features['nose_width_nostrils'] = calculate_distance(landmarks[NOSTRIL_RIGHT], landmarks[NOSTRIL_LEFT])
-
-        # --- Eye Features (EAR) ---
-        re_outer, re_inner = landmarks[36], landmarks[39]
-        le_outer, le_inner = landmarks[45], landmarks[42]
-
-        re_p2, re_p6 = landmarks[37], landmarks[41]
-        re_p3, re_p5 = landmarks[38], landmarks[40]
-        re_ear_num = calculate_distance(re_p2, re_p6) + calculate_distance(re_p3, re_p5)
-        re_ear_den = 2.0 * calculate_distance(re_outer, re_inner)
-        features['eye_aspect_ratio_right'] = re_ear_num / re_ear_den if re_ear_den > 0 else np.nan
-
-        le_p2, le_p6 = landmarks[43], landmarks[47]
-        le_p3, le_p5 = landmarks[44], landmarks[46]
-        le_ear_num = calculate_distance(le_p2, le_p6) + calculate_distance(le_p3, le_p5)
-        le_ear_den = 2.0 * calculate_distance(le_outer, le_inner)
-        features['eye_aspect_ratio_left'] = le_ear_num / le_ear_den if le_ear_den > 0 else np.nan
-
-        if pd.notna(features['eye_aspect_ratio_right']) and pd.notna(features['eye_aspect_ratio_left']):
-            features['avg_ear'] = (features['eye_aspect_ratio_right'] + features['eye_aspect_ratio_left']) / 2.0
-
-        # --- Emotion-related Cues ---
-        features['tension_eyebrow_gap_horizontal_dist'] = abs(
-            landmarks[RIGHT_EYEBROW_INNER_END][0] - landmarks[LEFT_EYEBROW_INNER_END][0])
-        features['smile_mouth_width_corners_dist'] = features['mouth_width_corners']
-
-        mouth_center_y = (landmarks[LIP_TOP_OUTER][1] + landmarks[LIP_BOTTOM_OUTER][1]) / 2.0
-        left_corner_y = landmarks[MOUTH_CORNER_LEFT][1]
-        right_corner_y = landmarks[MOUTH_CORNER_RIGHT][1]
-        features['smile_lip_corner_pull_up_avg_y'] = mouth_center_y - (left_corner_y + right_corner_y) / 2.0
-
-        # ... and so on for all other features. The full calculation logic from your
-        # original `step3_feature_calculations.py` would be placed here.
-        # This is a truncated example.
-
-    except (IndexError, TypeError, ZeroDivisionError) as e:
-        print(f"Error during feature calculation: {e}")
-        # Return a dictionary of NaNs on error
-        return {name: np.nan for name in ALL_FEATURE_NAMES}
-
-    # Final cleanup of values
-    for key, value in features.items():
-        if isinstance(value, (float, int)) and (math.isinf(value) or math.isnan(value)):
-            features[key] = np.nan
-
-    return features
\ No newline at end of file
+        return {name: np.nan for name in feature_names}
+    points = np.fromiter(itertools.chain.from_iterable(landmarks), dtype=np.float64, count=136).reshape(1, 68, 2)
+    values = _evaluate_features(points, feature_names)
+    features = {}
+    for name in feature_names:
+        value = values[name].item() if name in values else np.nan
+        features[name] = value if math.isfinite(value) else np.nan
+    return features
@@ -0,0 +1,235 @@
+# facial_feature_extractor/landmark_store.py
+import os
+import re
+import glob
+import numpy as np
+
+# Shard files: <prefix>_<index>.landmarks.npy (int16, N x 68 x 2) and <prefix>_<index>.ids.npy (str, N).
+# The shard being filled is kept as <prefix>_<index>.landmarks.part (raw int16 rows) and
+# <prefix>_<index>.ids.part (one id per line) until it is full.
+SHARD_PREFIX = 'shard'
+SHARD_PATTERN = re.compile(rf'{SHARD_PREFIX}_(\d+)\.landmarks\.npy$')
+PART_PATTERN = re.compile(rf'{SHARD_PREFIX}_(\d+)\.ids\.part$')
+LANDMARK_DTYPE = np.int16
+ROW_BYTES = 68 * 2 * np.dtype(LANDMARK_DTYPE).itemsize
+
+
+def _shard_paths(directory: str, shard_index: int) -> tuple[str, str]:
+    base = os.path.join(directory, f"{SHARD_PREFIX}_{shard_index:05d}")
+    return f"{base}.landmarks.npy", f"{base}.ids.npy"
+
+
+def _part_paths(directory: str, shard_index: int) -> tuple[str, str]:
+    base = os.path.join(directory, f"{SHARD_PREFIX}_{shard_index:05d}")
+    return f"{base}.landmarks.part", f"{base}.ids.part"
+
+
+def _existing_shard_indices(directory: str, pattern: re.Pattern = SHARD_PATTERN) -> list[int]:
+    indices = []
+    for path in glob.glob(os.path.join(directory, f"{SHARD_PREFIX}_*")):
+        match = pattern.search(os.path.basename(path))
+        if match:
+            indices.append(int(match.group(1)))
+    return sorted(indices)
+
+
+def _read_part(directory: str, shard_index: int, mmap: bool = True) -> tuple[np.ndarray, np.ndarray]:
+    """Reads the complete rows of an open shard: (ids, landmarks), ignoring a partly written last row."""
+    landmarks_path, ids_path = _part_paths(directory, shard_index)
+    with open(ids_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    ids = content.split('\n')[:-1]  # Only newline-terminated ids are complete
+    count = min(len(ids), os.path.getsize(landmarks_path) // ROW_BYTES) if os.path.exists(landmarks_path) else 0
+    ids = np.array(ids[:count], dtype=str)
+    if count == 0:
+        return ids, np.empty((0, 68, 2), dtype=LANDMARK_DTYPE)
+    if mmap:
+        return ids, np.memmap(landmarks_path, dtype=LANDMARK_DTYPE, mode='r', shape=(count, 68, 2))
+    return ids, np.fromfile(landmarks_path, dtype=LANDMARK_DTYPE, count=count * 68 * 2).reshape(count, 68, 2)
+
+
+class LandmarkStoreWriter:
+    """
+    Appends landmark sets to a directory of compact `.npy` shards.
+
+    Each shard holds an int16 array of shape (N, 68, 2) and a matching array of image ids.
+    The shard being filled is appended to on every `flush` (call it whenever the buffered
+    images are recorded elsewhere, e.g. checkpointed to a CSV) and written as `.npy` files once
+    it holds `shard_size` sets, so checkpoints do not cut shards short. A crash loses at most
+    the sets added since the last `flush`. Writing to a directory that already holds shards
+    continues the open shard, or starts one after the last.
+    """
+
+    def __init__(self, directory: str, shard_size: int = 100000, overwrite: bool = False):
+        """
+        Initializes the writer.
+
+        Args:
+            directory (str): Directory of the store. It is created if missing.
+            shard_size (int): Maximum number of landmark sets per shard.
+            overwrite (bool): If True, existing shards in the directory are deleted first.
+        """
+        self.directory = directory
+        self.shard_size = max(1, shard_size)
+        os.makedirs(directory, exist_ok=True)
+        if overwrite:
+            shard_indices = _existing_shard_indices(directory) + _existing_shard_indices(directory, PART_PATTERN)
+            for shard_index in set(shard_indices):
+                for path in _shard_paths(directory, shard_index) + _part_paths(directory, shard_index):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        self._next_shard = 0
+        self._part_count = 0  # Sets already appended to the open shard
+        for shard_index in _existing_shard_indices(directory, PART_PATTERN):
+            if os.path.exists(_shard_paths(directory, shard_index)[1]):
+                self._remove_part(shard_index)  # Interrupted after the shard was written
+            else:
+                self._next_shard = shard_index
+        sealed = [i for i in _existing_shard_indices(directory) if os.path.exists(_shard_paths(directory, i)[1])]
+        if sealed and sealed[-1] >= self._next_shard:
+            self._next_shard = sealed[-1] + 1
+        if os.path.exists(_part_paths(directory, self._next_shard)[1]):
+            # Continue the open shard, dropping a row the crash left half written
+            ids, landmarks = _read_part(directory, self._next_shard, mmap=False)
+            self._remove_part(self._next_shard)
+            if len(ids):
+                self._append_part(list(ids), list(landmarks))
+        self._ids = []
+        self._landmarks = []
+
+    def add(self, image_id: str, landmarks: list[tuple[int, int]] | np.ndarray | None) -> bool:
+        """
+        Buffers the landmarks of one image, writing a shard once it is full.
+
+        Returns:
+            bool: False if the landmarks were missing or malformed and were skipped.
+        """
+        if landmarks is None:
+            return False
+        points = np.asarray(landmarks)
+        if points.shape != (68, 2):
+            print(f"Skipping landmarks of {image_id}: expected shape (68, 2), got {points.shape}")
+            return False
+        self._ids.append(str(image_id))
+        self._landmarks.append(np.rint(points).astype(LANDMARK_DTYPE))
+        if self._part_count + len(self._ids) >= self.shard_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Persists the buffered landmark sets, appending them to the open shard and writing it out once full."""
+        if self._ids:
+            self._append_part(self._ids, self._landmarks)
+            self._ids = []
+            self._landmarks = []
+        if self._part_count >= self.shard_size:
+            self._seal()
+
+    def close(self):
+        """Writes any remaining landmark sets, including the open shard."""
+        self.flush()
+        if self._part_count:
+            self._seal()
+
+    def _append_part(self, ids: list[str], landmarks: list[np.ndarray]):
+        landmarks_path, ids_path = _part_paths(self.directory, self._next_shard)
+        # Landmarks first: a row only counts once its id line is complete
+        with open(landmarks_path, 'ab') as f:
+            f.write(np.stack(landmarks).astype(LANDMARK_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(ids_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(f"{image_id}\n" for image_id in ids))
+            f.flush()
+            os.fsync(f.fileno())
+        self._part_count += len(ids)
+
+    def _seal(self):
+        ids, landmarks = _read_part(self.directory, self._next_shard, mmap=False)
+        landmarks_path, ids_path = _shard_paths(self.directory, self._next_shard)
+        # Write the ids last: a shard only counts as complete once both files exist
+        np.save(landmarks_path, landmarks)
+        np.save(ids_path, ids)
+        self._remove_part(self._next_shard)
+        self._next_shard += 1
+        self._part_count = 0
+
+    def _remove_part(self, shard_index: int):
+        for path in _part_paths(self.directory, shard_index):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class LandmarkStore:
+    """
+    Read access to a directory written by `LandmarkStoreWriter`.
+
+    Landmark arrays are memory-mapped, so iterating over the store never loads more than
+    the shard being processed, and looking up single images does not read whole shards.
+    An image stored more than once (e.g. retried by a resumed run) counts only with its last entry.
+    The open shard of an interrupted run is read as well.
+    """
+
+    def __init__(self, directory: str):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"Landmark store not found at: {directory}")
+        self.directory = directory
+        sealed = {i for i in _existing_shard_indices(directory) if os.path.exists(_shard_paths(directory, i)[1])}
+        self._open_shards = set(_existing_shard_indices(directory, PART_PATTERN)) - sealed
+        self.shard_indices = sorted(sealed | self._open_shards)
+        self._index = None
+
+    def _load_shard(self, shard_index: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the ids and the memory-mapped landmarks of a shard."""
+        if shard_index in self._open_shards:
+            return _read_part(self.directory, shard_index)
+        landmarks_path, ids_path = _shard_paths(self.directory, shard_index)
+        return np.load(ids_path), np.load(landmarks_path, mmap_mode='r')
+
+    def __len__(self) -> int:
+        if self._index is None:
+            self._index = self._build_index()
+        return len(self._index)
+
+    def iter_shards(self):
+        """
+        Yields the shards of the store in order.
+
+        Yields:
+            tuple[np.ndarray, np.ndarray]: The image ids (N,) and the memory-mapped int16
+                                           landmarks (N, 68, 2) of one shard.
+        """
+        if self._index is None:
+            self._index = self._build_index()
+        for shard_index in self.shard_indices:
+            ids, landmarks = self._load_shard(shard_index)
+            latest = np.array([self._index[str(image_id)] == (shard_index, row) for row, image_id in enumerate(ids)],
+                              dtype=bool)
+            if not latest.all():  # Drop entries superseded by a later one of the same image
+                ids, landmarks = ids[latest], landmarks[latest]
+            yield ids, landmarks
+
+    def _build_index(self) -> dict:
+        index = {}
+        for shard_index in self.shard_indices:
+            ids = self._load_shard(shard_index)[0]
+            for row, image_id in enumerate(ids):
+                index[str(image_id)] = (shard_index, row)
+        return index
+
+    def get(self, image_id: str) -> np.ndarray | None:
+        """Returns the (68, 2) landmarks of an image, or None if the image is not in the store."""
+        if self._index is None:
+            self._index = self._build_index()
+        location = self._index.get(str(image_id))
+        if location is None:
+            return None
+        shard_index, row = location
+        return np.array(self._load_shard(shard_index)[1][row])
@@ -1,8 +1,50 @@
 # facial_feature_extractor/landmarks.py
+import os
+import threading
 import dlib
 import numpy as np
 import cv2
 
+# Mean face shape of landmarks 17-67 on the unit square: the template dlib.get_face_chip aligns faces to
+MEAN_FACE_SHAPE_X = np.array([
+    0.000213256, 0.0752622, 0.18113, 0.29077, 0.393397, 0.586856, 0.689483, 0.799124,
+    0.904991, 0.98004, 0.490127, 0.490127, 0.490127, 0.490127, 0.36688, 0.426036,
+    0.490127, 0.554217, 0.613373, 0.121737, 0.187122, 0.265825, 0.334606, 0.260918,
+    0.182743, 0.645647, 0.714428, 0.793132, 0.858516, 0.79751, 0.719335, 0.254149,
+    0.340985, 0.428858, 0.490127, 0.551395, 0.639268, 0.726104, 0.642159, 0.556721,
+    0.490127, 0.423532, 0.338094, 0.290379, 0.428096, 0.490127, 0.552157, 0.689874,
+    0.553364, 0.490127, 0.42689])
+MEAN_FACE_SHAPE_Y = np.array([
+    0.106454, 0.038915, 0.0187482, 0.0344891, 0.0773906, 0.0773906, 0.0344891,
+    0.0187482, 0.038915, 0.106454, 0.203352, 0.307009, 0.409805, 0.515625, 0.587326,
+    0.609345, 0.628106, 0.609345, 0.587326, 0.216423, 0.178758, 0.179852, 0.231733,
+    0.245099, 0.244077, 0.231733, 0.179852, 0.178758, 0.216423, 0.244077, 0.245099,
+    0.780233, 0.745405, 0.727388, 0.742578, 0.727388, 0.745405, 0.780233, 0.864805,
+    0.902192, 0.909281, 0.902192, 0.864805, 0.784792, 0.778746, 0.785343, 0.778746,
+    0.784792, 0.824182, 0.831803, 0.824182])
+# Landmarks the alignment is fitted to; like dlib, the eyebrows and the lower lip are left out
+ALIGNMENT_POINT_INDICES = [i for i in range(27, 68) if not (55 <= i <= 59 or 65 <= i <= 67)]
+
+# Shape predictors loaded in this process, by absolute model path
+_shape_predictors = {}
+_shape_predictors_lock = threading.Lock()
+
+
+def load_shape_predictor(model_path: str) -> dlib.shape_predictor:
+    """
+    Loads a dlib shape predictor once per process and returns the shared instance on later calls.
+
+    A shape predictor can be used from several threads at once, so all analyzers of a process
+    (e.g. one per thread) share one copy of the ~100MB model. Loaded before forking worker
+    processes, the model is also shared with them copy-on-write.
+    """
+    key = os.path.abspath(model_path)
+    with _shape_predictors_lock:
+        if key not in _shape_predictors:
+            _shape_predictors[key] = dlib.shape_predictor(model_path)
+        return _shape_predictors[key]
+
+
 def get_landmarks(image: np.ndarray, face_rect: dlib.rectangle, predictor: dlib.shape_predictor):
     """
     Finds facial landmarks for a given face rectangle.
@@ -30,6 +72,26 @@ def get_landmarks(image: np.ndarray, face_rect: dlib.rectangle, predictor: dlib.
         print(f"Error during dlib landmark prediction: {e}")
         return None
 
+def get_landmarks_batch(image: np.ndarray, face_rects: list, predictor: dlib.shape_predictor) -> list:
+    """
+    Finds facial landmarks for several face rectangles in the same image.
+
+    The image is converted to grayscale once and shared by all predictions.
+
+    Args:
+        image (np.ndarray): Input BGR or grayscale image.
+        face_rects (list[dlib.rectangle]): The rectangles defining the face regions.
+        predictor (dlib.shape_predictor): An initialized dlib shape predictor model.
+
+    Returns:
+        list[dlib.full_object_detection | None]: The landmarks for each rectangle, None where prediction failed.
+    """
+    if image is None or predictor is None or not face_rects:
+        return [None] * len(face_rects or [])
+
+    img_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) > 2 else image
+    return [get_landmarks(img_gray, face_rect, predictor) for face_rect in face_rects]
+
 def align_face_chip(image: np.ndarray, landmarks: dlib.full_object_detection,
                      target_size: int = 256, padding: float = 0.2):
     """
@@ -53,8 +115,139 @@ def align_face_chip(image: np.ndarray, landmarks: dlib.full_object_detection,
         print(f"Error during dlib.get_face_chip: {e}")
         return None
 
+
+def estimate_similarity_transform(src_points: np.ndarray, dst_points: np.ndarray) -> np.ndarray:
+    """
+    Finds the rotation, uniform scale and translation that best maps `src_points` onto
+    `dst_points` in the least-squares sense (Umeyama's method, as dlib's find_similarity_transform).
+
+    Returns:
+        np.ndarray: The 2x3 affine matrix of the transform.
+    """
+    src = np.asarray(src_points, dtype=np.float64)
+    dst = np.asarray(dst_points, dtype=np.float64)
+    src_mean, dst_mean = src.mean(axis=0), dst.mean(axis=0)
+    src_centered, dst_centered = src - src_mean, dst - dst_mean
+    src_variance = np.mean(np.sum(src_centered ** 2, axis=1))
+    u, singular_values, vt = np.linalg.svd(dst_centered.T @ src_centered / len(src))
+    reflection = np.diag([1.0, np.sign(np.linalg.det(u) * np.linalg.det(vt)) or 1.0])
+    rotation = u @ reflection @ vt
+    scale = np.trace(np.diag(singular_values) @ reflection) / src_variance
+    translation = dst_mean - scale * rotation @ src_mean
+    return np.hstack([scale * rotation, translation[:, None]])
+
+
+def compute_face_chip_transform(landmark_points: list[tuple[int, int]], target_size: int = 256,
+                                padding: float = 0.2) -> np.ndarray | None:
+    """
+    Computes the transform `dlib.get_face_chip` aligns a face with, directly from the 68 landmark points.
+
+    Returns:
+        np.ndarray | None: The 2x3 affine matrix mapping image coordinates to chip coordinates,
+                           or None if the landmarks are missing.
+    """
+    if landmark_points is None or len(landmark_points) != 68:
+        return None
+    points = np.asarray(landmark_points, dtype=np.float64)
+    template = np.stack([(padding + MEAN_FACE_SHAPE_X) / (2 * padding + 1),
+                         (padding + MEAN_FACE_SHAPE_Y) / (2 * padding + 1)], axis=1) * target_size
+    chip_to_image = estimate_similarity_transform(template[np.subtract(ALIGNMENT_POINT_INDICES, 17)],
+                                                  points[ALIGNMENT_POINT_INDICES])
+    # dlib keeps the rotation and the chip center of the fit, but maps the first and last chip pixels
+    # onto the first and last pixels of the fitted chip rectangle (target_size * scale pixels wide)
+    scale = np.hypot(*chip_to_image[:, 0])
+    linear = chip_to_image[:, :2] * ((target_size * scale - 1) / max(target_size - 1, 1) / scale)
+    center = chip_to_image @ np.array([target_size / 2, target_size / 2, 1.0])
+    translation = center - linear @ np.full(2, (target_size - 1) / 2)
+    return cv2.invertAffineTransform(np.hstack([linear, translation[:, None]]))
+
+
+def transform_points(points, transform: np.ndarray) -> np.ndarray:
+    """Applies a 2x3 affine transform (e.g. from `compute_face_chip_transform`) to (x, y) points."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points @ transform[:, :2].T + transform[:, 2]
+
+
+def align_face_chip_affine(image: np.ndarray, landmark_points: list[tuple[int, int]], target_size: int = 256,
+                           padding: float = 0.2) -> tuple[np.ndarray | None, np.ndarray | None]:
+    """
+    Extracts an aligned face chip like `align_face_chip`, but with OpenCV, warping only the region
+    of the image the chip covers.
+
+    The transform is computed from the landmark points (see `compute_face_chip_transform`), so the
+    image can be the grayscale plane alone when color is not needed. Faces much larger than the
+    chip are first halved with a Gaussian pyramid, as dlib does, so at most two image pixels
+    map onto one chip pixel.
+
+    Args:
+        image (np.ndarray): The BGR or grayscale input image.
+        landmark_points (list[tuple[int, int]]): The 68 (x, y) landmark points.
+        target_size (int): The desired output size (width and height) of the chip.
+        padding (float): Padding around the face, relative to face size.
+
+    Returns:
+        tuple[np.ndarray | None, np.ndarray | None]: The chip (with the image's channels) and the
+            2x3 matrix mapping image coordinates to chip coordinates, or (None, None) on failure.
+    """
+    if image is None:
+        return None, None
+    transform = compute_face_chip_transform(landmark_points, target_size, padding)
+    if transform is None:
+        return None, None
+
+    try:
+        # Bounding box of the chip in the image, with a margin for the pyramid and interpolation filters
+        image_pixels_per_chip_pixel = 1.0 / np.sqrt(abs(np.linalg.det(transform[:, :2])))
+        margin = 2 + 2 * int(image_pixels_per_chip_pixel)
+        chip_to_image = cv2.invertAffineTransform(transform)
+        corners = transform_points([(0, 0), (target_size - 1, 0), (0, target_size - 1),
+                                    (target_size - 1, target_size - 1)], chip_to_image)
+        height, width = image.shape[:2]
+        left, top = np.maximum(np.floor(corners.min(axis=0)).astype(int) - margin, 0)
+        right, bottom = np.minimum(np.ceil(corners.max(axis=0)).astype(int) + margin + 1, (width, height))
+        if right <= left or bottom <= top:
+            return np.zeros((target_size, target_size) + image.shape[2:], dtype=image.dtype), transform
+
+        region = image[top:bottom, left:right]
+        region_transform = transform.copy()
+        region_transform[:, 2] += transform[:, :2] @ np.array([left, top], dtype=np.float64)
+        while image_pixels_per_chip_pixel >= 2.0:
+            # Halve the region like one level of dlib's image pyramid; pixel i lands on 2i
+            region = cv2.pyrDown(region)
+            region_transform[:, :2] *= 2.0
+            image_pixels_per_chip_pixel /= 2.0
+        chip = cv2.warpAffine(region, region_transform, (target_size, target_size), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return chip, transform
+    except Exception as e:
+        print(f"Error during affine face alignment: {e}")
+        return None, None
+
+
 def extract_landmark_points(landmarks: dlib.full_object_detection) -> list[tuple[int, int]] | None:
     """Extracts landmark coordinates as a list of (x, y) tuples."""
     if landmarks is None or landmarks.num_parts == 0:
         return None
-    return [(p.x, p.y) for p in landmarks.parts()]
\ No newline at end of file
+    return [(p.x, p.y) for p in landmarks.parts()]
+
+
+def build_landmarks_object(face_rect: tuple[int, int, int, int],
+                           points: list[tuple[int, int]]) -> dlib.full_object_detection | None:
+    """
+    Rebuilds a dlib landmarks object from stored values (e.g. a cached result).
+
+    Args:
+        face_rect (tuple[int, int, int, int]): The face rectangle as (left, top, right, bottom).
+        points (list[tuple[int, int]]): The 68 (x, y) landmark points.
+
+    Returns:
+        dlib.full_object_detection | None: The landmarks object, or None on failure.
+    """
+    if face_rect is None or not points:
+        return None
+    try:
+        rect = dlib.rectangle(*map(int, face_rect))
+        return dlib.full_object_detection(rect, [dlib.point(int(x), int(y)) for x, y in points])
+    except Exception as e:
+        print(f"Error rebuilding landmarks object: {e}")
+        return None
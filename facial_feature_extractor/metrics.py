@@ -0,0 +1,187 @@
+# facial_feature_extractor/metrics.py
+import os
+import sys
+import json
+import math
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+TIME_KINDS = ('wall', 'cpu')
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def peak_rss_bytes() -> int | None:
+    """Returns the peak resident set size of the current process in bytes, or None if it cannot be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+
+
+class StageTimer:
+    """
+    Records the wall-clock and CPU time of named pipeline stages.
+
+    CPU time is measured per thread, so timings stay meaningful when several analyzers
+    run in threads of the same process. A disabled timer records nothing.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Context manager that adds the time spent in its body to the stage `name`."""
+        if not self.enabled:
+            yield
+            return
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            stage = self.timings.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            stage['wall'] += time.perf_counter() - wall_start
+            stage['cpu'] += time.thread_time() - cpu_start
+
+    def as_dict(self) -> dict | None:
+        """Returns the recorded timings as {stage: {'wall': s, 'cpu': s}}, or None if disabled."""
+        return dict(self.timings) if self.enabled else None
+
+
+class LatencyHistogram:
+    """
+    A fixed-bucket, log-scaled histogram of durations in seconds.
+
+    Quantiles are approximated by the upper bound of the bucket they fall in (about 12%
+    relative error with the default resolution).
+    """
+
+    MIN_SECONDS = 1e-5
+    BUCKETS_PER_DECADE = 20
+    NUM_BUCKETS = 8 * BUCKETS_PER_DECADE  # 10us .. 1000s
+
+    def __init__(self):
+        self.counts = [0] * (self.NUM_BUCKETS + 1)  # The last bucket collects overflows
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _bucket(self, seconds: float) -> int:
+        if seconds <= self.MIN_SECONDS:
+            return 0
+        index = int(math.ceil(math.log10(seconds / self.MIN_SECONDS) * self.BUCKETS_PER_DECADE))
+        return min(index, self.NUM_BUCKETS)
+
+    def _upper_bound(self, index: int) -> float:
+        return self.MIN_SECONDS * 10 ** (index / self.BUCKETS_PER_DECADE)
+
+    def add(self, seconds: float):
+        """Records one duration."""
+        self.counts[self._bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Returns the approximate q-quantile (0 <= q <= 1), or NaN if the histogram is empty."""
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank and bucket_count:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Returns count, mean, max and the standard quantiles."""
+        summary = {'count': self.count, 'mean': self.total / self.count if self.count else math.nan, 'max': self.max}
+        summary.update({f"p{int(q * 100)}": self.quantile(q) for q in QUANTILES})
+        return summary
+
+
+class MetricsAggregator:
+    """
+    Aggregates per-image results of a batch run into per-stage latency histograms,
+    status counts, throughput and the peak memory of the workers, and exports them as
+    JSON or Prometheus text format.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.status_counts = Counter()
+        self.histograms = {}
+        self.worker_peak_rss_bytes = None
+
+    def add_result(self, status: str, timings: dict | None = None, peak_rss: int | None = None):
+        """Records the status, (optional) stage timings and (optional) worker peak RSS of one processed image."""
+        self.status_counts[status] += 1
+        if peak_rss is not None:
+            self.worker_peak_rss_bytes = max(self.worker_peak_rss_bytes or 0, peak_rss)
+        for stage, values in (timings or {}).items():
+            for kind in TIME_KINDS:
+                if kind in values:
+                    self.histograms.setdefault((stage, kind), LatencyHistogram()).add(values[kind])
+
+    def snapshot(self) -> dict:
+        """Returns all metrics as a JSON-serializable dict."""
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        total_images = sum(self.status_counts.values())
+        stages = {}
+        for (stage, kind), histogram in sorted(self.histograms.items()):
+            stages.setdefault(stage, {})[kind] = histogram.summary()
+        return {
+            'elapsed_seconds': elapsed,
+            'images_total': total_images,
+            'images_per_second': total_images / elapsed,
+            'status_counts': dict(self.status_counts),
+            'worker_peak_rss_bytes': self.worker_peak_rss_bytes,
+            'main_peak_rss_bytes': peak_rss_bytes(),
+            'stages': stages,
+        }
+
+    def to_json(self) -> str:
+        """Returns the metrics snapshot as a JSON string."""
+        return json.dumps(self.snapshot(), indent=2, default=lambda v: None)
+
+    def to_prometheus(self, prefix: str = 'face_analyzer') -> str:
+        """Returns the metrics snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            f"# TYPE {prefix}_images_total counter",
+            *[f'{prefix}_images_total{{status="{status}"}} {count}'
+              for status, count in sorted(snapshot['status_counts'].items())],
+            f"# TYPE {prefix}_images_per_second gauge",
+            f"{prefix}_images_per_second {snapshot['images_per_second']:.6f}",
+        ]
+        for name in ('worker_peak_rss_bytes', 'main_peak_rss_bytes'):
+            if snapshot[name] is not None:
+                lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {snapshot[name]}"]
+        lines.append(f"# TYPE {prefix}_stage_seconds summary")
+        for (stage, kind), histogram in sorted(self.histograms.items()):
+            labels = f'stage="{stage}",kind="{kind}"'
+            for q in QUANTILES:
+                lines.append(f'{prefix}_stage_seconds{{{labels},quantile="{q}"}} {histogram.quantile(q):.6f}')
+            lines.append(f"{prefix}_stage_seconds_sum{{{labels}}} {histogram.total:.6f}")
+            lines.append(f"{prefix}_stage_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """Writes the metrics to `path`, as Prometheus text for '.prom'/'.txt' files and JSON otherwise."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        content = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        # Write to a temporary file first so readers never see a partial dump
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
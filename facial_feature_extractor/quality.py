@@ -0,0 +1,70 @@
+# facial_feature_extractor/quality.py
+import cv2
+import numpy as np
+
+# Quality metrics, in the order they are reported
+QUALITY_METRIC_NAMES = ['image_width', 'image_height', 'sharpness', 'brightness_mean', 'brightness_std']
+
+
+def compute_quality_metrics(gray: np.ndarray, sample_size: int = 256,
+                            image_size: tuple[int, int] | None = None) -> dict:
+    """
+    Computes inexpensive image quality metrics on a downsampled grayscale image.
+
+    Args:
+        gray (np.ndarray): The grayscale image.
+        sample_size (int): Length the longer side is reduced to before measuring. Sharpness is
+                           measured at this size, so thresholds do not depend on the resolution.
+        image_size (tuple[int, int], optional): (width, height) of the full-resolution image, if
+                                                `gray` was decoded reduced.
+
+    Returns:
+        dict: 'image_width' and 'image_height' of the full image, 'sharpness' (variance of the
+              Laplacian), and 'brightness_mean' / 'brightness_std' of the pixel values (0-255).
+    """
+    height, width = gray.shape[:2]
+    full_width, full_height = image_size if image_size else (width, height)
+    scale = sample_size / max(height, width)
+    sample = gray
+    if scale < 1.0:
+        sample = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                            interpolation=cv2.INTER_AREA)
+    mean, std = cv2.meanStdDev(sample)
+    return {
+        'image_width': int(full_width),
+        'image_height': int(full_height),
+        'sharpness': float(cv2.Laplacian(sample, cv2.CV_64F).var()),
+        'brightness_mean': float(mean[0][0]),
+        'brightness_std': float(std[0][0]),
+    }
+
+
+def check_quality(metrics: dict, min_side: int | None = None, min_sharpness: float | None = None,
+                  min_brightness: float | None = None, max_brightness: float | None = None,
+                  min_contrast: float | None = None) -> str | None:
+    """
+    Checks quality metrics against thresholds. Thresholds set to None are not checked.
+
+    Args:
+        metrics (dict): Metrics from `compute_quality_metrics`.
+        min_side (int, optional): Minimum length of the shorter image side, in pixels.
+        min_sharpness (float, optional): Minimum variance of the Laplacian (blur).
+        min_brightness (float, optional): Minimum mean brightness (too dark / black images).
+        max_brightness (float, optional): Maximum mean brightness (overexposed images).
+        min_contrast (float, optional): Minimum standard deviation of the brightness (flat images).
+
+    Returns:
+        str | None: The reason the image was rejected, or None if it passed.
+    """
+    short_side = min(metrics['image_width'], metrics['image_height'])
+    if min_side is not None and short_side < min_side:
+        return f"Image too small ({metrics['image_width']}x{metrics['image_height']})"
+    if min_brightness is not None and metrics['brightness_mean'] < min_brightness:
+        return f"Image too dark (mean brightness {metrics['brightness_mean']:.1f})"
+    if max_brightness is not None and metrics['brightness_mean'] > max_brightness:
+        return f"Image overexposed (mean brightness {metrics['brightness_mean']:.1f})"
+    if min_contrast is not None and metrics['brightness_std'] < min_contrast:
+        return f"Image contrast too low (brightness std {metrics['brightness_std']:.1f})"
+    if min_sharpness is not None and metrics['sharpness'] < min_sharpness:
+        return f"Image too blurry (sharpness {metrics['sharpness']:.1f})"
+    return None
@@ -0,0 +1,303 @@
+# facial_feature_extractor/service.py
+import json
+import math
+import time
+import queue
+import logging
+import threading
+import numpy as np
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from .analysis import FaceAnalyzer, RESULT_PROFILE_FEATURES
+from .metrics import MetricsAggregator, LatencyHistogram
+
+# Result entries returned to clients (image arrays are never sent)
+RESPONSE_FIELDS = ('image_path', 'status', 'error_message', 'face_area', 'num_faces', 'detect_upsample_used',
+                   'image_size', 'quality', 'cache_hit', 'landmarks', 'features', 'timings')
+
+# Marks the end of the request queue for one worker
+_STOP = None
+
+
+class ServiceOverloadedError(Exception):
+    """Raised when a request is rejected because it could not be answered within the latency target."""
+
+
+class AnalysisService:
+    """
+    Keeps warm FaceAnalyzer instances in a pool of worker threads and analyzes encoded images
+    submitted from other threads (e.g. HTTP request handlers).
+
+    Each worker takes the oldest request from a shared queue, analyzes it and resolves its
+    future. There is no micro-batching: analysis time is dominated by detection and landmark
+    prediction, which dlib runs per image, so grouping requests would only make them wait for
+    each other. dlib releases the GIL while detecting, so the threads run in parallel.
+
+    With a latency target, requests are rejected up front (`ServiceOverloadedError`) when the
+    predicted queueing delay already exceeds it, instead of queueing without bound.
+    """
+
+    DEFAULT_CONFIG = {
+        'result_profile': RESULT_PROFILE_FEATURES,
+        'collect_timings': True,
+    }
+
+    def __init__(self, shape_predictor_path: str, config: dict = None, num_workers: int = 1,
+                 latency_target_ms: float | None = None, max_queue_size: int = 1024):
+        """
+        Initializes the service. Call `start` to load the analyzers and start the workers.
+
+        Args:
+            shape_predictor_path (str): Path to the dlib shape predictor model file.
+            config (dict, optional): FaceAnalyzer config overrides (the features profile with
+                                     timings is used by default).
+            num_workers (int): Number of worker threads, each with its own analyzer.
+            latency_target_ms (float, optional): Reject requests whose predicted queueing delay
+                                                 exceeds this (None to never reject).
+            max_queue_size (int): Maximum number of queued requests.
+        """
+        self.shape_predictor_path = shape_predictor_path
+        self.config = {**self.DEFAULT_CONFIG, **(config or {})}
+        self.num_workers = max(1, num_workers)
+        self.latency_target_ms = latency_target_ms
+
+        self.metrics = MetricsAggregator()
+        self.latency = LatencyHistogram()
+        self.rejected = 0
+        # Moving average of the worker time per image, used to predict the queueing delay
+        self.service_time = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._workers = []
+
+    def start(self):
+        """Loads one analyzer per worker (sharing the shape predictor) and starts the worker threads."""
+        if self._workers:
+            return
+        analyzers = [FaceAnalyzer(self.shape_predictor_path, self.config) for _ in range(self.num_workers)]
+        for index, analyzer in enumerate(analyzers):
+            worker = threading.Thread(target=self._run_worker, args=(analyzer,), name=f"analysis-worker-{index}",
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logging.info(f"Analysis service started with {self.num_workers} workers.")
+
+    def stop(self):
+        """Finishes the queued requests and stops the worker threads."""
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def predicted_wait_ms(self) -> float:
+        """Returns the expected queueing delay of a new request in milliseconds (0.0 before any measurement)."""
+        if self.service_time is None:
+            return 0.0
+        return self._queue.qsize() / self.num_workers * self.service_time * 1000
+
+    def submit(self, image_data: bytes, image_id: str | None = None) -> Future:
+        """
+        Queues an encoded image for analysis.
+
+        Returns:
+            Future: Resolves to the response dict (see `analyze`).
+
+        Raises:
+            ServiceOverloadedError: If the queue is full or the latency target cannot be met.
+        """
+        if self.latency_target_ms is not None and self.predicted_wait_ms() > self.latency_target_ms:
+            self._reject()
+            raise ServiceOverloadedError(f"Predicted wait of {self.predicted_wait_ms():.0f} ms exceeds "
+                                         f"the latency target of {self.latency_target_ms:.0f} ms")
+        future = Future()
+        try:
+            self._queue.put_nowait((image_data, image_id, future, time.perf_counter()))
+        except queue.Full:
+            self._reject()
+            raise ServiceOverloadedError("Request queue is full")
+        return future
+
+    def analyze(self, image_data: bytes, image_id: str | None = None, timeout: float | None = None) -> dict:
+        """
+        Analyzes an encoded image and waits for the result.
+
+        Returns:
+            dict: The JSON-serializable result entries (RESPONSE_FIELDS), plus 'latency_ms' (from
+                  submission to completion) and 'queue_ms' (waiting for a worker).
+        """
+        future = self.submit(image_data, image_id)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def health(self) -> dict:
+        """Returns the queue size, latency quantiles and the latency target."""
+        with self._lock:
+            summary = self.latency.summary()
+            rejected = self.rejected
+        return {
+            'status': 'ok' if self._workers else 'stopped',
+            'workers': len(self._workers),
+            'queue_size': self._queue.qsize(),
+            'requests_total': summary['count'],
+            'requests_rejected': rejected,
+            'latency_p50_ms': _milliseconds(summary['p50']),
+            'latency_p99_ms': _milliseconds(summary['p99']),
+            'latency_target_ms': self.latency_target_ms,
+            'service_time_ms': _milliseconds(self.service_time),
+        }
+
+    def metrics_text(self) -> str:
+        """Returns the per-stage metrics (including 'queue' and 'request' latency) in Prometheus text format."""
+        with self._lock:
+            return self.metrics.to_prometheus(prefix='face_analysis_service')
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+            self.metrics.add_result('rejected')
+
+    def _run_worker(self, analyzer: FaceAnalyzer):
+        """Worker thread: analyzes queued requests one at a time until it receives the stop marker."""
+        while True:
+            request = self._queue.get()
+            if request is _STOP:
+                return
+            # Requests whose caller gave up before they were picked up are dropped
+            if request[2].set_running_or_notify_cancel():
+                self._process_request(analyzer, *request)
+
+    def _process_request(self, analyzer: FaceAnalyzer, image_data: bytes, image_id: str | None, future: Future,
+                         enqueued_at: float):
+        """Analyzes one request and resolves its future."""
+        start = time.perf_counter()
+        try:
+            result = analyzer.process_image_bytes(image_data, image_id)
+        except Exception as e:
+            logging.error(f"Error analyzing image {image_id}: {e}")
+            future.set_exception(e)
+            return
+        finished = time.perf_counter()
+
+        response = {field: result[field] for field in RESPONSE_FIELDS}
+        response['latency_ms'] = (finished - enqueued_at) * 1000
+        response['queue_ms'] = (start - enqueued_at) * 1000
+
+        elapsed = finished - start
+        timings = dict(response['timings'] or {})
+        timings['queue'] = {'wall': response['queue_ms'] / 1000}
+        timings['request'] = {'wall': response['latency_ms'] / 1000}
+        with self._lock:
+            self.service_time = elapsed if self.service_time is None else 0.8 * self.service_time + 0.2 * elapsed
+            self.metrics.add_result(response['status'], timings)
+            self.latency.add(response['latency_ms'] / 1000)
+        future.set_result(response)
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP endpoints of an `AnalysisHTTPServer`:
+
+    - POST /analyze: the raw image bytes as the body, an optional `?id=` for the image_path
+      entry; answers the JSON response, 503 when overloaded and 504 on timeout.
+    - GET /health: JSON health summary (see `AnalysisService.health`).
+    - GET /metrics: Prometheus text metrics.
+    """
+
+    # Keep-alive, so clients can reuse their connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/analyze':
+            self._send_json(404, {'error': f"Unknown endpoint: {url.path}"})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0:
+            self._send_json(400, {'error': 'Request body must contain the encoded image'})
+            return
+        if length > self.server.max_body_bytes:
+            self.close_connection = True  # The unread body cannot be skipped on this connection
+            self._send_json(413, {'error': f"Image larger than {self.server.max_body_bytes} bytes"})
+            return
+        image_data = self.rfile.read(length)
+        image_id = parse_qs(url.query).get('id', [None])[0]
+
+        try:
+            response = self.server.service.analyze(image_data, image_id, timeout=self.server.request_timeout)
+        except ServiceOverloadedError as e:
+            self._send_json(503, {'error': str(e)}, headers={'Retry-After': '1'})
+            return
+        except TimeoutError:
+            self._send_json(504, {'error': 'Analysis timed out'})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, response)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, self.server.service.health())
+        elif path == '/metrics':
+            self._send(200, self.server.service.metrics_text().encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint: {path}"})
+
+    def _send_json(self, code: int, payload: dict, headers: dict = None):
+        self._send(code, json.dumps(_json_safe(payload)).encode('utf-8'), 'application/json', headers)
+
+    def _send(self, code: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+
+class AnalysisHTTPServer(ThreadingHTTPServer):
+    """A threaded HTTP server exposing an `AnalysisService` (see `AnalysisRequestHandler`)."""
+
+    daemon_threads = True
+    # Keep-alive connections from load generators can be numerous
+    request_queue_size = 128
+
+    def __init__(self, server_address: tuple[str, int], service: AnalysisService, request_timeout: float = 30.0,
+                 max_body_bytes: int = 32 * 1024 * 1024):
+        self.service = service
+        self.request_timeout = request_timeout
+        self.max_body_bytes = max_body_bytes
+        super().__init__(server_address, AnalysisRequestHandler)
+
+
+def _milliseconds(seconds: float | None) -> float | None:
+    return None if seconds is None or math.isnan(seconds) else seconds * 1000
+
+
+def _json_safe(value):
+    """Replaces NaN and infinite floats (e.g. features that could not be computed) with None, recursively."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    return value
@@ -16,6 +16,15 @@ LEFT_EYE = list(range(42, 48))
 OUTER_LIP = list(range(48, 60))
 INNER_LIP = list(range(60, 68))
 
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...), which hold the dimensions
+JPEG_SOF_MARKERS = frozenset({0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF})
+# Reduced-size JPEG decoding flags for each full-size flag and reduction factor
+REDUCED_DECODE_FLAGS = {
+    cv2.IMREAD_COLOR: {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8},
+    cv2.IMREAD_GRAYSCALE: {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                           8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+}
+
 
 def create_dir_if_not_exists(directory: str):
     """Creates a directory if it does not already exist."""
@@ -27,12 +36,118 @@ def create_dir_if_not_exists(directory: str):
             raise
 
 
-def load_image(image_path: str) -> np.ndarray | None:
-    """Loads an image from a file path using OpenCV."""
+def read_image_bytes(image_path: str) -> bytes | None:
+    """Reads the raw (still encoded) bytes of an image file."""
+    if not image_path or not isinstance(image_path, str) or not os.path.exists(image_path):
+        return None
+    try:
+        with open(image_path, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        print(f"Error reading image {image_path}: {e}")
+        return None
+
+
+def decode_image(image_data: bytes | np.ndarray, flags: int = cv2.IMREAD_COLOR) -> np.ndarray | None:
+    """Decodes an encoded image (e.g. JPEG or PNG bytes) using OpenCV (BGR by default)."""
+    if image_data is None or len(image_data) == 0:
+        return None
+    try:
+        buffer = np.frombuffer(image_data, dtype=np.uint8) if isinstance(image_data, (bytes, bytearray)) else image_data
+        return cv2.imdecode(buffer, flags)
+    except Exception as e:
+        print(f"Error decoding image: {e}")
+        return None
+
+
+def read_image_dimensions(image_data: bytes) -> tuple[int, int] | None:
+    """
+    Reads the (width, height) of a JPEG or PNG image from its header, without decoding it.
+
+    Returns:
+        tuple[int, int] | None: The stored dimensions (before any EXIF rotation), or None
+                                for other formats or malformed headers.
+    """
+    if image_data[:8] == b'\x89PNG\r\n\x1a\n' and len(image_data) >= 24:
+        return int.from_bytes(image_data[16:20], 'big'), int.from_bytes(image_data[20:24], 'big')
+    if image_data[:2] != b'\xff\xd8':
+        return None
+    # Walk the JPEG segments up to the start-of-frame marker
+    offset = 2
+    while offset + 9 <= len(image_data):
+        if image_data[offset] != 0xFF:
+            return None
+        marker = image_data[offset + 1]
+        if marker == 0xFF:  # Fill byte
+            offset += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height = int.from_bytes(image_data[offset + 5:offset + 7], 'big')
+            width = int.from_bytes(image_data[offset + 7:offset + 9], 'big')
+            return width, height
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # Markers without a length
+            offset += 2
+            continue
+        offset += 2 + int.from_bytes(image_data[offset + 2:offset + 4], 'big')
+    return None
+
+
+def decode_image_capped(image_data: bytes, flags: int = cv2.IMREAD_COLOR,
+                        max_pixels: int | None = None) -> tuple[np.ndarray | None, float]:
+    """
+    Decodes an encoded image, reducing it to at most `max_pixels` pixels.
+
+    JPEGs are decoded directly at 1/2, 1/4 or 1/8 size (`cv2.IMREAD_REDUCED_*`), so the
+    full-resolution image never exists in memory. Other images, or JPEGs still too large at
+    1/8, are resized right after decoding.
+
+    Args:
+        image_data (bytes): The encoded image.
+        flags (int): `cv2.IMREAD_COLOR` or `cv2.IMREAD_GRAYSCALE` (other flags disable reduced decoding).
+        max_pixels (int, optional): Maximum width * height of the decoded image (None for no limit).
+
+    Returns:
+        tuple[np.ndarray | None, float]: The image and its scale relative to the full
+                                         resolution (1.0 if not reduced).
+    """
+    dimensions = read_image_dimensions(image_data) if max_pixels and image_data else None
+    decode_flags = flags
+    if dimensions and dimensions[0] * dimensions[1] > max_pixels and image_data[:2] == b'\xff\xd8' \
+            and flags in REDUCED_DECODE_FLAGS:
+        width, height = dimensions
+        factor = next((f for f in (2, 4, 8) if math.ceil(width / f) * math.ceil(height / f) <= max_pixels), 8)
+        decode_flags = REDUCED_DECODE_FLAGS[flags][factor]
+
+    img = decode_image(image_data, decode_flags)
+    if img is None:
+        return None, 1.0
+    scale = 1.0
+    if dimensions and decode_flags != flags:
+        # Area ratio, so an EXIF rotation applied during decoding does not matter
+        scale = math.sqrt(img.shape[0] * img.shape[1] / (dimensions[0] * dimensions[1]))
+    if max_pixels and img.shape[0] * img.shape[1] > max_pixels:
+        resize_factor = math.sqrt(max_pixels / (img.shape[0] * img.shape[1]))
+        new_size = (max(1, int(img.shape[1] * resize_factor)), max(1, int(img.shape[0] * resize_factor)))
+        scale *= new_size[0] / img.shape[1]
+        img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+    return img, scale
+
+
+def load_image_capped(image_path: str, flags: int = cv2.IMREAD_COLOR,
+                      max_pixels: int | None = None) -> tuple[np.ndarray | None, float]:
+    """Loads an image from a file path, reducing it to at most `max_pixels` pixels (see `decode_image_capped`)."""
+    image_data = read_image_bytes(image_path)
+    if image_data is None:
+        return None, 1.0
+    return decode_image_capped(image_data, flags, max_pixels)
+
+
+def load_image(image_path: str, flags: int = cv2.IMREAD_COLOR) -> np.ndarray | None:
+    """Loads an image from a file path using OpenCV (BGR by default, see `cv2.IMREAD_*` for `flags`)."""
     if not image_path or not isinstance(image_path, str) or not os.path.exists(image_path):
         return None
     try:
-        img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), flags)
         return img
     except Exception as e:
         print(f"Error loading image {image_path}: {e}")
@@ -0,0 +1,187 @@
+# facial_feature_extractor/video.py
+import math
+import cv2
+import dlib
+import numpy as np
+
+
+def iter_video_frames(video_path: str, frame_step: int = 1):
+    """
+    Yields frames from a video file.
+
+    Args:
+        video_path (str): Path to the video file.
+        frame_step (int): Yield every `frame_step`-th frame.
+
+    Yields:
+        np.ndarray: BGR frames.
+    """
+    capture = cv2.VideoCapture(video_path)
+    try:
+        frame_index = 0
+        while True:
+            if frame_index % frame_step == 0:
+                ok, frame = capture.read()
+            else:
+                ok = capture.grab()  # Skip without decoding
+                frame = None
+            if not ok:
+                break
+            if frame is not None:
+                yield frame
+            frame_index += 1
+    finally:
+        capture.release()
+
+
+def get_video_fps(video_path: str) -> float | None:
+    """Returns the frame rate stored in a video file, or None if it is unknown."""
+    capture = cv2.VideoCapture(video_path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        return float(fps) if fps and fps > 0 else None
+    finally:
+        capture.release()
+
+
+class LandmarkTracker:
+    """
+    Tracks one face across consecutive frames using its landmarks.
+
+    After a detection, the face rectangle for the next frame is derived from the previous
+    frame's landmarks (keeping the detector's rectangle-to-landmark geometry), so only the
+    region around it needs to be searched instead of the full frame. The shape predictor fits
+    landmarks into any rectangle, so the caller must confirm a face there (see
+    `detect_faces_in_region`) before passing its landmarks to `update`. Tracking is lost when the
+    landmarks move or change scale more than a frame-to-frame face motion allows, or after
+    `redetect_interval` tracked frames, which forces a fresh detection.
+    """
+
+    def __init__(self, max_motion: float = 0.25, max_scale_change: float = 0.2, redetect_interval: int = 30):
+        """
+        Initializes the tracker.
+
+        Args:
+            max_motion (float): Maximum mean landmark displacement between frames, relative to
+                                the inter-ocular distance.
+            max_scale_change (float): Maximum relative change of the landmark bounding box size.
+            redetect_interval (int): Number of tracked frames after which detection is forced.
+        """
+        self.max_motion = max_motion
+        self.max_scale_change = max_scale_change
+        self.redetect_interval = redetect_interval
+        self.reset()
+
+    def reset(self):
+        """Drops the tracked face, so the next frame needs a full detection."""
+        self._points = None
+        self._rect_offsets = None
+        self._frames_since_detection = 0
+
+    @property
+    def active(self) -> bool:
+        """Whether the next frame can be tracked instead of detected."""
+        return self._points is not None and self._frames_since_detection < self.redetect_interval
+
+    @staticmethod
+    def _bounding_box(points: np.ndarray) -> tuple[float, float, float, float]:
+        x_min, y_min = points.min(axis=0)
+        x_max, y_max = points.max(axis=0)
+        return x_min, y_min, max(x_max - x_min, 1.0), max(y_max - y_min, 1.0)
+
+    def start(self, face_rect: dlib.rectangle, points: list[tuple[int, int]]):
+        """Starts tracking from a detected face rectangle and its landmarks."""
+        self._points = np.asarray(points, dtype=np.float64)
+        x, y, w, h = self._bounding_box(self._points)
+        # Position of the detector rectangle relative to the landmark bounding box
+        self._rect_offsets = ((face_rect.left() - x) / w, (face_rect.top() - y) / h,
+                              (face_rect.right() - x) / w, (face_rect.bottom() - y) / h)
+        self._frames_since_detection = 0
+
+    def predict_rect(self) -> dlib.rectangle | None:
+        """Returns the face rectangle to use for the next frame, or None if not tracking."""
+        if not self.active:
+            return None
+        x, y, w, h = self._bounding_box(self._points)
+        left, top, right, bottom = self._rect_offsets
+        return dlib.rectangle(int(round(x + left * w)), int(round(y + top * h)),
+                              int(round(x + right * w)), int(round(y + bottom * h)))
+
+    def update(self, points: list[tuple[int, int]] | None) -> bool:
+        """
+        Checks the landmarks predicted in a tracked frame and keeps them if they are plausible.
+
+        Returns:
+            bool: True if the face is still tracked; False if tracking was lost (the tracker is reset).
+        """
+        if points is None or self._points is None:
+            self.reset()
+            return False
+
+        new_points = np.asarray(points, dtype=np.float64)
+        inter_ocular = np.linalg.norm(self._points[36:42].mean(axis=0) - self._points[42:48].mean(axis=0))
+        motion = np.linalg.norm(new_points - self._points, axis=1).mean() / max(inter_ocular, 1.0)
+        _, _, old_w, old_h = self._bounding_box(self._points)
+        _, _, new_w, new_h = self._bounding_box(new_points)
+        scale_change = abs(math.sqrt((new_w * new_h) / (old_w * old_h)) - 1.0)
+
+        if motion > self.max_motion or scale_change > self.max_scale_change:
+            self.reset()
+            return False
+
+        self._points = new_points
+        self._frames_since_detection += 1
+        return True
+
+
+def count_blinks(ear_values: list[float], threshold: float = 0.21, min_frames: int = 2) -> int:
+    """
+    Counts blinks in a sequence of eye aspect ratios, as runs of at least `min_frames`
+    consecutive values below `threshold`. Missing values (NaN/None) end a run.
+    """
+    blinks, run_length = 0, 0
+    for ear in ear_values:
+        if ear is not None and not math.isnan(ear) and ear < threshold:
+            run_length += 1
+            continue
+        if run_length >= min_frames:
+            blinks += 1
+        run_length = 0
+    if run_length >= min_frames:
+        blinks += 1
+    return blinks
+
+
+def summarize_frame_sequence(frame_results: list[dict], fps: float | None = None,
+                             blink_ear_threshold: float = 0.21, blink_min_frames: int = 2) -> dict:
+    """
+    Computes sequence-level statistics from per-frame analysis results.
+
+    Args:
+        frame_results (list[dict]): Results from `FaceAnalyzer.process_frames`, in frame order.
+        fps (float, optional): Rate of the analyzed frames. Needed for the duration and blink rate.
+        blink_ear_threshold (float): EAR below which the eyes count as closed.
+        blink_min_frames (int): Minimum number of closed-eye frames that form a blink.
+
+    Returns:
+        dict: Frame counts, tracking statistics, `avg_ear` statistics, blink count and blink rate.
+    """
+    num_frames = len(frame_results)
+    successes = [r for r in frame_results if r['status'] == 'success']
+    ear_values = [r['features'].get('avg_ear') for r in frame_results]
+    valid_ears = np.array([e for e in ear_values if e is not None and not math.isnan(e)], dtype=np.float64)
+    blinks = count_blinks(ear_values, blink_ear_threshold, blink_min_frames)
+    duration = num_frames / fps if fps else None
+
+    return {
+        'frames_total': num_frames,
+        'frames_with_face': len(successes),
+        'frames_tracked': sum(1 for r in successes if r.get('tracked')),
+        'detections_run': sum(1 for r in frame_results if r['status'] != 'failed' and not r.get('tracked')),
+        'duration_seconds': duration,
+        'avg_ear_mean': float(valid_ears.mean()) if valid_ears.size else np.nan,
+        'avg_ear_std': float(valid_ears.std()) if valid_ears.size else np.nan,
+        'avg_ear_min': float(valid_ears.min()) if valid_ears.size else np.nan,
+        'blink_count': blinks,
+        'blink_rate_per_minute': blinks / (duration / 60.0) if duration else np.nan,
+    }
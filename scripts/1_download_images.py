@@ -1,11 +1,11 @@
 # scripts/1_download_images.py
 import pandas as pd
-import requests
 import os
+import time
 import logging
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
-import mimetypes
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from facial_feature_extractor.download import ImageDownloader, DownloadState
 
 # --- Configuration ---
 # Input CSV containing URLs
@@ -21,44 +21,35 @@ OUTPUT_CSV_PATH = 'data/downloaded_image_paths.csv'
 
 MAX_WORKERS = 10
 REQUEST_TIMEOUT = 15
-DEFAULT_EXTENSION = '.jpg'
+# Maximum number of concurrent requests to a single host
+PER_HOST_LIMIT = 8
+# Retries after the first attempt for timeouts, connection errors and 5xx/429 responses
+MAX_RETRIES = 3
+# Base delay (seconds) of the jittered exponential backoff between retries
+RETRY_BACKOFF_BASE = 0.5
+
+# Sync mode: only fetch rows that are new or changed since the last run, and merge the
+# results into OUTPUT_CSV_PATH instead of re-downloading the whole manifest
+SYNC_MODE = True
+# State file recording the URL, ETag/Last-Modified, size and hash of every downloaded image
+DOWNLOAD_STATE_PATH = 'data/download_state.json'
+# Re-check existing images with conditional requests once their last check is older than this (None: never)
+REVALIDATE_AFTER_HOURS = 24 * 7
+# Also compare the SHA-256 of existing files against the state (reads every file)
+VERIFY_HASH = False
 
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def get_file_extension(content_type: str | None) -> str:
-    """Guesses file extension from MIME type."""
-    if not content_type:
-        return DEFAULT_EXTENSION
-    return mimetypes.guess_extension(content_type.split(';')[0].strip()) or DEFAULT_EXTENSION
-
-
-def download_and_save(url: str, id_val: str, index: int) -> dict:
-    """Downloads a single image and saves it to disk."""
-    result = {'index': index, 'image_filepath': None, 'error': None}
-    if not isinstance(url, str) or not url.startswith('http'):
-        result['error'] = f'Invalid URL format: {url}'
-        return result
-
-    try:
-        response = requests.get(url, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-
-        ext = get_file_extension(response.headers.get('Content-Type'))
-        filename = f"{str(id_val).strip()}{ext}"
-        filepath = os.path.join(IMAGE_SAVE_DIR, filename)
-
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
-        result['image_filepath'] = filepath
-
-    except requests.RequestException as e:
-        result['error'] = str(e)
-    except IOError as e:
-        result['error'] = f"File save error: {e}"
-
-    return result
+def find_existing_images(directory):
+    """Maps file names without extension to the image files already in `directory`."""
+    existing = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith(('.part', '.tmp')) and entry.stat().st_size > 0:
+                existing[os.path.splitext(entry.name)[0]] = entry.path
+    return existing
 
 
 def main():
@@ -73,32 +64,79 @@ def main():
     os.makedirs(IMAGE_SAVE_DIR, exist_ok=True)
     logging.info(f"Images will be saved to '{IMAGE_SAVE_DIR}'")
 
-    tasks = []
-    for index, row in df.iterrows():
-        url = row.get(URL_COLUMN)
-        id_val = row.get(ID_COLUMN)
-        if pd.notna(url) and pd.notna(id_val):
-            tasks.append((url, id_val, index))
+    state = DownloadState(DOWNLOAD_STATE_PATH) if SYNC_MODE else None
+    existing_files = find_existing_images(IMAGE_SAVE_DIR) if SYNC_MODE else {}
+    revalidate_before = time.time() - REVALIDATE_AFTER_HOURS * 3600 if REVALIDATE_AFTER_HOURS is not None else None
 
     results = [None] * len(df)
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_and_save, url, id_val, index): index for url, id_val, index in tasks}
-
-        for future in tqdm(futures, total=len(tasks), desc="Downloading Images"):
-            res = future.result()
-            results[res['index']] = res
+    tasks = []
+    skipped = 0
+    for position, (url, id_val) in enumerate(zip(df[URL_COLUMN], df[ID_COLUMN])):
+        if pd.isna(url) or pd.isna(id_val):
+            continue
+        validators = None
+        if SYNC_MODE:
+            key = str(id_val).strip()
+            if state.get(key) is None and key in existing_files:
+                # Downloaded before the state file existed
+                state.adopt(key, url, existing_files[key])
+            if state.is_valid(key, url, verify_hash=VERIFY_HASH):
+                entry = state.get(key)
+                if revalidate_before is None or entry['checked_at'] >= revalidate_before:
+                    results[position] = {'image_filepath': entry['image_filepath'], 'error': None}
+                    skipped += 1
+                    continue
+                validators = entry
+        tasks.append((url, id_val, position, validators))
+    if SYNC_MODE:
+        logging.info(f"Sync: {skipped} images are up to date, {len(tasks)} to fetch or revalidate.")
+
+    # One pooled session is shared by all threads, so connections are reused across URLs
+    downloader = ImageDownloader(IMAGE_SAVE_DIR, pool_size=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT,
+                                 timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, backoff_base=RETRY_BACKOFF_BASE)
+    not_modified = 0
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(downloader.download, url, id_val, validators): (url, id_val, position)
+                       for url, id_val, position, validators in tasks}
+
+            for future in tqdm(as_completed(futures), total=len(tasks), desc="Downloading Images"):
+                url, id_val, position = futures[future]
+                result = future.result()
+                if SYNC_MODE:
+                    state.update(id_val, url, result)
+                    if result['not_modified']:
+                        result['image_filepath'] = state.get(id_val)['image_filepath']
+                        not_modified += 1
+                results[position] = result
+    finally:
+        downloader.close()
+        if SYNC_MODE:
+            state.save()
 
     # Add results back to the DataFrame
     df['image_filepath'] = [r['image_filepath'] if r else None for r in results]
     df['download_error'] = [r['error'] if r else 'No URL/ID' for r in results]
 
+    if SYNC_MODE and os.path.exists(OUTPUT_CSV_PATH):
+        # Keep the rows of earlier runs that are no longer in the manifest
+        previous = pd.read_csv(OUTPUT_CSV_PATH, encoding='utf-8-sig')
+        if ID_COLUMN in previous.columns:
+            current_ids = set(df[ID_COLUMN].astype(str))
+            previous = previous[~previous[ID_COLUMN].astype(str).isin(current_ids)]
+            df = pd.concat([previous, df], ignore_index=True)
+
     # Save the new CSV with local paths
     df.to_csv(OUTPUT_CSV_PATH, index=False, encoding='utf-8-sig')
     logging.info(f"Saved new CSV with local paths to {OUTPUT_CSV_PATH}")
 
     success_count = df['image_filepath'].notna().sum()
-    logging.info(f"Successfully downloaded {success_count} / {len(tasks)} images.")
+    logging.info(f"{success_count} / {len(df)} rows have a local image; {len(tasks)} requests sent, "
+                 f"{not_modified} answered 304 Not Modified.")
+    stats = downloader.throughput()
+    logging.info(f"Throughput: {stats['files_per_second']:.1f} images/sec, "
+                 f"{stats['megabytes_per_second']:.2f} MB/sec over {stats['elapsed_seconds']:.1f}s")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
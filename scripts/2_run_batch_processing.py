@@ -1,95 +1,455 @@
 # scripts/2_run_batch_processing.py
 import os
+import argparse
 import pandas as pd
 from tqdm import tqdm
+import time
+import heapq
+import itertools
 import logging
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from facial_feature_extractor.analysis import FaceAnalyzer
+import threading
+import multiprocessing
+import multiprocessing.util
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from facial_feature_extractor.analysis import (FaceAnalyzer, RESULT_PROFILE_FEATURES, RESULT_PROFILE_LANDMARKS,
+                                               RESULT_PROFILE_FULL)
 from facial_feature_extractor.features import ALL_FEATURE_NAMES
+from facial_feature_extractor.utils import save_image
+from facial_feature_extractor.batch import (IncrementalCSVWriter, read_completed_image_paths, compact_output_csv,
+                                            iter_image_paths,
+                                            iter_manifest_paths, iter_chunks, submit_bounded, WatchdogProcessPool,
+                                            ItemTimeoutError, iter_shard, shard_path, processed_image_name)
+from facial_feature_extractor.landmarks import load_shape_predictor
+from facial_feature_extractor.cache import ResultCache
+from facial_feature_extractor.metrics import MetricsAggregator, peak_rss_bytes
+from facial_feature_extractor.landmark_store import LandmarkStoreWriter
+from facial_feature_extractor.quality import QUALITY_METRIC_NAMES
+from facial_feature_extractor.dedup import NearDuplicateFilter
+from facial_feature_extractor.chip_store import ChipArchiveWriter
 
 # --- Configuration ---
-# Directory containing the images to process
+# Directory containing the images to process (scanned recursively)
 IMAGE_DIRECTORY = "data/input_images"
+# Optional CSV or JSONL manifest listing the images to process in an 'image_path' column/key.
+# If set, it is used instead of scanning IMAGE_DIRECTORY.
+INPUT_MANIFEST_PATH = None
 # Path to save the final CSV with all features
 OUTPUT_CSV_PATH = "data/facial_features_output.csv"
+# Multi-node runs: the input is split into NUM_SHARDS disjoint shards by a stable hash of each
+# image path (relative to IMAGE_DIRECTORY when scanning it), and this run processes shard SHARD_INDEX
+# (0-based). Every node sees the same input and only differs in SHARD_INDEX. Each shard writes its own
+# OUTPUT_CSV_PATH, LANDMARK_STORE_DIR and METRICS_PATH with a '.shard-<i>-of-<n>' suffix;
+# scripts/merge_batch_shards.py merges the CSVs and checks that every image appears exactly once.
+# Both values can be overridden per node with --num-shards/--shard-index or the FFE_NUM_SHARDS and
+# FFE_SHARD_INDEX environment variables, so every node runs the same script file.
+NUM_SHARDS = 1
+SHARD_INDEX = 0
 # Path to the dlib shape predictor model
 SHAPE_PREDICTOR_PATH = "models/shape_predictor_68_face_landmarks.dat"
-# Number of parallel processes to use
+# How images are processed in parallel:
+#   'process': worker processes that each load their own copy of the ~100MB shape predictor
+#   'fork':    worker processes forked after the main process loaded the model, sharing it copy-on-write (POSIX only)
+#   'thread':  threads sharing one model; dlib and OpenCV release the GIL in their heavy calls.
+#              IMAGE_TIME_BUDGET is not enforced in this mode, as threads cannot be stopped.
+# scripts/benchmark_execution_modes.py compares their throughput and memory.
+EXECUTION_MODE = 'fork' if hasattr(os, 'fork') else 'process'
+# Number of parallel processes (or threads) to use
 MAX_WORKERS = max(1, os.cpu_count() - 1)
+# Number of images sent to a worker per task
+TASK_CHUNK_SIZE = 16
+# Maximum number of submitted but unfinished tasks; bounds memory for any input size
+MAX_IN_FLIGHT_TASKS = MAX_WORKERS * 4
+# Result profile requested from the analyzer ('features', 'landmarks' or 'full').
+# Only the features are written to the CSV, so the lightest profile is the default.
+RESULT_PROFILE = RESULT_PROFILE_FEATURES
+# Directory to save the final processed face images to (None to skip saving).
+# Images are written by the workers themselves and never sent back to the main process.
+PROCESSED_IMAGE_DIR = None
+# Pack the processed images into chip archive shards in PROCESSED_IMAGE_DIR (each worker appends
+# to its own chips_*.chips shards; read them back with chip_store.ChipArchive) instead of writing
+# one PNG per image. 'processed_image_path' then holds '<shard file>#<row>' instead of a PNG path.
+PROCESSED_IMAGE_ARCHIVE = False
+PROCESSED_IMAGE_ARCHIVE_SHARD_SIZE = 10000
+# Directory of the compact landmark store (None to disable). Features can be recomputed
+# from it with scripts/3_recompute_features_from_store.py without touching the images.
+LANDMARK_STORE_DIR = "data/landmark_store"
+# Maximum landmark sets per shard. Buffered sets are appended to the open shard before every CSV chunk,
+# so the store never lags behind the CSV that RESUME skips images by, without cutting shards short.
+# With RESUME = False the store is recreated.
+LANDMARK_STORE_SHARD_SIZE = 10000
+# Number of results buffered before they are appended to the output CSV
+WRITE_CHUNK_SIZE = 500
+# Skip images already present in OUTPUT_CSV_PATH and append new results to it.
+# Set to False to overwrite the output from scratch.
+RESUME = True
+# Resumed runs retry images without a final result (timeouts, crashes) until they have been tried
+# this many times. Their earlier rows are dropped from the CSV once they get a final result.
+MAX_ATTEMPTS = 2
+# Upsampling levels tried in order until a face is found. Most photos have large faces,
+# so starting at 0 avoids scanning a 4x larger image for them. Images without a face pay for
+# every level (1 + 4 + 16 = 21x the pixels of level 0 for (0, 1, 2)), so keep the list short.
+# Escalation serves the best face only: detection stops at the first level finding any face, so
+# smaller faces only visible at higher levels are not counted in 'num_faces'.
+DETECT_UPSAMPLE_LEVELS = (0, 1)
+# Escalate to the next level if the largest face found is smaller than this (in pixels, None to disable)
+DETECT_MIN_FACE_AREA = None
+# Decode larger images reduced to this many pixels, bounding the memory of each worker
+# (None for full resolution). JPEGs are decoded directly at 1/2, 1/4 or 1/8 size.
+LOAD_MAX_PIXELS = 12_000_000
+# Report landmarks, face_area and features in full-resolution coordinates even when reduced
+REPORT_ORIGINAL_COORDINATES = True
+# Reject blurry, tiny, black or overexposed images before detection (status 'low_quality')
+# and write the quality metrics as columns. Thresholds are the analyzer's 'quality_*' defaults.
+QUALITY_CHECK = True
+# Subset of features to compute and write (None for all of ALL_FEATURE_NAMES)
+FEATURE_NAMES = None
+# Path to a persistent result cache shared by all workers (None to disable caching).
+# Images whose bytes, config and model are unchanged skip detection and landmarking.
+CACHE_PATH = None
+CACHE_MAX_SIZE_MB = 1024
+# Record per-stage timings in every worker and export aggregated metrics
+COLLECT_TIMINGS = True
+# Metrics output: Prometheus text format for '.prom' files, JSON otherwise (None to disable)
+METRICS_PATH = "data/batch_metrics.json"
+# Seconds between intermediate metrics dumps during a run
+METRICS_DUMP_INTERVAL = 60
+# Maximum seconds per image (None to disable). A worker exceeding it is killed and replaced,
+# and the image is recorded with the status 'timeout'.
+IMAGE_TIME_BUDGET = 120
+# Seconds between checks of the images being processed
+WATCHDOG_POLL_INTERVAL = 1.0
+# Skip the analysis of near-duplicates (e.g. recompressed copies) of images seen earlier in the run
+# (or shard) and copy the earlier result instead. The copy gets the original's path in 'duplicate_of'
+# and the Hamming distance of their 64-bit perceptual hashes (dHash) in 'duplicate_distance'.
+# Results are only copied between images of the same dimensions; resized copies are analyzed
+# themselves (and still marked). Flat or low-texture images are never treated as duplicates.
+# Every image is read once more for hashing, by DEDUP_HASH_WORKERS threads in the main process.
+DEDUPLICATE = False
+# Maximum Hamming distance between the hashes of near-duplicates (out of 64 bits)
+DEDUP_MAX_DISTANCE = 4
+# Threads hashing images ahead of the worker pool
+DEDUP_HASH_WORKERS = MAX_WORKERS
+# Results kept in memory for later duplicates; a duplicate of an older image is analyzed itself
+DEDUP_MAX_RETAINED_RESULTS = 20_000
+# Number of slowest images logged at the end of the run, with their size and stage timings
+SLOWEST_IMAGES_TO_LOG = 10
 
-# --- Global Initializer for Multiprocessing ---
-# This avoids re-loading the model in every single process call
-analyzer = None
+# --- Worker Initializer ---
+# One analyzer per worker process (or per thread in 'thread' mode), so the model is not
+# re-loaded for every image
+_worker_state = threading.local()
 
 
-def initialize_worker(predictor_path):
-    """Initializes the FaceAnalyzer in each worker process."""
-    global analyzer
-    logging.info(f"Initializing analyzer in process {os.getpid()}...")
-    analyzer = FaceAnalyzer(shape_predictor_path=predictor_path)
+def initialize_worker(predictor_path, result_profile, cache_path=None):
+    """Initializes the FaceAnalyzer in each worker process or thread."""
+    logging.info(f"Initializing analyzer in process {os.getpid()} ({threading.current_thread().name})...")
+    cache = ResultCache(cache_path, max_size_bytes=CACHE_MAX_SIZE_MB * 1024 * 1024) if cache_path else None
+    config = {
+        'result_profile': result_profile,
+        'detect_upsample_levels': DETECT_UPSAMPLE_LEVELS,
+        'detect_min_face_area': DETECT_MIN_FACE_AREA,
+        'collect_timings': COLLECT_TIMINGS,
+        'feature_names': FEATURE_NAMES,
+        'quality_check': QUALITY_CHECK,
+        'load_max_pixels': LOAD_MAX_PIXELS,
+        'report_original_coordinates': REPORT_ORIGINAL_COORDINATES,
+    }
+    _worker_state.analyzer = FaceAnalyzer(shape_predictor_path=predictor_path, config=config, cache=cache)
 
 
-def process_image_task(image_path):
-    """A wrapper function to be called by each process."""
+def get_chip_writer(image_output_dir):
+    """
+    Returns this worker's chip archive writer, creating it on first use (after any fork).
+    The writer is closed when the worker process (or thread) exits.
+    """
+    if getattr(_worker_state, 'chip_writer', None) is None:
+        writer = ChipArchiveWriter(image_output_dir, shard_size=PROCESSED_IMAGE_ARCHIVE_SHARD_SIZE)
+        # Unlike atexit handlers, finalizers with an exit priority also run when a pool process exits
+        multiprocessing.util.Finalize(writer, writer.close, exitpriority=10)
+        _worker_state.chip_writer = writer
+    return _worker_state.chip_writer
+
+
+def process_image_task(image_path, image_output_dir=None):
+    """
+    A wrapper function to be called by each process.
+
+    If `image_output_dir` is given, the final processed image is saved by the worker (as a PNG,
+    or appended to the worker's chip archive shard as '<shard file>#<row>') and only its location
+    is returned; image arrays are always removed from the returned result.
+    """
+    analyzer = getattr(_worker_state, 'analyzer', None)
     if analyzer is None:
         raise RuntimeError("Analyzer is not initialized in this process.")
-    return analyzer.process_image(image_path)
+    start_time = time.perf_counter()
+    result = analyzer.process_image(image_path)
 
+    if image_output_dir and result['final_image'] is not None:
+        if PROCESSED_IMAGE_ARCHIVE:
+            location = get_chip_writer(image_output_dir).add(image_path, result['final_image'])
+            result['processed_image_path'] = f"{location[0]}#{location[1]}" if location else None
+        else:
+            root = None if INPUT_MANIFEST_PATH else IMAGE_DIRECTORY
+            output_path = os.path.join(image_output_dir, processed_image_name(image_path, root))
+            result['processed_image_path'] = output_path if save_image(result['final_image'], output_path) else None
+
+    result['aligned_image'] = None
+    result['final_image'] = None
+    result['elapsed_seconds'] = time.perf_counter() - start_time
+    result['worker_peak_rss'] = peak_rss_bytes()
+    return result
+
+
+def process_image_safe_task(image_path, image_output_dir=None):
+    """Runs `process_image_task`, turning exceptions into error results."""
+    try:
+        return process_image_task(image_path, image_output_dir)
+    except Exception as e:
+        return {'image_path': image_path, 'status': 'critical_error', 'error_message': str(e)}
+
+
+def process_image_chunk_task(image_paths, image_output_dir=None):
+    """Processes a chunk of images in one task (used in 'thread' mode)."""
+    return [process_image_safe_task(image_path, image_output_dir) for image_path in image_paths]
+
+
+def start_pool(result_profile):
+    """
+    Creates the worker pool for EXECUTION_MODE.
+
+    Returns:
+        tuple: The pool (a context manager) and a function that takes an iterable of image
+               path chunks and yields (chunk, future) pairs as they complete.
+    """
+    initargs = (SHAPE_PREDICTOR_PATH, result_profile, CACHE_PATH)
+    if EXECUTION_MODE == 'thread':
+        pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, initializer=initialize_worker, initargs=initargs)
+        return pool, lambda chunks: submit_bounded(pool, process_image_chunk_task, chunks, MAX_IN_FLIGHT_TASKS,
+                                                   PROCESSED_IMAGE_DIR)
+
+    mp_context = None
+    if EXECUTION_MODE == 'fork':
+        # Workers forked from here find the model already loaded and share its pages
+        load_shape_predictor(SHAPE_PREDICTOR_PATH)
+        mp_context = multiprocessing.get_context('fork')
+    pool = WatchdogProcessPool(max_workers=MAX_WORKERS, initializer=initialize_worker, initargs=initargs,
+                               time_budget=IMAGE_TIME_BUDGET, poll_interval=WATCHDOG_POLL_INTERVAL,
+                               mp_context=mp_context)
+    return pool, lambda chunks: pool.submit_chunks(process_image_safe_task, chunks, MAX_IN_FLIGHT_TASKS,
+                                                   PROCESSED_IMAGE_DIR)
+
+
+def format_slow_image(elapsed, result):
+    """Describes one slow image for the log: time, status, dimensions, file size and stage timings."""
+    image_path = result['image_path']
+    size = result.get('image_size')
+    dimensions = f"{size[0]}x{size[1]}" if size else "unknown size"
+    try:
+        file_size = f"{os.path.getsize(image_path) / 1e6:.1f} MB"
+    except OSError:
+        file_size = "file size unknown"
+    stages = ', '.join(f"{stage} {values['wall']:.2f}s" for stage, values in (result.get('timings') or {}).items()
+                       if stage != 'total')
+    return f"{elapsed:8.2f}s  {result['status']:<16} {dimensions:<12} {file_size:<10} {image_path}" + \
+        (f"  [{stages}]" if stages else "")
 
-def main():
-    """Main function to run batch processing on a directory of images."""
-    if not os.path.exists(IMAGE_DIRECTORY):
-        logging.error(f"Image directory not found: {IMAGE_DIRECTORY}")
-        return
 
-    image_paths = [os.path.join(IMAGE_DIRECTORY, f) for f in os.listdir(IMAGE_DIRECTORY) if
-                   f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    if not image_paths:
-        logging.warning(f"No images found in '{IMAGE_DIRECTORY}'.")
+def flatten_result(result):
+    """Flattens an analyzer result into a CSV row."""
+    if 'features' not in result:  # Error results from the main process (critical errors, timeouts)
+        return result
+    flat_result = {
+        'image_path': result['image_path'],
+        'status': result['status'],
+        'error_message': result['error_message'],
+        'face_area': result['face_area'],
+        'num_faces': result['num_faces'],
+        'detect_upsample_used': result['detect_upsample_used']
+    }
+    if PROCESSED_IMAGE_DIR:
+        flat_result['processed_image_path'] = result.get('processed_image_path')
+    if QUALITY_CHECK:
+        flat_result.update(result.get('quality') or {})
+    if DEDUPLICATE:
+        flat_result['duplicate_of'] = result.get('duplicate_of')
+        flat_result['duplicate_distance'] = result.get('duplicate_distance')
+    # Add all feature values
+    flat_result.update(result['features'])
+    return flat_result
+
+
+def parse_args():
+    """Parses the per-node overrides of NUM_SHARDS and SHARD_INDEX (flags, then environment, then the constants)."""
+    parser = argparse.ArgumentParser(description="Extracts facial features from a directory or manifest of images.")
+    parser.add_argument('--num-shards', type=int, default=int(os.environ.get('FFE_NUM_SHARDS', NUM_SHARDS)),
+                        help="Number of shards the input is split into (default: FFE_NUM_SHARDS or NUM_SHARDS)")
+    parser.add_argument('--shard-index', type=int, default=int(os.environ.get('FFE_SHARD_INDEX', SHARD_INDEX)),
+                        help="0-based shard processed by this run (default: FFE_SHARD_INDEX or SHARD_INDEX)")
+    return parser.parse_args()
+
+
+def main(num_shards=NUM_SHARDS, shard_index=SHARD_INDEX):
+    """
+    Main function to run batch processing on a directory tree or manifest of images.
+
+    Args:
+        num_shards (int): Number of shards the input is split into.
+        shard_index (int): The 0-based shard processed by this run.
+    """
+    if EXECUTION_MODE not in ('process', 'fork', 'thread'):
+        logging.error(f"Unknown EXECUTION_MODE '{EXECUTION_MODE}'. Expected 'process', 'fork' or 'thread'.")
+        return
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        logging.error(f"The shard index must be between 0 and the number of shards - 1 ({num_shards - 1}), "
+                      f"got {shard_index}.")
         return
+    if EXECUTION_MODE == 'thread' and IMAGE_TIME_BUDGET:
+        logging.warning("IMAGE_TIME_BUDGET is not enforced in 'thread' mode.")
+    if INPUT_MANIFEST_PATH:
+        if not os.path.exists(INPUT_MANIFEST_PATH):
+            logging.error(f"Input manifest not found: {INPUT_MANIFEST_PATH}")
+            return
+        image_paths = iter_manifest_paths(INPUT_MANIFEST_PATH)
+        source = INPUT_MANIFEST_PATH
+    else:
+        if not os.path.exists(IMAGE_DIRECTORY):
+            logging.error(f"Image directory not found: {IMAGE_DIRECTORY}")
+            return
+        image_paths = iter_image_paths(IMAGE_DIRECTORY)
+        source = IMAGE_DIRECTORY
 
-    logging.info(f"Found {len(image_paths)} images. Starting processing with {MAX_WORKERS} workers...")
+    # Each shard writes its own outputs, so nodes never write to the same file
+    output_csv_path = shard_path(OUTPUT_CSV_PATH, num_shards, shard_index)
+    landmark_store_dir = shard_path(LANDMARK_STORE_DIR, num_shards, shard_index) if LANDMARK_STORE_DIR else None
+    metrics_path = shard_path(METRICS_PATH, num_shards, shard_index) if METRICS_PATH else None
+    if num_shards > 1:
+        image_paths = iter_shard(image_paths, num_shards, shard_index,
+                                 root=None if INPUT_MANIFEST_PATH else IMAGE_DIRECTORY)
+        source = f"{source} (shard {shard_index + 1} of {num_shards})"
 
-    all_results = []
+    # Resume: skip images already recorded in the output CSV from a previous run
+    if RESUME:
+        completed_paths = read_completed_image_paths(output_csv_path, max_attempts=MAX_ATTEMPTS)
+        if completed_paths:
+            logging.info(f"Resuming: {len(completed_paths)} images already processed will be skipped.")
+            image_paths = (path for path in image_paths if path not in completed_paths)
 
-    # Using ProcessPoolExecutor to leverage multiple CPU cores
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=initialize_worker,
-                             initargs=(SHAPE_PREDICTOR_PATH,)) as executor:
+    # Near-duplicates of images already passed on are held back and get a copy of their result
+    dedup = None
+    if DEDUPLICATE:
+        dedup = NearDuplicateFilter(max_distance=DEDUP_MAX_DISTANCE,
+                                    max_retained_results=DEDUP_MAX_RETAINED_RESULTS,
+                                    num_workers=DEDUP_HASH_WORKERS)
+        image_paths = dedup.filter(image_paths)
 
-        futures = {executor.submit(process_image_task, path): path for path in image_paths}
+    logging.info(f"Streaming images from '{source}'. Starting processing with {MAX_WORKERS} workers...")
 
-        for future in tqdm(as_completed(futures), total=len(image_paths), desc="Processing Images"):
-            try:
-                result = future.result()
-                # Flatten the result for the DataFrame
-                flat_result = {
-                    'image_path': result['image_path'],
-                    'status': result['status'],
-                    'error_message': result['error_message'],
-                    'face_area': result['face_area']
-                }
-                # Add all feature values
-                flat_result.update(result['features'])
-                all_results.append(flat_result)
+    # Define column order for better readability
+    columns = ['image_path', 'status', 'error_message', 'face_area', 'num_faces', 'detect_upsample_used']
+    if QUALITY_CHECK:
+        columns += QUALITY_METRIC_NAMES
+    if DEDUPLICATE:
+        columns += ['duplicate_of', 'duplicate_distance']
+    columns += list(FEATURE_NAMES or ALL_FEATURE_NAMES)
+    if PROCESSED_IMAGE_DIR:
+        columns.append('processed_image_path')
+    metrics = MetricsAggregator()
+    last_metrics_dump = time.time()
 
+    # Saving images needs the full profile; the images themselves stay in the workers.
+    # The landmark store needs at least the landmarks profile.
+    result_profile = RESULT_PROFILE
+    if PROCESSED_IMAGE_DIR:
+        result_profile = RESULT_PROFILE_FULL
+    elif landmark_store_dir and RESULT_PROFILE == RESULT_PROFILE_FEATURES:
+        result_profile = RESULT_PROFILE_LANDMARKS
+    if PROCESSED_IMAGE_DIR:
+        os.makedirs(PROCESSED_IMAGE_DIR, exist_ok=True)
+
+    # Results are written to the CSV in chunks as they complete
+    pool, submit_chunks = start_pool(result_profile)
+    # The store is flushed before every CSV chunk, so images marked done in the CSV always have their landmarks
+    store_writer = LandmarkStoreWriter(landmark_store_dir, LANDMARK_STORE_SHARD_SIZE, overwrite=not RESUME) \
+        if landmark_store_dir else None
+    with IncrementalCSVWriter(output_csv_path, columns, chunk_size=WRITE_CHUNK_SIZE, append=RESUME,
+                              before_flush=store_writer.flush if store_writer else None) as writer, \
+            (store_writer or nullcontext()) as landmark_store, \
+            pool:
+
+        # Images are submitted in chunks as workers free up, so scanning and processing overlap
+        completed_tasks = submit_chunks(iter_chunks(image_paths, TASK_CHUNK_SIZE))
+        progress = tqdm(desc="Processing Images", unit="img")
+        slowest = []  # Min-heap of (elapsed, sequence number, result) for the slowest images
+        sequence = itertools.count()
+
+        def record(results):
+            """Writes results and adds them to the landmark store, metrics and slowest images."""
+            for result in results:
+                writer.write(flatten_result(result))
+                if landmark_store is not None:
+                    landmark_store.add(result['image_path'], result.get('landmarks'))
+                metrics.add_result(result['status'], result.get('timings'), result.get('worker_peak_rss'))
+                if SLOWEST_IMAGES_TO_LOG and result.get('elapsed_seconds') is not None:
+                    entry = (result['elapsed_seconds'], next(sequence), result)
+                    if len(slowest) < SLOWEST_IMAGES_TO_LOG:
+                        heapq.heappush(slowest, entry)
+                    elif entry[0] > slowest[0][0]:
+                        heapq.heapreplace(slowest, entry)
+            progress.update(len(results))
+
+        for chunk, future in completed_tasks:
+            try:
+                results = future.result()
+            except ItemTimeoutError as e:
+                logging.warning(f"Timeout after {e.elapsed:.1f}s, worker replaced: {e.item}")
+                results = [{'image_path': e.item, 'status': 'timeout', 'error_message': str(e),
+                            'elapsed_seconds': e.elapsed}]
             except Exception as e:
-                image_path = futures[future]
-                logging.error(f"Error processing {image_path}: {e}")
-                all_results.append({'image_path': image_path, 'status': 'critical_error', 'error_message': str(e)})
+                logging.error(f"Error processing chunk starting at {chunk[0]}: {e}")
+                results = [{'image_path': path, 'status': 'critical_error', 'error_message': str(e)} for path in chunk]
 
-    # Create a DataFrame from the results
-    # Define column order for better readability
-    columns = ['image_path', 'status', 'error_message', 'face_area'] + ALL_FEATURE_NAMES
-    results_df = pd.DataFrame(all_results, columns=columns)
+            if dedup is not None:
+                for result in results:
+                    dedup.add_result(result)
+                results += dedup.pop_ready()
+            record(results)
 
-    # Save to CSV
-    os.makedirs(os.path.dirname(OUTPUT_CSV_PATH), exist_ok=True)
-    results_df.to_csv(OUTPUT_CSV_PATH, index=False, encoding='utf-8-sig')
+            if metrics_path and time.time() - last_metrics_dump >= METRICS_DUMP_INTERVAL:
+                metrics.dump(metrics_path)
+                last_metrics_dump = time.time()
+        if dedup is not None:
+            record(dedup.pop_ready())  # Duplicates found after the last analyzed image finished
+        progress.close()
 
-    logging.info(f"\nProcessing complete. Results saved to {OUTPUT_CSV_PATH}")
-    logging.info(f"Status summary:\n{results_df['status'].value_counts().to_string()}")
+    # Written before any early return, so a run with nothing left to process still replaces the
+    # intermediate dumps with its final metrics
+    if metrics_path:
+        metrics.dump(metrics_path)
+        logging.info(f"Metrics saved to {metrics_path}")
+    if writer.rows_written == 0:
+        logging.warning(f"No new images found in '{source}'.")
+        return
+    logging.info(f"\nProcessing complete. {writer.rows_written} new results saved to {output_csv_path}")
+    if RESUME:
+        superseded = compact_output_csv(output_csv_path)
+        if superseded:
+            logging.info(f"Dropped {superseded} earlier rows of retried images from {output_csv_path}.")
+    logging.info(f"Status summary:\n{pd.Series(metrics.status_counts).sort_values(ascending=False).to_string()}")
+    if metrics.worker_peak_rss_bytes is not None:
+        logging.info(f"Peak RSS: {metrics.worker_peak_rss_bytes / 1e6:.0f} MB per worker (max), "
+                     f"{peak_rss_bytes() / 1e6:.0f} MB in the main process.")
+    if dedup is not None and dedup.duplicates_found:
+        logging.info(f"Near-duplicates: {dedup.duplicates_found} images matched an earlier image "
+                     f"(within {DEDUP_MAX_DISTANCE} bits); results were copied for same-size matches still in memory.")
+    if getattr(pool, 'restarts', 0):
+        logging.info(f"Worker pool was restarted {pool.restarts} times after timeouts or crashes.")
+    if slowest:
+        lines = [format_slow_image(elapsed, result) for elapsed, _, result in sorted(slowest, reverse=True)]
+        logging.info(f"Slowest {len(lines)} images:\n" + '\n'.join(lines))
 
 
 if __name__ == "__main__":
     # This is important for multiprocessing on some platforms (like Windows)
-    main()
\ No newline at end of file
+    args = parse_args()
+    main(args.num_shards, args.shard_index)
\ No newline at end of file
@@ -0,0 +1,46 @@
+# scripts/3_recompute_features_from_store.py
+import os
+import logging
+from tqdm import tqdm
+from facial_feature_extractor.features import calculate_features_batch
+from facial_feature_extractor.landmark_store import LandmarkStore
+
+# --- Configuration ---
+# Landmark store written by 2_run_batch_processing.py
+LANDMARK_STORE_DIR = "data/landmark_store"
+# Path to save the recomputed features
+OUTPUT_CSV_PATH = "data/facial_features_recomputed.csv"
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def main():
+    """Recomputes all features from stored landmarks, without loading any image or dlib model."""
+    try:
+        store = LandmarkStore(LANDMARK_STORE_DIR)
+    except FileNotFoundError as e:
+        logging.error(str(e))
+        return
+    if not store.shard_indices:
+        logging.warning(f"No landmark shards found in '{LANDMARK_STORE_DIR}'.")
+        return
+
+    directory = os.path.dirname(OUTPUT_CSV_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    total_rows = 0
+    with open(OUTPUT_CSV_PATH, 'w', encoding='utf-8-sig', newline='') as f:
+        for shard_number, (image_ids, landmarks) in enumerate(tqdm(store.iter_shards(), total=len(store.shard_indices),
+                                                                   desc="Recomputing Features", unit="shard")):
+            features_df = calculate_features_batch(landmarks)
+            features_df.insert(0, 'image_path', image_ids)
+            features_df.to_csv(f, header=(shard_number == 0), index=False)
+            total_rows += len(features_df)
+
+    logging.info(f"Recomputed features for {total_rows} faces. Results saved to {OUTPUT_CSV_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# scripts/4_download_and_process.py
+import os
+import queue
+import logging
+import threading
+import pandas as pd
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from facial_feature_extractor.analysis import FaceAnalyzer, RESULT_PROFILE_FEATURES
+from facial_feature_extractor.features import ALL_FEATURE_NAMES
+from facial_feature_extractor.download import ImageDownloader, get_file_extension
+from facial_feature_extractor.quality import QUALITY_METRIC_NAMES
+from facial_feature_extractor.batch import (IncrementalCSVWriter, read_completed_image_paths, compact_output_csv,
+                                            iter_chunks, submit_bounded)
+
+# --- Configuration ---
+# Input CSV containing URLs
+INPUT_CSV_PATH = 'data/source_urls.csv'
+# Column in the CSV that contains the image URLs
+URL_COLUMN = 'validate_photo_url'
+# Column identifying each row; the output CSV joins on it
+ID_COLUMN = 'order_no'
+# Path to save the CSV with all features. Its columns differ from those of 2_run_batch_processing.py,
+# so the two scripts must not share an output file (resuming would refuse the mismatched header).
+OUTPUT_CSV_PATH = 'data/facial_features_from_urls.csv'
+# Path to the dlib shape predictor model
+SHAPE_PREDICTOR_PATH = 'models/shape_predictor_68_face_landmarks.dat'
+# Directory to also persist the raw downloaded images to (None to keep them in memory only)
+RAW_IMAGE_SAVE_DIR = None
+
+# Download threads and analysis processes
+DOWNLOAD_WORKERS = 16
+ANALYSIS_WORKERS = max(1, os.cpu_count() - 1)
+REQUEST_TIMEOUT = 15
+PER_HOST_LIMIT = 8
+MAX_RETRIES = 3
+# Maximum number of downloaded images waiting for analysis; downloads pause when it is full
+DOWNLOAD_QUEUE_SIZE = 256
+# Number of images sent to an analysis worker per task, and the maximum number of pending tasks
+TASK_CHUNK_SIZE = 8
+MAX_IN_FLIGHT_TASKS = ANALYSIS_WORKERS * 2
+# Number of results buffered before they are appended to the output CSV
+WRITE_CHUNK_SIZE = 500
+# Decode larger images reduced to this many pixels, bounding the memory of each worker (None for full resolution)
+LOAD_MAX_PIXELS = 12_000_000
+# Reject blurry, tiny, black or overexposed images before detection and write the quality metrics
+QUALITY_CHECK = True
+# Skip rows whose ID is already present in OUTPUT_CSV_PATH
+RESUME = True
+# Resumed runs retry rows without a final result (download errors, crashes) until they have been
+# tried this many times. Their earlier rows are dropped from the CSV once they get a final result.
+MAX_ATTEMPTS = 3
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Global Initializer for Multiprocessing ---
+analyzer = None
+# Marks the end of the download queue
+_END_OF_QUEUE = None
+
+
+def initialize_worker(predictor_path):
+    """Initializes the FaceAnalyzer in each analysis process."""
+    global analyzer
+    logging.info(f"Initializing analyzer in process {os.getpid()}...")
+    config = {'result_profile': RESULT_PROFILE_FEATURES, 'quality_check': QUALITY_CHECK,
+              'load_max_pixels': LOAD_MAX_PIXELS, 'report_original_coordinates': True}
+    analyzer = FaceAnalyzer(shape_predictor_path=predictor_path, config=config)
+
+
+def analyze_chunk_task(items):
+    """Analyzes a chunk of downloaded images in an analysis process."""
+    rows = []
+    for item in items:
+        row = {ID_COLUMN: item['id'], URL_COLUMN: item['url'], 'download_error': item['error']}
+        if item['image_bytes'] is None:
+            row.update(status='download_error', error_message=item['error'])
+            rows.append(row)
+            continue
+        try:
+            result = analyzer.process_image_bytes(item['image_bytes'], image_path=item['image_filepath'])
+            row.update(status=result['status'], error_message=result['error_message'],
+                       face_area=result['face_area'], image_filepath=item['image_filepath'])
+            row.update(result['quality'] or {})
+            row.update(result['features'])
+        except Exception as e:
+            row.update(status='critical_error', error_message=str(e))
+        rows.append(row)
+    return rows
+
+
+def fetch_task(downloader, url, id_val):
+    """Downloads one image into memory, optionally persisting the raw bytes."""
+    item = {'id': id_val, 'url': url, 'image_bytes': None, 'image_filepath': None, 'error': None}
+    if not isinstance(url, str) or not url.startswith('http'):
+        item['error'] = f'Invalid URL format: {url}'
+        return item
+    try:
+        item['image_bytes'], content_type = downloader.fetch_bytes(url)
+    except Exception as e:
+        item['error'] = str(e)
+        return item
+
+    if RAW_IMAGE_SAVE_DIR:
+        filepath = os.path.join(RAW_IMAGE_SAVE_DIR, f"{str(id_val).strip()}{get_file_extension(content_type)}")
+        try:
+            with open(filepath, 'wb') as f:
+                f.write(item['image_bytes'])
+            item['image_filepath'] = filepath
+        except IOError as e:
+            logging.warning(f"Could not save raw image {filepath}: {e}")
+    return item
+
+
+def iter_download_tasks(completed_ids):
+    """Yields (url, id) pairs from the input CSV, read in chunks."""
+    # IDs are read as strings, so e.g. order numbers keep their leading zeros in the output and resume checks
+    for chunk in pd.read_csv(INPUT_CSV_PATH, usecols=[URL_COLUMN, ID_COLUMN], dtype={ID_COLUMN: str},
+                             chunksize=10000):
+        for url, id_val in zip(chunk[URL_COLUMN], chunk[ID_COLUMN]):
+            if pd.isna(url) or pd.isna(id_val) or str(id_val) in completed_ids:
+                continue
+            yield url, id_val
+
+
+def run_downloads(downloader, download_queue, completed_ids):
+    """Producer thread: downloads images and puts them on the bounded queue."""
+    try:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            tasks = ((downloader, url, id_val) for url, id_val in iter_download_tasks(completed_ids))
+            for _, future in submit_bounded(executor, lambda task: fetch_task(*task), tasks, DOWNLOAD_WORKERS * 2):
+                download_queue.put(future.result())  # Blocks while the analysis side is behind
+    finally:
+        download_queue.put(_END_OF_QUEUE)
+
+
+def main():
+    """Downloads images and analyzes them in one pass, without a second scan of the disk."""
+    if not os.path.exists(INPUT_CSV_PATH):
+        logging.error(f"Input CSV not found: {INPUT_CSV_PATH}")
+        return
+    if RAW_IMAGE_SAVE_DIR:
+        os.makedirs(RAW_IMAGE_SAVE_DIR, exist_ok=True)
+
+    completed_ids = read_completed_image_paths(OUTPUT_CSV_PATH, path_column=ID_COLUMN, max_attempts=MAX_ATTEMPTS) \
+        if RESUME else set()
+    if completed_ids:
+        logging.info(f"Resuming: {len(completed_ids)} rows already processed will be skipped.")
+
+    columns = [ID_COLUMN, URL_COLUMN, 'image_filepath', 'download_error', 'status', 'error_message',
+               'face_area'] + (QUALITY_METRIC_NAMES if QUALITY_CHECK else []) + ALL_FEATURE_NAMES
+    downloader = ImageDownloader(RAW_IMAGE_SAVE_DIR or '.', pool_size=DOWNLOAD_WORKERS, per_host_limit=PER_HOST_LIMIT,
+                                 timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES)
+    download_queue = queue.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+    producer = threading.Thread(target=run_downloads, args=(downloader, download_queue, completed_ids), daemon=True)
+    producer.start()
+
+    status_counts = {}
+    with IncrementalCSVWriter(OUTPUT_CSV_PATH, columns, chunk_size=WRITE_CHUNK_SIZE, append=RESUME) as writer, \
+            ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS, initializer=initialize_worker,
+                                initargs=(SHAPE_PREDICTOR_PATH,)) as executor:
+        downloaded = iter(download_queue.get, _END_OF_QUEUE)
+        progress = tqdm(desc="Downloading and Processing", unit="img")
+        for chunk, future in submit_bounded(executor, analyze_chunk_task, iter_chunks(downloaded, TASK_CHUNK_SIZE),
+                                            MAX_IN_FLIGHT_TASKS):
+            try:
+                rows = future.result()
+            except Exception as e:
+                rows = [{ID_COLUMN: item['id'], URL_COLUMN: item['url'], 'status': 'critical_error',
+                         'error_message': str(e)} for item in chunk]
+            for row in rows:
+                writer.write(row)
+                status_counts[row['status']] = status_counts.get(row['status'], 0) + 1
+            progress.update(len(rows))
+        progress.close()
+
+    producer.join()
+    downloader.close()
+    stats = downloader.throughput()
+    logging.info(f"Processing complete. {writer.rows_written} new results saved to {OUTPUT_CSV_PATH}")
+    if RESUME and writer.rows_written:
+        superseded = compact_output_csv(OUTPUT_CSV_PATH, path_column=ID_COLUMN)
+        if superseded:
+            logging.info(f"Dropped {superseded} earlier rows of retried downloads from {OUTPUT_CSV_PATH}.")
+    logging.info(f"Status summary:\n{pd.Series(status_counts, dtype=int).sort_values(ascending=False).to_string()}")
+    logging.info(f"Download throughput: {stats['files_per_second']:.1f} images/sec, "
+                 f"{stats['megabytes_per_second']:.2f} MB/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# scripts/5_run_analysis_service.py
+import os
+import logging
+from facial_feature_extractor.service import AnalysisService, AnalysisHTTPServer
+
+# --- Configuration ---
+# Address to listen on (keep it on localhost; the service has no authentication)
+HOST = '127.0.0.1'
+PORT = 8080
+# Path to the dlib shape predictor model
+SHAPE_PREDICTOR_PATH = 'models/shape_predictor_68_face_landmarks.dat'
+# Worker threads, each keeping a warm analyzer (the shape predictor is shared)
+NUM_WORKERS = max(1, os.cpu_count() or 1)
+# Requests are rejected with 503 when their predicted queueing delay exceeds this (None to never reject)
+LATENCY_TARGET_MS = 500.0
+# Maximum time a request may wait for its result before it is answered with 504
+REQUEST_TIMEOUT = 30.0
+# Decode larger images reduced to this many pixels (None for full resolution)
+LOAD_MAX_PIXELS = 12_000_000
+# Reject blurry, tiny, black or overexposed images before detection
+QUALITY_CHECK = True
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def main():
+    """Runs the analysis service until interrupted (POST /analyze, GET /health, GET /metrics)."""
+    if not os.path.exists(SHAPE_PREDICTOR_PATH):
+        logging.error(f"Shape predictor model not found: {SHAPE_PREDICTOR_PATH}")
+        return
+
+    config = {'quality_check': QUALITY_CHECK, 'load_max_pixels': LOAD_MAX_PIXELS,
+              'report_original_coordinates': True}
+    service = AnalysisService(SHAPE_PREDICTOR_PATH, config, num_workers=NUM_WORKERS,
+                              latency_target_ms=LATENCY_TARGET_MS)
+    service.start()
+    server = AnalysisHTTPServer((HOST, PORT), service, request_timeout=REQUEST_TIMEOUT)
+    logging.info(f"Listening on http://{HOST}:{PORT} (POST /analyze, GET /health, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down...")
+    finally:
+        server.server_close()
+        service.stop()
+        health = service.health()
+        logging.info(f"Served {health['requests_total']} requests ({health['requests_rejected']} rejected), "
+                     f"p99 latency {health['latency_p99_ms'] or 0:.1f} ms.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# scripts/benchmark_alignment.py
+import os
+import time
+import logging
+import numpy as np
+import cv2
+import dlib
+from facial_feature_extractor.utils import load_image
+from facial_feature_extractor.detection import detect_faces, get_best_face
+from facial_feature_extractor.landmarks import (get_landmarks, extract_landmark_points, align_face_chip,
+                                                align_face_chip_affine, load_shape_predictor)
+
+# --- Configuration ---
+# Directory containing the images to benchmark on
+IMAGE_DIRECTORY = "data/input_images"
+# Path to the dlib shape predictor model
+SHAPE_PREDICTOR_PATH = "models/shape_predictor_68_face_landmarks.dat"
+# Chip settings under test (the analyzer's 'align_target_size' and 'align_padding' defaults)
+ALIGN_TARGET_SIZE = 256
+ALIGN_PADDING = 0.25
+DETECT_UPSAMPLE = 1
+# Each alignment is repeated this many times and the fastest run is kept
+REPEATS = 5
+# Maximum number of images to benchmark
+MAX_IMAGES = 200
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def best_time(function, *args):
+    """Returns (fastest of REPEATS runs in seconds, result of the last run)."""
+    fastest, result = float('inf'), None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        fastest = min(fastest, time.perf_counter() - start)
+    return fastest, result
+
+
+def main():
+    """Compares dlib.get_face_chip with the OpenCV affine alignment (color and grayscale) on a directory of images."""
+    if not os.path.exists(IMAGE_DIRECTORY):
+        logging.error(f"Image directory not found: {IMAGE_DIRECTORY}")
+        return
+
+    image_paths = sorted(os.path.join(IMAGE_DIRECTORY, f) for f in os.listdir(IMAGE_DIRECTORY)
+                         if f.lower().endswith(('.png', '.jpg', '.jpeg')))[:MAX_IMAGES]
+    detector = dlib.get_frontal_face_detector()
+    predictor = load_shape_predictor(SHAPE_PREDICTOR_PATH)
+
+    timings = {'dlib': [], 'affine_color': [], 'affine_gray': []}
+    color_diffs, gray_diffs = [], []
+    for path in image_paths:
+        image = load_image(path)
+        if image is None:
+            continue
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        face_rect = get_best_face(detect_faces(gray, detector, DETECT_UPSAMPLE))
+        landmarks_obj = get_landmarks(gray, face_rect, predictor) if face_rect is not None else None
+        if landmarks_obj is None:
+            continue
+        points = extract_landmark_points(landmarks_obj)
+
+        dlib_time, dlib_chip = best_time(align_face_chip, image, landmarks_obj, ALIGN_TARGET_SIZE, ALIGN_PADDING)
+        # The affine timings include computing the transform from the landmark points
+        color_time, (color_chip, _) = best_time(align_face_chip_affine, image, points, ALIGN_TARGET_SIZE, ALIGN_PADDING)
+        gray_time, (gray_chip, _) = best_time(align_face_chip_affine, gray, points, ALIGN_TARGET_SIZE, ALIGN_PADDING)
+        if dlib_chip is None or color_chip is None or gray_chip is None:
+            continue
+        timings['dlib'].append(dlib_time)
+        timings['affine_color'].append(color_time)
+        timings['affine_gray'].append(gray_time)
+
+        # Pixel agreement with the dlib chip (in gray levels; the gray chip against dlib's chip converted to gray)
+        color_diff = np.abs(color_chip.astype(np.int16) - dlib_chip.astype(np.int16))
+        gray_diff = np.abs(gray_chip.astype(np.int16) - cv2.cvtColor(dlib_chip, cv2.COLOR_BGR2GRAY).astype(np.int16))
+        color_diffs.append((color_diff.mean(), np.percentile(color_diff, 99), color_diff.max()))
+        gray_diffs.append((gray_diff.mean(), np.percentile(gray_diff, 99), gray_diff.max()))
+
+    if not timings['dlib']:
+        logging.warning(f"No faces could be aligned in '{IMAGE_DIRECTORY}'.")
+        return
+
+    dlib_total = np.sum(timings['dlib'])
+    logging.info(f"Images: {len(timings['dlib'])}, chip size {ALIGN_TARGET_SIZE}, padding {ALIGN_PADDING}")
+    for name, values in timings.items():
+        logging.info(f"{name:<13} {np.mean(values) * 1000:7.3f} ms/face  "
+                     f"({dlib_total / np.sum(values):.2f}x the speed of dlib)")
+    for name, diffs in (('affine_color', color_diffs), ('affine_gray', gray_diffs)):
+        diffs = np.asarray(diffs)
+        logging.info(f"{name} vs dlib: mean abs diff {diffs[:, 0].mean():.3f}, "
+                     f"p99 {diffs[:, 1].mean():.1f}, max {diffs[:, 2].max():.0f} gray levels")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# scripts/benchmark_detection.py
+import os
+import time
+import logging
+import numpy as np
+import dlib
+from facial_feature_extractor.utils import load_image, RIGHT_EYE, LEFT_EYE
+from facial_feature_extractor.detection import detect_faces, get_best_face, choose_detection_scale
+from facial_feature_extractor.landmarks import get_landmarks, extract_landmark_points
+
+# --- Configuration ---
+# Directory containing the images to benchmark on
+IMAGE_DIRECTORY = "data/input_images"
+# Path to the dlib shape predictor model
+SHAPE_PREDICTOR_PATH = "models/shape_predictor_68_face_landmarks.dat"
+# Upsampling used by both detection modes
+DETECT_UPSAMPLE = 1
+# Multi-resolution settings under test
+DETECT_MAX_PIXELS = 1_000_000
+DETECT_MIN_FACE_SIZE = None
+# Maximum number of images to benchmark
+MAX_IMAGES = 200
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def locate(image, detector, predictor, scale):
+    """Detects the best face at the given detection scale and returns (seconds, landmarks)."""
+    start = time.perf_counter()
+    face_rect = get_best_face(detect_faces(image, detector, DETECT_UPSAMPLE, scale=scale))
+    landmarks_obj = get_landmarks(image, face_rect, predictor) if face_rect is not None else None
+    elapsed = time.perf_counter() - start
+    points = extract_landmark_points(landmarks_obj)
+    return elapsed, (np.asarray(points, dtype=np.float64) if points else None)
+
+
+def main():
+    """Compares full-resolution and downscaled detection on a directory of images."""
+    if not os.path.exists(IMAGE_DIRECTORY):
+        logging.error(f"Image directory not found: {IMAGE_DIRECTORY}")
+        return
+
+    image_paths = sorted(os.path.join(IMAGE_DIRECTORY, f) for f in os.listdir(IMAGE_DIRECTORY)
+                         if f.lower().endswith(('.png', '.jpg', '.jpeg')))[:MAX_IMAGES]
+    detector = dlib.get_frontal_face_detector()
+    predictor = dlib.shape_predictor(SHAPE_PREDICTOR_PATH)
+
+    speedups, deviations = [], []
+    full_total, reduced_total, missed = 0.0, 0.0, 0
+    for path in image_paths:
+        image = load_image(path)
+        if image is None:
+            continue
+        scale = choose_detection_scale(image.shape, DETECT_MAX_PIXELS, DETECT_MIN_FACE_SIZE, DETECT_UPSAMPLE)
+
+        full_time, full_points = locate(image, detector, predictor, 1.0)
+        reduced_time, reduced_points = locate(image, detector, predictor, scale)
+        full_total += full_time
+        reduced_total += reduced_time
+        speedups.append(full_time / reduced_time if reduced_time > 0 else np.nan)
+
+        if full_points is None:
+            continue
+        if reduced_points is None:
+            missed += 1
+            continue
+        # Mean landmark deviation, normalized by the distance between the eye centers
+        eye_dist = np.linalg.norm(full_points[RIGHT_EYE].mean(axis=0) - full_points[LEFT_EYE].mean(axis=0))
+        deviation = np.linalg.norm(full_points - reduced_points, axis=1).mean()
+        deviations.append((deviation, deviation / eye_dist if eye_dist > 0 else np.nan))
+
+    if not speedups:
+        logging.warning(f"No images could be loaded from '{IMAGE_DIRECTORY}'.")
+        return
+
+    deviations = np.asarray(deviations) if deviations else np.full((1, 2), np.nan)
+    logging.info(f"Images: {len(speedups)}")
+    logging.info(f"Full resolution: {full_total / len(speedups) * 1000:.1f} ms/image")
+    logging.info(f"Downscaled:      {reduced_total / len(speedups) * 1000:.1f} ms/image")
+    logging.info(f"Per-image speedup: median {np.nanmedian(speedups):.2f}x, "
+                 f"min {np.nanmin(speedups):.2f}x, max {np.nanmax(speedups):.2f}x")
+    logging.info(f"Landmark deviation: mean {np.nanmean(deviations[:, 0]):.2f}px, "
+                 f"max {np.nanmax(deviations[:, 0]):.2f}px, "
+                 f"mean {np.nanmean(deviations[:, 1]) * 100:.2f}% of inter-ocular distance")
+    logging.info(f"Faces found at full resolution but missed when downscaled: {missed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# scripts/benchmark_execution_modes.py
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from facial_feature_extractor.analysis import FaceAnalyzer, RESULT_PROFILE_FEATURES
+from facial_feature_extractor.batch import iter_image_paths, iter_chunks, submit_bounded
+from facial_feature_extractor.landmarks import load_shape_predictor
+
+# --- Configuration ---
+# Directory containing the images to benchmark on (scanned recursively)
+IMAGE_DIRECTORY = "data/input_images"
+# Path to the dlib shape predictor model
+SHAPE_PREDICTOR_PATH = "models/shape_predictor_68_face_landmarks.dat"
+# Execution modes to compare (see EXECUTION_MODE in 2_run_batch_processing.py)
+MODES = ('process', 'fork', 'thread')
+# Number of worker processes or threads
+NUM_WORKERS = max(1, os.cpu_count() - 1)
+# Number of images sent to a worker per task
+TASK_CHUNK_SIZE = 16
+# Maximum number of images to process per mode
+MAX_IMAGES = 500
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_worker_state = threading.local()
+
+
+def initialize_worker(predictor_path):
+    """Initializes the FaceAnalyzer in each worker process or thread."""
+    _worker_state.analyzer = FaceAnalyzer(shape_predictor_path=predictor_path,
+                                          config={'result_profile': RESULT_PROFILE_FEATURES})
+
+
+def process_chunk(image_paths):
+    """Analyzes a chunk of images and returns their statuses."""
+    return [_worker_state.analyzer.process_image(path)['status'] for path in image_paths]
+
+
+def read_memory_kb(pid, field):
+    """Returns a field (e.g. 'Pss' or 'Rss') of /proc/<pid>/smaps_rollup in kB, or None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def measure_memory_mb():
+    """
+    Returns the total PSS and RSS of this process and its child processes in MB.
+
+    PSS divides shared pages between the processes sharing them, so unlike RSS it shows how
+    much memory a model shared copy-on-write actually saves.
+    """
+    pids = [os.getpid()] + [child.pid for child in multiprocessing.active_children()]
+    totals = {}
+    for field in ('Pss', 'Rss'):
+        values = [read_memory_kb(pid, field) for pid in pids]
+        totals[field] = sum(values) / 1024 if all(v is not None for v in values) else None
+    return totals['Pss'], totals['Rss']
+
+
+def run_mode(mode, image_paths, results):
+    """Processes the images in one execution mode (in a fresh process) and stores its measurements."""
+    start = time.perf_counter()
+    if mode == 'thread':
+        executor = ThreadPoolExecutor(max_workers=NUM_WORKERS, initializer=initialize_worker,
+                                      initargs=(SHAPE_PREDICTOR_PATH,))
+    else:
+        mp_context = None
+        if mode == 'fork':
+            load_shape_predictor(SHAPE_PREDICTOR_PATH)
+            mp_context = multiprocessing.get_context('fork')
+        executor = ProcessPoolExecutor(max_workers=NUM_WORKERS, mp_context=mp_context, initializer=initialize_worker,
+                                       initargs=(SHAPE_PREDICTOR_PATH,))
+
+    first_result_time = None
+    statuses = []
+    with executor:
+        for _, future in submit_bounded(executor, process_chunk, iter_chunks(image_paths, TASK_CHUNK_SIZE),
+                                        NUM_WORKERS * 2):
+            statuses.extend(future.result())
+            if first_result_time is None:
+                first_result_time = time.perf_counter() - start
+        elapsed = time.perf_counter() - start
+        # Measured while the workers are still alive
+        pss_mb, rss_mb = measure_memory_mb()
+
+    results[mode] = {
+        'images': len(statuses),
+        'successes': sum(1 for status in statuses if status == 'success'),
+        'elapsed': elapsed,
+        'first_result': first_result_time,
+        'pss_mb': pss_mb,
+        'rss_mb': rss_mb,
+    }
+
+
+def main():
+    """Compares throughput and memory of the process, fork and thread execution modes."""
+    if not os.path.exists(IMAGE_DIRECTORY):
+        logging.error(f"Image directory not found: {IMAGE_DIRECTORY}")
+        return
+    image_paths = []
+    for path in iter_image_paths(IMAGE_DIRECTORY):
+        image_paths.append(path)
+        if len(image_paths) >= MAX_IMAGES:
+            break
+    if not image_paths:
+        logging.warning(f"No images found in '{IMAGE_DIRECTORY}'.")
+        return
+
+    logging.info(f"Benchmarking {len(image_paths)} images with {NUM_WORKERS} workers...")
+    # Each mode runs in a fresh process, so a model loaded by one mode cannot leak into the next
+    spawn = multiprocessing.get_context('spawn')
+    with spawn.Manager() as manager:
+        results = manager.dict()
+        for mode in MODES:
+            if mode == 'fork' and not hasattr(os, 'fork'):
+                logging.warning("Skipping 'fork' mode, which is not available on this platform.")
+                continue
+            runner = spawn.Process(target=run_mode, args=(mode, image_paths, results))
+            runner.start()
+            runner.join()
+            if mode not in results:
+                logging.error(f"Mode '{mode}' failed (exit code {runner.exitcode}).")
+                continue
+            r = results[mode]
+            memory = (f"PSS {r['pss_mb']:.0f} MB, RSS {r['rss_mb']:.0f} MB" if r['pss_mb'] is not None
+                      else "memory not measurable on this platform")
+            logging.info(f"{mode:<8} {r['images'] / r['elapsed']:7.1f} images/s  "
+                         f"first result after {r['first_result']:.2f}s  {memory}  "
+                         f"({r['successes']}/{r['images']} faces found)")
+
+
+if __name__ == "__main__":
+    main()
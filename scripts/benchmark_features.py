@@ -0,0 +1,142 @@
+# scripts/benchmark_features.py
+import math
+import time
+import logging
+import numpy as np
+import pandas as pd
+from facial_feature_extractor.utils import calculate_distance
+from facial_feature_extractor.features import (calculate_features, calculate_features_batch, ALL_FEATURE_NAMES,
+                                               JAW_RIGHT_END, JAW_LEFT_END, NOSE_BRIDGE_TOP, CHIN_TIP, NOSE_TIP,
+                                               MOUTH_CORNER_RIGHT, MOUTH_CORNER_LEFT, RIGHT_EYE_INNER_CORNER,
+                                               LEFT_EYE_INNER_CORNER, NOSTRIL_RIGHT, NOSTRIL_LEFT, LIP_TOP_OUTER,
+                                               LIP_BOTTOM_OUTER, RIGHT_EYEBROW_INNER_END, LEFT_EYEBROW_INNER_END)
+
+# --- Configuration ---
+# Number of synthetic landmark sets to benchmark on
+NUM_FACES = 20000
+# Image size used to draw the synthetic landmark coordinates
+IMAGE_SIZE = 256
+RANDOM_SEED = 0
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def reference_all_features(landmarks: list[tuple[int, int]]) -> dict:
+    """
+    Calculates all geometric features of one face with plain scalar arithmetic. This is the
+    original hand-wired implementation, kept as the reference the feature registry is checked against.
+
+    Args:
+        landmarks (list[tuple[int, int]]): A list of 68 (x,y) tuples for facial landmarks.
+
+    Returns:
+        dict: A dictionary where keys are feature names and values are the calculated feature values.
+    """
+    features = {name: np.nan for name in ALL_FEATURE_NAMES}
+    if not landmarks or len(landmarks) != 68:
+        return features
+
+    try:
+        # --- Basic Distances ---
+        features['face_width_max_jaw'] = calculate_distance(landmarks[JAW_RIGHT_END], landmarks[JAW_LEFT_END])
+        features['face_height_nose_bridge_to_chin'] = abs(landmarks[NOSE_BRIDGE_TOP][1] - landmarks[CHIN_TIP][1])
+        features['mouth_width_corners'] = calculate_distance(landmarks[MOUTH_CORNER_RIGHT],
+                                                             landmarks[MOUTH_CORNER_LEFT])
+        features['inter_ocular_distance_inner'] = calculate_distance(landmarks[RIGHT_EYE_INNER_CORNER],
+                                                                     landmarks[LEFT_EYE_INNER_CORNER])
+        features['nose_length'] = calculate_distance(landmarks[NOSE_BRIDGE_TOP], landmarks[NOSE_TIP])
+        features['nose_width_nostrils'] = calculate_distance(landmarks[NOSTRIL_RIGHT], landmarks[NOSTRIL_LEFT])
+
+        # --- Eye Features (EAR) ---
+        re_outer, re_inner = landmarks[36], landmarks[39]
+        le_outer, le_inner = landmarks[45], landmarks[42]
+
+        re_p2, re_p6 = landmarks[37], landmarks[41]
+        re_p3, re_p5 = landmarks[38], landmarks[40]
+        re_ear_num = calculate_distance(re_p2, re_p6) + calculate_distance(re_p3, re_p5)
+        re_ear_den = 2.0 * calculate_distance(re_outer, re_inner)
+        features['eye_aspect_ratio_right'] = re_ear_num / re_ear_den if re_ear_den > 0 else np.nan
+
+        le_p2, le_p6 = landmarks[43], landmarks[47]
+        le_p3, le_p5 = landmarks[44], landmarks[46]
+        le_ear_num = calculate_distance(le_p2, le_p6) + calculate_distance(le_p3, le_p5)
+        le_ear_den = 2.0 * calculate_distance(le_outer, le_inner)
+        features['eye_aspect_ratio_left'] = le_ear_num / le_ear_den if le_ear_den > 0 else np.nan
+
+        if pd.notna(features['eye_aspect_ratio_right']) and pd.notna(features['eye_aspect_ratio_left']):
+            features['avg_ear'] = (features['eye_aspect_ratio_right'] + features['eye_aspect_ratio_left']) / 2.0
+
+        # --- Emotion-related Cues ---
+        features['tension_eyebrow_gap_horizontal_dist'] = abs(
+            landmarks[RIGHT_EYEBROW_INNER_END][0] - landmarks[LEFT_EYEBROW_INNER_END][0])
+        features['smile_mouth_width_corners_dist'] = features['mouth_width_corners']
+
+        mouth_center_y = (landmarks[LIP_TOP_OUTER][1] + landmarks[LIP_BOTTOM_OUTER][1]) / 2.0
+        left_corner_y = landmarks[MOUTH_CORNER_LEFT][1]
+        right_corner_y = landmarks[MOUTH_CORNER_RIGHT][1]
+        features['smile_lip_corner_pull_up_avg_y'] = mouth_center_y - (left_corner_y + right_corner_y) / 2.0
+
+        # ... and so on for all other features. The full calculation logic from your
+        # original `step3_feature_calculations.py` would be placed here.
+        # This is a truncated example.
+
+    except (IndexError, TypeError, ZeroDivisionError) as e:
+        print(f"Error during feature calculation: {e}")
+        # Return a dictionary of NaNs on error
+        return {name: np.nan for name in ALL_FEATURE_NAMES}
+
+    # Final cleanup of values
+    for key, value in features.items():
+        if isinstance(value, (float, int)) and (math.isinf(value) or math.isnan(value)):
+            features[key] = np.nan
+
+    return features
+
+
+def make_synthetic_landmarks(num_faces: int, image_size: int, seed: int) -> np.ndarray:
+    """Creates an (N, 68, 2) int array of random landmark coordinates, including degenerate rows."""
+    rng = np.random.default_rng(seed)
+    landmarks = rng.integers(0, image_size, size=(num_faces, 68, 2))
+    # Collapse both eyes of a few faces to a single point to exercise the zero-denominator path
+    landmarks[::97, 36:48, :] = landmarks[::97, 36:37, :]
+    return landmarks
+
+
+def main():
+    """
+    Compares the scalar reference, the single-face registry path and the vectorized batch path
+    for speed and numerical agreement.
+    """
+    landmarks = make_synthetic_landmarks(NUM_FACES, IMAGE_SIZE, RANDOM_SEED)
+    landmark_lists = [[(int(x), int(y)) for x, y in face] for face in landmarks]
+
+    start = time.perf_counter()
+    scalar_df = pd.DataFrame([reference_all_features(face) for face in landmark_lists], columns=ALL_FEATURE_NAMES)
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single_df = pd.DataFrame([calculate_features(face) for face in landmark_lists], columns=ALL_FEATURE_NAMES)
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_df = calculate_features_batch(landmarks)
+    batch_time = time.perf_counter() - start
+
+    scalar_values = scalar_df.to_numpy(dtype=np.float64)
+    batch_values = batch_df.to_numpy(dtype=np.float64)
+    single_values = single_df.to_numpy(dtype=np.float64)
+    matches = np.allclose(scalar_values, batch_values, rtol=1e-12, atol=0.0, equal_nan=True) and \
+        np.allclose(scalar_values, single_values, rtol=1e-12, atol=0.0, equal_nan=True)
+    max_abs_diff = np.nanmax(np.abs(scalar_values - batch_values)) if np.isfinite(scalar_values).any() else 0.0
+
+    logging.info(f"Faces: {NUM_FACES}")
+    logging.info(f"Scalar reference: {scalar_time:.3f}s ({NUM_FACES / scalar_time:,.0f} faces/sec)")
+    logging.info(f"Single-face path: {single_time:.3f}s ({NUM_FACES / single_time:,.0f} faces/sec)")
+    logging.info(f"Vectorized path:  {batch_time:.3f}s ({NUM_FACES / batch_time:,.0f} faces/sec)")
+    logging.info(f"Speedup: {scalar_time / batch_time:.1f}x")
+    logging.info(f"Results match: {matches} (max abs diff {max_abs_diff:.3e})")
+
+
+if __name__ == "__main__":
+    main()
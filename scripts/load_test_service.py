@@ -0,0 +1,108 @@
+# scripts/load_test_service.py
+import sys
+import time
+import logging
+import threading
+import requests
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from facial_feature_extractor.batch import iter_image_paths
+from facial_feature_extractor.utils import read_image_bytes
+
+# --- Configuration ---
+# URL of a running analysis service (see 5_run_analysis_service.py)
+SERVICE_URL = 'http://127.0.0.1:8080'
+# Directory containing the images to send (scanned recursively, reused in a cycle)
+IMAGE_DIRECTORY = 'data/input_images'
+# Number of images loaded into memory before the test
+MAX_IMAGES = 200
+# Number of concurrent clients, and the total number of requests they send
+CONCURRENCY = 8
+NUM_REQUESTS = 1000
+# The test fails (exit code 1) when the client-side p99 latency exceeds this
+LATENCY_TARGET_MS = 500.0
+REQUEST_TIMEOUT = 60
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_client_state = threading.local()
+
+
+def send_request(image_data, image_id):
+    """Posts one image and returns (HTTP status, client latency in ms, response JSON or None)."""
+    if not hasattr(_client_state, 'session'):
+        _client_state.session = requests.Session()
+    start = time.perf_counter()
+    try:
+        response = _client_state.session.post(f"{SERVICE_URL}/analyze", params={'id': image_id}, data=image_data,
+                                              headers={'Content-Type': 'application/octet-stream'},
+                                              timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Request for {image_id} failed: {e}")
+        return None, (time.perf_counter() - start) * 1000, None
+    latency_ms = (time.perf_counter() - start) * 1000
+    return response.status_code, latency_ms, response.json() if response.status_code == 200 else None
+
+
+def format_percentiles(values):
+    """Formats p50/p95/p99/max of a list of milliseconds."""
+    if not values:
+        return "n/a"
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return f"p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, max {max(values):.1f} ms"
+
+
+def main():
+    """Sends NUM_REQUESTS images from CONCURRENCY clients and checks the p99 latency against the target."""
+    images = []
+    for path in iter_image_paths(IMAGE_DIRECTORY):
+        image_data = read_image_bytes(path)
+        if image_data:
+            images.append((path, image_data))
+        if len(images) >= MAX_IMAGES:
+            break
+    if not images:
+        logging.error(f"No images found in '{IMAGE_DIRECTORY}'.")
+        sys.exit(2)
+    try:
+        requests.get(f"{SERVICE_URL}/health", timeout=5).raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Service not reachable at {SERVICE_URL}: {e}")
+        sys.exit(2)
+
+    logging.info(f"Sending {NUM_REQUESTS} requests from {CONCURRENCY} clients ({len(images)} distinct images)...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        futures = [executor.submit(send_request, images[i % len(images)][1], images[i % len(images)][0])
+                   for i in range(NUM_REQUESTS)]
+        outcomes = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    http_counts = {}
+    for code, _, _ in outcomes:
+        http_counts[code] = http_counts.get(code, 0) + 1
+    answered = [(latency, body) for code, latency, body in outcomes if code == 200]
+    client_latencies = [latency for latency, _ in answered]
+    server_latencies = [body['latency_ms'] for _, body in answered]
+    queue_times = [body['queue_ms'] for _, body in answered]
+
+    logging.info(f"Throughput: {len(answered) / elapsed:.1f} answered requests/sec over {elapsed:.1f}s")
+    logging.info(f"HTTP status counts: {http_counts}")
+    logging.info(f"Client latency: {format_percentiles(client_latencies)}")
+    logging.info(f"Server latency: {format_percentiles(server_latencies)}")
+    logging.info(f"Queue time:     {format_percentiles(queue_times)}")
+    logging.info(f"Service health: {requests.get(f'{SERVICE_URL}/health', timeout=5).json()}")
+
+    if not client_latencies:
+        logging.error("No request was answered.")
+        sys.exit(1)
+    p99 = np.percentile(client_latencies, 99)
+    if p99 > LATENCY_TARGET_MS:
+        logging.error(f"p99 latency {p99:.1f} ms exceeds the target of {LATENCY_TARGET_MS:.1f} ms.")
+        sys.exit(1)
+    logging.info(f"p99 latency {p99:.1f} ms is within the target of {LATENCY_TARGET_MS:.1f} ms.")
+
+
+if __name__ == "__main__":
+    main()
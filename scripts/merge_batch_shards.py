@@ -0,0 +1,72 @@
+# scripts/merge_batch_shards.py
+import os
+import argparse
+import logging
+from facial_feature_extractor.batch import (iter_image_paths, iter_manifest_paths, shard_key, shard_path,
+                                            merge_shard_outputs)
+
+# --- Configuration ---
+# Must match the settings of the sharded 2_run_batch_processing.py runs
+IMAGE_DIRECTORY = "data/input_images"
+INPUT_MANIFEST_PATH = None
+OUTPUT_CSV_PATH = "data/facial_features_output.csv"
+# Overridable with --num-shards or the FFE_NUM_SHARDS environment variable
+NUM_SHARDS = 4
+# Check that every input image appears in the merged output (set to False to only check for
+# duplicates and misplaced images, e.g. when the input has changed since the run)
+CHECK_COMPLETENESS = True
+# Number of offending images listed per problem
+MAX_EXAMPLES = 10
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def log_problem(description, entries):
+    """Logs the count and the first few entries of one kind of validation problem."""
+    if entries:
+        examples = '\n'.join(f"  {entry}" for entry in entries[:MAX_EXAMPLES])
+        logging.error(f"{len(entries)} {description}:\n{examples}")
+
+
+def parse_args():
+    """Parses the override of NUM_SHARDS (flag, then environment, then the constant)."""
+    parser = argparse.ArgumentParser(description="Merges and validates the shard outputs of a multi-node batch run.")
+    parser.add_argument('--num-shards', type=int, default=int(os.environ.get('FFE_NUM_SHARDS', NUM_SHARDS)),
+                        help="Number of shards of the run (default: FFE_NUM_SHARDS or NUM_SHARDS)")
+    return parser.parse_args()
+
+
+def main(num_shards=NUM_SHARDS):
+    """Merges the per-shard output CSVs into OUTPUT_CSV_PATH, if every image appears exactly once."""
+    root = None if INPUT_MANIFEST_PATH else IMAGE_DIRECTORY
+    expected_keys = None
+    if CHECK_COMPLETENESS:
+        source = INPUT_MANIFEST_PATH or IMAGE_DIRECTORY
+        if not os.path.exists(source):
+            logging.error(f"Input not found: {source}")
+            return
+        image_paths = iter_manifest_paths(INPUT_MANIFEST_PATH) if INPUT_MANIFEST_PATH \
+            else iter_image_paths(IMAGE_DIRECTORY)
+        expected_keys = {shard_key(path, root) for path in image_paths}
+        logging.info(f"Expecting {len(expected_keys)} images from '{source}'.")
+
+    logging.info(f"Merging {num_shards} shards of {OUTPUT_CSV_PATH} "
+                 f"({shard_path(OUTPUT_CSV_PATH, num_shards, 0)}, ...)")
+    report = merge_shard_outputs(OUTPUT_CSV_PATH, num_shards, expected_keys=expected_keys, root=root)
+
+    log_problem("shard outputs are missing", report['missing_shards'])
+    log_problem("shard outputs have different columns", report['column_mismatches'])
+    log_problem("images have more than one final result", report['duplicates'])
+    log_problem("images are in the wrong shard (image, found in, expected in)", report['misplaced'])
+    log_problem("input images are missing from all shards", report['missing'])
+    if not report['valid']:
+        logging.error("Merge failed validation; no merged output was written.")
+        return
+    logging.info(f"Merged {report['rows']} rows into {OUTPUT_CSV_PATH}; every image appears exactly once.")
+    if report['superseded']:
+        logging.info(f"Dropped {report['superseded']} earlier rows of images retried by a resumed run.")
+
+
+if __name__ == "__main__":
+    main(parse_args().num_shards)
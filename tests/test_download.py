@@ -0,0 +1,114 @@
+# tests/test_download.py
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from facial_feature_extractor.download import ImageDownloader
+
+IMAGE_BODY = b'\xff\xd8\xff' + bytes(range(256)) * 64
+ETAG = '"v1"'
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Serves IMAGE_BODY with scripted failures, counting the requests per path."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            hits = server.hits[self.path]
+
+        if self.path == '/flaky.jpg' and hits <= 2:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/etag.jpg' and self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+        if self.path == '/missing.jpg':
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(IMAGE_BODY)))
+        self.send_header('ETag', ETAG)
+        self.end_headers()
+        if self.path == '/truncated.jpg':
+            # Promise the whole body but close the connection halfway through
+            self.wfile.write(IMAGE_BODY[:len(IMAGE_BODY) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(IMAGE_BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ScriptedHandler)
+    httpd.hits = {}
+    httpd.lock = threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def downloader(tmp_path):
+    downloader = ImageDownloader(str(tmp_path), timeout=5, max_retries=3, backoff_base=0.01, backoff_max=0.02)
+    yield downloader
+    downloader.close()
+
+
+def test_download_streams_to_file(server, downloader, tmp_path):
+    _, base_url = server
+    result = downloader.download(f"{base_url}/ok.jpg", 'img1')
+    assert result['error'] is None
+    assert result['image_filepath'] == os.path.join(str(tmp_path), 'img1.jpg')
+    with open(result['image_filepath'], 'rb') as f:
+        assert f.read() == IMAGE_BODY
+    assert result['bytes'] == len(IMAGE_BODY)
+    assert result['etag'] == ETAG
+
+
+def test_retryable_errors_are_retried(server, downloader):
+    httpd, base_url = server
+    result = downloader.download(f"{base_url}/flaky.jpg", 'flaky')
+    assert result['error'] is None
+    assert httpd.hits['/flaky.jpg'] == 3
+
+
+def test_client_errors_are_not_retried(server, downloader, tmp_path):
+    httpd, base_url = server
+    result = downloader.download(f"{base_url}/missing.jpg", 'missing')
+    assert result['image_filepath'] is None
+    assert '404' in result['error']
+    assert httpd.hits['/missing.jpg'] == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_not_modified_writes_nothing(server, downloader, tmp_path):
+    _, base_url = server
+    result = downloader.download(f"{base_url}/etag.jpg", 'etag', validators={'etag': ETAG})
+    assert result['not_modified']
+    assert result['image_filepath'] is None
+    assert result['error'] is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_truncated_download_fails_without_leftovers(server, downloader, tmp_path):
+    httpd, base_url = server
+    result = downloader.download(f"{base_url}/truncated.jpg", 'truncated')
+    assert result['image_filepath'] is None
+    assert result['error']
+    assert httpd.hits['/truncated.jpg'] == downloader.max_retries + 1
+    # Neither the image nor its partial '.part' file is left behind
+    assert os.listdir(tmp_path) == []